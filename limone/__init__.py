@@ -1,6 +1,19 @@
+import bisect
+import codecs
+import collections
 import colander
+import datetime
+import decimal
+import keyword
+import re
 import sys
-import venusian
+import weakref
+
+_ = colander._ # XXX private colander api
+
+
+TypeCacheInfo = collections.namedtuple(
+    'TypeCacheInfo', 'hits misses evictions maxsize currsize live')
 
 
 class Registry(object):
@@ -8,9 +21,65 @@ class Registry(object):
     Content type registry.
     """
     _finder_loader = None
+    _stats = None
 
-    def __init__(self):
+    def __init__(self, max_cached_types=128):
         self._types = {}
+        self._lazy_types = {}
+        self.max_cached_types = max_cached_types
+        self._cached_types = weakref.WeakValueDictionary()
+        self._recent_types = collections.OrderedDict()
+        self._type_cache_stats = [0, 0, 0] # hits, misses, evictions
+
+    def make_content_type(self, schema, name, module=None, bases=(object,),
+                          **kw):
+        """
+        Like `limone.make_content_type`, but returns a content type made
+        earlier if there is one with a structurally identical schema and the
+        same arguments, rather than generating a new one.
+
+        The `max_cached_types` most recently requested content types are kept
+        alive by the registry.  Older ones are kept only as long as something
+        else, such as one of their instances, refers to them.
+        """
+        if isinstance(schema, type):
+            schema = schema()
+        # Bases, metaclasses and property factories are compared by identity,
+        # since what they do can't be told from their contents.  They are
+        # kept alive by the content types using them.
+        key = (_fingerprint(schema), name, module,
+               tuple([id(base) for base in bases]),
+               _items_key(kw, _identity_options),
+               tuple([(option, id(kw[option])) for option in _identity_options
+                      if option in kw]))
+        stats = self._type_cache_stats
+        content_type = self._cached_types.get(key)
+        if content_type is None:
+            stats[1] += 1
+            content_type = make_content_type(schema, name, module, bases, **kw)
+            self._cached_types[key] = content_type
+        else:
+            stats[0] += 1
+
+        recent = self._recent_types
+        recent.pop(key, None)
+        recent[key] = content_type
+        while len(recent) > self.max_cached_types:
+            recent.popitem(last=False)
+            stats[2] += 1
+
+        return content_type
+
+    def type_cache_info(self):
+        """
+        Returns a `TypeCacheInfo` with the number of hits, misses and
+        evictions of the cache used by `make_content_type`, its maximum and
+        current size, and the number of cached content types which are still
+        alive, including those which have been evicted.
+        """
+        hits, misses, evictions = self._type_cache_stats
+        return TypeCacheInfo(hits, misses, evictions, self.max_cached_types,
+                             len(self._recent_types), len(self._cached_types))
 
     def register_content_type(self, content_type):
         """
@@ -20,18 +89,98 @@ class Registry(object):
         if self._finder_loader is not None:
             content_type._original__module__ = content_type.__module__
             content_type.__module__ = self._finder_loader.module
+        if self._stats is not None:
+            self._stats.instrument(content_type)
+
+    def enable_stats(self, exporter=None):
+        """
+        Start collecting statistics for the content types registered with
+        this registry, including ones registered later: the number of
+        instances constructed, the time taken to construct them and the
+        number of constructions which fail validation and, for each
+        attribute, the number of assignments, the time taken to validate them
+        and the number which fail validation.  Collecting statistics replaces
+        the constructors and attribute descriptors of the content types,
+        which are put back by `disable_stats`, so there is no cost when
+        statistics aren't being collected.
+
+        `exporter`, if given, is called by `export_stats` with the
+        statistics, eg to send them to a metrics system.
+        """
+        if self._stats is not None:
+            self._stats.exporter = exporter
+            return
+        from limone.stats import Stats
+        self._stats = Stats(exporter)
+        for content_type in self._types.values():
+            self._stats.instrument(content_type)
+
+    def disable_stats(self):
+        """
+        Stop collecting statistics and discard those collected so far.
+        """
+        if self._stats is not None:
+            for content_type in self._types.values():
+                self._stats.uninstrument(content_type)
+            del self._stats
+
+    def stats(self):
+        """
+        Returns the statistics collected since they were enabled or last
+        exported, as a dictionary keyed by content type name, or `None` if
+        statistics aren't being collected.  Each value is a dictionary with
+        `constructions`, `construction_time` and `invalid` keys, and a
+        `fields` dictionary with `assignments`, `validation_time` and
+        `invalid` for each attribute.  Times are in seconds.
+        """
+        if self._stats is not None:
+            return self._stats.snapshot()
+
+    def export_stats(self):
+        """
+        Passes the statistics returned by `stats` to the exporter given to
+        `enable_stats`, then starts counting again from zero.  Returns the
+        statistics.
+        """
+        stats = self._stats
+        if stats is None:
+            return None
+        snapshot = stats.snapshot()
+        stats.reset()
+        if stats.exporter is not None:
+            stats.exporter(snapshot)
+        return snapshot
+
+    def _register_lazy(self, name, module, attr):
+        """
+        Register the content type which can be imported as `attr` from
+        `module` the first time it is looked up.
+        """
+        self._lazy_types[name] = (module, attr)
+
+    def _resolve_lazy(self, name):
+        module, attr = self._lazy_types.pop(name)
+        __import__(module)
+        content_type = getattr(sys.modules[module], attr)
+        self.register_content_type(content_type)
+        return content_type
 
     def get_content_type(self, name):
         """
         Retrieve a content type by name.
         """
-        return self._types.get(name)
+        content_type = self._types.get(name)
+        if content_type is None and name in self._lazy_types:
+            content_type = self._resolve_lazy(name)
+        return content_type
 
     def get_content_types(self):
         """
         Retrieve a tuple containing all of the content types registered with
         this instance.
         """
+        for name in list(self._lazy_types):
+            self._resolve_lazy(name)
         return tuple(self._types.values())
 
     def hook_import(self, module='__limone__'):
@@ -55,9 +204,17 @@ class Registry(object):
                 ct.__module__ = ct._original__module__
                 del ct._original__module__
 
-    def scan(self, module):
-        scanner = venusian.Scanner(limone=self)
-        scanner.scan(module, categories=('limone',))
+    def scan(self, module, cache=None):
+        """
+        Register the content types defined in `module`, or in any of its
+        submodules if it is a package.  If `cache` is given, it is the path of
+        a manifest recording which content types were found, which is used
+        by later scans for as long as none of the package's source files
+        change.  Content types are then registered without importing the
+        modules defining them until they are looked up.
+        """
+        from limone.scan import scan
+        scan(self, module, cache)
 
 
 class _LeafNodeProperty(object):
@@ -68,31 +225,248 @@ class _LeafNodeProperty(object):
         name = node.name
         assert name
         self._attr = '.' + name
+        self._slot = None
+        self._check = _leaf_validator(node)
+        self._track = getattr(content, '_track_changes', False)
+
+    def __getstate__(self):
+        # The leaf validator is a closure, which can't be pickled.
+        state = self.__dict__.copy()
+        del state['_check']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._check = _leaf_validator(self.node)
 
     def __get__(self, obj, cls=None):
-        return obj.__dict__[self._attr]
+        slot = self._slot
+        if slot is None:
+            return obj.__dict__[self._attr]
+        return slot.__get__(obj, cls)
 
     def __set__(self, obj, value):
         value = self._validate(obj.__content__, value)
         setattr(obj, self._attr, value)
+        if self._track:
+            _touch(obj, self.node.name)
+        return value
+
+    def _pack(self, value):
+        """
+        Returns `value`, a value of this property, as a plain Python object
+        for pickling.
+        """
+        return value
+
+    def _restore(self, content, value):
+        """
+        Returns the value of this property for something packed with `_pack`,
+        without validating it.
+        """
         return value
 
     def _validate(self, content, value):
+        check = self._check
+        if check is not None:
+            return check(value)
+
         # serialize/deserialize forces colander to validate
         # also will replace null values with defaults
         node = self.node
         return node.deserialize(node.serialize(value))
 
 
-class _MappingNodeProperty(_LeafNodeProperty):
+def _leaf_validator(node):
+    """
+    Returns a function which validates an appstruct value for a leaf node
+    without round tripping it through the node's serialization, or `None` if
+    the node's type is not one we know how to validate directly.  The returned
+    function has the same semantics as `node.deserialize(node.serialize(v))`:
+    defaults are substituted for null values, missing values are substituted
+    for empty ones and the node's validator is run on anything else.
+    """
+    coerce = _leaf_coercers.get(type(node.typ))
+    if coerce is None:
+        return None
+
+    null = colander.null
+    required = colander.required
+    deferred = colander.deferred
+
+    def validate(value):
+        # Attributes of the node are looked up on each call since schemas may
+        # be altered after content types are generated from them.
+        if value is null:
+            value = node.default
+            if isinstance(value, deferred):
+                value = null
+        if value is not null:
+            value = coerce(node, value)
+        preparer = node.preparer
+        if preparer is not None:
+            value = preparer(value)
+        if value is null:
+            value = node.missing
+            if value is required or isinstance(value, deferred):
+                raise colander.Invalid(node, _('Required'))
+            return value
+        validator = node.validator
+        if validator is not None and not isinstance(validator, deferred):
+            validator(node, value)
+        return value
+
+    return validate
+
+
+def _coerce_number(node, value):
+    try:
+        return node.typ.num(value)
+    except Exception:
+        raise colander.Invalid(node, _('"${val}" is not a number',
+                                       mapping={'val': value}))
+
+
+def _coerce_string(node, value):
+    encoding = node.typ.encoding
+    try:
+        if isinstance(value, unicode):
+            if encoding:
+                value.encode(encoding)
+        elif encoding:
+            value = unicode(value, encoding)
+        else:
+            value = unicode(value)
+    except Exception, e:
+        raise colander.Invalid(node, _('"${val} cannot be serialized: ${err}',
+                                       mapping={'val': value, 'err': e}))
+    if not value:
+        return colander.null
+    return value
+
+
+def _coerce_boolean(node, value):
+    return bool(value)
+
+
+def _coerce_date(node, value):
+    if isinstance(value, datetime.datetime):
+        return value.date()
+    if not isinstance(value, datetime.date):
+        raise colander.Invalid(node, _('"${val}" is not a date object',
+                                       mapping={'val': value}))
+    if type(value) is not datetime.date:
+        value = datetime.date(value.year, value.month, value.day)
+    return value
+
+
+def _coerce_datetime(node, value):
+    if type(value) is datetime.date:
+        value = datetime.datetime.combine(value, datetime.time())
+    if not isinstance(value, datetime.datetime):
+        raise colander.Invalid(node, _('"${val}" is not a datetime object',
+                                       mapping={'val': value}))
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=node.typ.default_tzinfo)
+    return value
+
+
+# Keyed by exact type, since subclasses may override serialization.
+_leaf_coercers = {
+    colander.Integer: _coerce_number,
+    colander.Float: _coerce_number,
+    colander.Decimal: _coerce_number,
+    colander.String: _coerce_string,
+    colander.Boolean: _coerce_boolean,
+    colander.Date: _coerce_date,
+    colander.DateTime: _coerce_datetime,
+}
+
+
+class _NestedNodeProperty(_LeafNodeProperty):
+    """
+    Base class for properties whose values are nested nodes.  If `_lazy` is
+    set, values are stored as they are passed in and only validated, and
+    turned into nodes, when they are first accessed.
+    """
+    _lazy = False
+
+    def __get__(self, obj, cls=None):
+        slot = self._slot
+        if slot is None:
+            value = obj.__dict__[self._attr]
+        else:
+            value = slot.__get__(obj, cls)
+        if type(value) is _Unvalidated:
+            value = self._validate(obj.__content__, value.appstruct)
+            setattr(obj, self._attr, value)
+            if self._track:
+                value._parent_link = (obj, self.node.name)
+        return value
+
+    def __set__(self, obj, value):
+        if not self._track:
+            if self._lazy:
+                setattr(obj, self._attr, _Unvalidated(value))
+                return value
+            return super(_NestedNodeProperty, self).__set__(obj, value)
+
+        old = self._stored(obj)
+        if self._lazy:
+            setattr(obj, self._attr, _Unvalidated(value))
+            _touch(obj, self.node.name)
+        else:
+            value = super(_NestedNodeProperty, self).__set__(obj, value)
+            value._parent_link = (obj, self.node.name)
+        if old is not None:
+            # Changes to the replaced node no longer affect `obj`.
+            old._parent_link = None
+        return value
+
+    def _stored(self, obj):
+        # Returns the node currently stored for `obj`, if there is one.
+        try:
+            if self._slot is None:
+                value = obj.__dict__[self._attr]
+            else:
+                value = self._slot.__get__(obj, type(obj))
+        except (KeyError, AttributeError):
+            return None
+        if type(value) is _Unvalidated:
+            return None
+        return value
+
+
+class _Unvalidated(object):
+    """
+    Holds the value of a lazy property until it is accessed.
+    """
+    __slots__ = ('appstruct',)
+
+    def __init__(self, appstruct):
+        self.appstruct = appstruct
+
+    def __reduce__(self):
+        return _Unvalidated, (self.appstruct,)
+
+
+class _MappingNodeProperty(_NestedNodeProperty):
 
     def _validate(self, content, value):
         if value is colander.null:
             value = {}
         return content._MappingNode(content, self.node, value)
 
+    def _pack(self, value):
+        return value._pack()
+
+    def _restore(self, content, value):
+        return content._MappingNode._restore(content, self.node, value)
+
 
 class _MappingNode(object):
+    _tracked_cache = None
+    _parent_link = None
 
     def __init__(self, content, schema, appstruct):
         self.__dict__['__content__'] = content
@@ -100,10 +474,9 @@ class _MappingNode(object):
         props = {}
         error = None
         data = appstruct.copy()
-        property_factory = content._property_factory
         for i, node in enumerate(schema):
             name = node.name
-            props[name] = prop = property_factory(content, node)
+            props[name] = prop = _nested_property(content, node)
             try:
                 prop.__set__(self, data.pop(name, colander.null))
             except colander.Invalid, e:
@@ -122,7 +495,11 @@ class _MappingNode(object):
         self.__dict__['_props'] = props
 
     def __getattr__(self, name):
-        prop = self._props.get(name, None)
+        props = self.__dict__.get('_props')
+        if props is None:
+            # Not initialized yet, eg while being unpickled.
+            raise AttributeError(name)
+        prop = props.get(name, None)
         if prop is None:
             raise AttributeError(name)
         return prop.__get__(self)
@@ -135,29 +512,106 @@ class _MappingNode(object):
                 return prop.__set__(self, value)
         return super(_MappingNode, self).__setattr__(name, value)
 
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop('_tracked_cache', None)
+        return state
+
+    def _pack(self):
+        props = self._props
+        return tuple([props[node.name]._pack(props[node.name].__get__(self))
+                      for node in self.__schema__.children])
+
+    @classmethod
+    def _restore(cls, content, schema, packed):
+        self = cls.__new__(cls)
+        data = self.__dict__
+        data['__content__'] = content
+        track = content._track_changes
+        props = {}
+        for node, value in zip(schema.children, packed):
+            name = node.name
+            props[name] = prop = _nested_property(content, node)
+            data[prop._attr] = value = prop._restore(content, value)
+            if track:
+                _link(self, name, value)
+        data['__schema__'] = schema
+        data['_props'] = props
+        return self
+
+    def _copy(self, content):
+        """
+        Returns a copy of the node for the content object `content`, with
+        copies of the nodes nested in it.
+        """
+        copy = type(self).__new__(type(self))
+        data = copy.__dict__
+        data.update(self.__dict__)
+        for name in ('_tracked_cache', '_parent_link'):
+            data.pop(name, None)
+        data['__content__'] = content
+        _copy_values(self, copy, self._props.values(), content)
+        return copy
+
     def appstruct(self):
-        return dict([(name, _appstruct_node(prop.__get__(self))) for
+        if self.__content__._track_changes:
+            return _copied(_cached(self, 0, type(self)._appstruct))
+        return self._appstruct()
+
+    def _appstruct(self):
+        return dict([(name, _shared_appstruct(prop.__get__(self))) for
                      name, prop in self._props.items()])
 
+    def _cstruct(self):
+        return _cached(self, 1, _serialize_mapping)
 
-class _SequenceNodeProperty(_LeafNodeProperty):
+
+class _SequenceNodeProperty(_NestedNodeProperty):
+
+    def __init__(self, content, node):
+        super(_SequenceNodeProperty, self).__init__(content, node)
+        index = getattr(node, 'index', None)
+        if index is not None:
+            if index not in ('hash', 'sorted'):
+                raise ValueError(
+                    "Sequence index must be 'hash' or 'sorted', not %r." %
+                    index)
+            if isinstance(node.children[0].typ, (
+                colander.Mapping, colander.Sequence, colander.Tuple)):
+                raise TypeError(
+                    'Only sequences of leaf values can be indexed: %s' %
+                    node.name)
+        self._index = index
 
     def _validate(self, content, value):
         if value is colander.null:
             value = []
-        return content._SequenceNode(content, self.node, value)
+        cls = content._SequenceNode
+        if self._index is not None:
+            cls = _indexed_sequence_class(cls)
+        return cls(content, self.node, value)
+
+    def _pack(self, value):
+        return value._pack()
+
+    def _restore(self, content, value):
+        cls = content._SequenceNode
+        if self._index is not None:
+            cls = _indexed_sequence_class(cls)
+        return cls._restore(content, self.node, value)
 
 
 class _SequenceNode(object):
     _data_type = list
+    _tracked_cache = None
+    _parent_link = None
 
     def __init__(self, content, schema, appstruct):
         # XXX calls private colander api.
         self.__content__ = content
         schema.typ._validate(schema, appstruct, schema.typ.accept_scalar)
         self.__schema__ = schema
-        property_factory = content._property_factory
-        self._prop = prop = property_factory(content, schema.children[0])
+        self._prop = prop = _nested_property(content, schema.children[0])
 
         data = self._data_type()
         error = None
@@ -173,16 +627,31 @@ class _SequenceNode(object):
             raise error
 
         self._data = data
+        if content._track_changes:
+            _adopt(self, data)
+
+    def _changed(self, items=()):
+        """
+        Called after `items` are stored in the sequence, or items are removed
+        from it or reordered, when the content type tracks changes.
+        """
+        _adopt(self, items)
+        _touch(self, None)
 
     def __getitem__(self, index):
         return self._data[index].get()
 
     def __setitem__(self, index, value):
         content = self.__content__
-        self._data[index] = content._SequenceItem(content, self._prop, value)
+        self._data[index] = item = content._SequenceItem(
+            content, self._prop, value)
+        if content._track_changes:
+            self._changed((item,))
 
     def __delitem__(self, index):
         del self._data[index]
+        if self.__content__._track_changes:
+            self._changed()
 
     def __iter__(self):
         for item in self._data:
@@ -196,15 +665,20 @@ class _SequenceNode(object):
 
     def append(self, item):
         content = self.__content__
-        self._data.append(
-            content._SequenceItem(content, self._prop, item))
+        item = content._SequenceItem(content, self._prop, item)
+        self._data.append(item)
+        if content._track_changes:
+            self._changed((item,))
 
     def extend(self, items):
         prop = self._prop
-        data = self._data
         content = self.__content__
-        for item in items:
-            data.append(content._SequenceItem(content, prop, item))
+        # Everything is validated before anything is added, so that nothing
+        # is added if an item isn't valid.
+        items = [content._SequenceItem(content, prop, item) for item in items]
+        self._data.extend(items)
+        if content._track_changes:
+            self._changed(items)
 
     def count(self, item):
         n = 0
@@ -228,17 +702,38 @@ class _SequenceNode(object):
 
     def insert(self, index, item):
         content = self.__content__
-        self._data.insert(index, content._SequenceItem(
-            content, self._prop, item))
+        item = content._SequenceItem(content, self._prop, item)
+        self._data.insert(index, item)
+        if content._track_changes:
+            self._changed((item,))
+
+    def _insert_valid(self, index, value):
+        """
+        Inserts `value`, a leaf value which is valid already, without
+        validating it again.
+        """
+        content = self.__content__
+        item = content._SequenceItem.__new__(content._SequenceItem)
+        item.__content__ = content
+        item._prop = prop = self._prop
+        setattr(item, prop._attr, value)
+        self._data.insert(index, item)
+        if content._track_changes:
+            self._changed((item,))
 
     def pop(self, index=-1):
-        return self._data.pop(index).get()
+        value = self._data.pop(index).get()
+        if self.__content__._track_changes:
+            self._changed()
+        return value
 
     def remove(self, item):
         del self[self.index(item)]
 
     def reverse(self):
         self._data.reverse()
+        if self.__content__._track_changes:
+            self._changed()
 
     def __getslice__(self, i, j):
         return [item.get() for item in self._data[i:j]]
@@ -261,15 +756,452 @@ class _SequenceNode(object):
             raise error
 
         self._data[i:j] = items
+        if content._track_changes:
+            self._changed(items)
 
     def __delslice__(self, i, j):
         del self._data[i:j]
+        if self.__content__._track_changes:
+            self._changed()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop('_tracked_cache', None)
+        return state
+
+    def _pack(self):
+        pack = self._prop._pack
+        return [pack(value) for value in self]
+
+    @classmethod
+    def _restore(cls, content, schema, packed):
+        self = cls.__new__(cls)
+        self.__content__ = content
+        self.__schema__ = schema
+        self._prop = prop = _nested_property(content, schema.children[0])
+        self._data = data = self._restore_items(content, prop, packed)
+        if content._track_changes:
+            _adopt(self, data)
+        return self
+
+    def _restore_items(self, content, prop, packed):
+        restore = content._SequenceItem._restore
+        return [restore(content, prop, value) for value in packed]
+
+    def _copy(self, content):
+        """
+        Returns a copy of the node for the content object `content`, with
+        copies of the nodes nested in it.
+        """
+        copy = type(self).__new__(type(self))
+        copy.__dict__.update(self.__dict__)
+        for name in ('_tracked_cache', '_parent_link'):
+            copy.__dict__.pop(name, None)
+        copy.__content__ = content
+        copy._data = data = self._copy_items(content)
+        if content._track_changes:
+            _adopt(copy, data)
+        return copy
+
+    def _copy_items(self, content):
+        data = self._data_type()
+        data.extend([item._copy(content) for item in self._data])
+        return data
 
     def appstruct(self):
-        return [_appstruct_node(item) for item in self]
+        if self.__content__._track_changes:
+            return _copied(_cached(self, 0, type(self)._appstruct))
+        return self._appstruct()
+
+    def _appstruct(self):
+        return [_shared_appstruct(value) for value in self]
+
+    def _cstruct(self):
+        return _cached(self, 1, _serialize_sequence)
+
+
+class _ListSequenceNode(_SequenceNode):
+    """
+    A sequence node which keeps validated values directly in a list, rather
+    than wrapping each of them in a `_SequenceItem`.
+    """
+
+    def __init__(self, content, schema, appstruct):
+        # XXX calls private colander api.
+        self.__content__ = content
+        schema.typ._validate(schema, appstruct, schema.typ.accept_scalar)
+        self.__schema__ = schema
+        self._prop = _nested_property(content, schema.children[0])
+        self._data = data = self._validate_items(appstruct, 0)
+        if content._track_changes:
+            _adopt(self, data)
+
+    def _validate_items(self, items, offset):
+        validate = self._prop._validate
+        content = self.__content__
+        data = []
+        error = None
+        for i, item in enumerate(items):
+            try:
+                data.append(validate(content, item))
+            except colander.Invalid, e:
+                if error is None:
+                    error = colander.Invalid(self.__schema__)
+                error.add(e, offset + i)
+
+        if error is not None:
+            raise error
+
+        return data
+
+    def __getitem__(self, index):
+        return self._data[index]
+
+    def __setitem__(self, index, value):
+        content = self.__content__
+        self._data[index] = value = self._prop._validate(content, value)
+        if content._track_changes:
+            self._changed((value,))
+
+    def __iter__(self):
+        return iter(self._data)
+
+    def __contains__(self, item):
+        return item in self._data
+
+    def __cmp__(self, right):
+        return cmp(self._data, right)
+
+    def __repr__(self):
+        return repr(self._data)
+
+    def append(self, item):
+        content = self.__content__
+        item = self._prop._validate(content, item)
+        self._data.append(item)
+        if content._track_changes:
+            self._changed((item,))
+
+    def extend(self, items):
+        validate = self._prop._validate
+        content = self.__content__
+        items = [validate(content, item) for item in items]
+        self._data.extend(items)
+        if content._track_changes:
+            self._changed(items)
+
+    def count(self, item):
+        return self._data.count(item)
+
+    def index(self, item, start=0, stop=None):
+        if stop is None:
+            stop = len(self._data)
+        try:
+            return self._data.index(item, start, stop)
+        except ValueError:
+            raise ValueError("'%s' not in list" % item)
+
+    def insert(self, index, item):
+        self._insert_valid(index, self._prop._validate(self.__content__, item))
+
+    def _insert_valid(self, index, value):
+        self._data.insert(index, value)
+        if self.__content__._track_changes:
+            self._changed((value,))
+
+    def pop(self, index=-1):
+        value = self._data.pop(index)
+        if self.__content__._track_changes:
+            self._changed()
+        return value
+
+    def __getslice__(self, i, j):
+        return self._data[i:j]
+
+    def __setslice__(self, i, j, s):
+        self._data[i:j] = items = self._validate_items(s, i)
+        if self.__content__._track_changes:
+            self._changed(items)
+
+    def _pack(self):
+        prop = self._prop
+        if type(prop) is _LeafNodeProperty:
+            return list(self._data)
+        pack = prop._pack
+        return [pack(value) for value in self._data]
+
+    def _restore_items(self, content, prop, packed):
+        if type(prop) is _LeafNodeProperty:
+            return list(packed)
+        restore = prop._restore
+        return [restore(content, value) for value in packed]
+
+    def _copy_items(self, content):
+        if type(self._prop) is _LeafNodeProperty:
+            return list(self._data)
+        return [_owned(content, value) for value in self._data]
+
+    def _appstruct(self):
+        if type(self._prop) is _LeafNodeProperty:
+            return list(self._data)
+        return [_shared_appstruct(item) for item in self._data]
+
+
+class _IndexedSequence(object):
+    """
+    Mixin for sequence nodes whose schema node declares an `index`, which
+    keeps a count of each value in the sequence, for fast membership tests
+    and counts, and the position of the first occurrence of each value, for
+    `index`.  Positions are worked out the first time `index` is called, and
+    are updated as the sequence changes at its end or without changing its
+    length; other changes move the values after them, so positions are
+    worked out again the next time `index` is called.  With
+    `index='sorted'`, the values are also kept in a sorted list, which is
+    used by `insert_sorted` and `values_between`, along with the number of
+    places where a value is followed by a smaller one, so `insert_sorted`
+    can tell whether the sequence is in sorted order.
+    """
+
+    def __init__(self, content, schema, appstruct):
+        super(_IndexedSequence, self).__init__(content, schema, appstruct)
+        self._build_index()
+
+    @classmethod
+    def _restore(cls, content, schema, packed):
+        self = super(_IndexedSequence, cls)._restore(content, schema, packed)
+        self._build_index()
+        return self
+
+    def _build_index(self):
+        self._counts = counts = {}
+        for value in self:
+            counts[value] = counts.get(value, 0) + 1
+        if self.__schema__.index == 'sorted':
+            self._sorted = sorted(self)
+            self._descents = _count_descents(list(self))
+        else:
+            self._sorted = None
+        self._positions = None
+
+    def _add(self, values):
+        counts = self._counts
+        ordered = self._sorted
+        for value in values:
+            counts[value] = counts.get(value, 0) + 1
+            if ordered is not None:
+                bisect.insort(ordered, value)
+
+    def _discard(self, values):
+        counts = self._counts
+        ordered = self._sorted
+        for value in values:
+            n = counts[value] - 1
+            if n:
+                counts[value] = n
+            else:
+                del counts[value]
+            if ordered is not None:
+                del ordered[bisect.bisect_left(ordered, value)]
+
+    def _replaced(self, i, j, old, new):
+        """
+        Updates the index after the values `old` at `i:j` have been replaced
+        by the values `new`.  Only the positions of values which were removed
+        or added are updated, and only if nothing after the change has moved.
+        """
+        self._discard(old)
+        self._add(new)
+        end = i + len(new)
+        if self._sorted is not None:
+            before = [self[i - 1]] if i else []
+            after = [self[end]] if end < len(self) else []
+            self._descents += (
+                _count_descents(before + list(new) + after) -
+                _count_descents(before + list(old) + after))
+        positions = self._positions
+        if positions is None:
+            return
+
+        if end != j and end != len(self):
+            # The values after the change have moved.
+            self._positions = None
+            return
+        lost = []
+        for value in set(old):
+            if positions[value] >= i:
+                lost.append(value)
+                del positions[value]
+
+        for position, value in enumerate(new, i):
+            first = positions.get(value)
+            if first is None or first > position:
+                positions[value] = position
+
+        for value in lost:
+            if value not in positions and value in self._counts:
+                # The first of the remaining occurrences is after the change.
+                positions[value] = super(_IndexedSequence, self).index(
+                    value, end)
+
+    def __contains__(self, item):
+        try:
+            return item in self._counts
+        except TypeError:
+            # Unhashable, so can't be equal to any of the values.
+            return False
+
+    def count(self, item):
+        try:
+            return self._counts.get(item, 0)
+        except TypeError:
+            return 0
+
+    def index(self, item, start=0, stop=None):
+        if item not in self:
+            raise ValueError("'%s' not in list" % item)
+        if start or stop is not None:
+            return super(_IndexedSequence, self).index(item, start, stop)
+        positions = self._positions
+        if positions is None:
+            self._positions = positions = {}
+            for i, value in enumerate(self):
+                if value not in positions:
+                    positions[value] = i
+        return positions[item]
+
+    def _position(self, index):
+        n = len(self)
+        if index < 0:
+            index += n
+        if not 0 <= index < n:
+            raise IndexError('list index out of range')
+        return index
+
+    def __setitem__(self, index, value):
+        index = self._position(index)
+        old = self[index]
+        super(_IndexedSequence, self).__setitem__(index, value)
+        self._replaced(index, index + 1, (old,), (self[index],))
+
+    def __delitem__(self, index):
+        index = self._position(index)
+        old = self[index]
+        super(_IndexedSequence, self).__delitem__(index)
+        self._replaced(index, index + 1, (old,), ())
+
+    def append(self, item):
+        n = len(self)
+        super(_IndexedSequence, self).append(item)
+        self._replaced(n, n, (), (self[n],))
+
+    def extend(self, items):
+        n = len(self)
+        super(_IndexedSequence, self).extend(items)
+        self._replaced(n, n, (), self[n:len(self)])
+
+    def insert(self, index, item):
+        n = len(self)
+        if index < 0:
+            index = max(0, index + n)
+        index = min(index, n)
+        super(_IndexedSequence, self).insert(index, item)
+        self._replaced(index, index, (), (self[index],))
+
+    def pop(self, index=-1):
+        index = self._position(index)
+        value = super(_IndexedSequence, self).pop(index)
+        self._replaced(index, index + 1, (value,), ())
+        return value
+
+    def reverse(self):
+        super(_IndexedSequence, self).reverse()
+        self._positions = None
+        if self._sorted is not None:
+            self._descents = _count_descents(list(self))
+
+    def _copy(self, content):
+        copy = super(_IndexedSequence, self)._copy(content)
+        copy._counts = self._counts.copy()
+        if self._sorted is not None:
+            copy._sorted = list(self._sorted)
+        if self._positions is not None:
+            copy._positions = self._positions.copy()
+        return copy
+
+    def __setslice__(self, i, j, s):
+        n = len(self)
+        i = max(0, min(i, n))
+        j = max(i, min(j, n))
+        old = self[i:j]
+        super(_IndexedSequence, self).__setslice__(i, j, s)
+        self._replaced(i, j, old, self[i:i + len(self) - n + len(old)])
+
+    def __delslice__(self, i, j):
+        n = len(self)
+        i = max(0, min(i, n))
+        j = max(i, min(j, n))
+        old = self[i:j]
+        super(_IndexedSequence, self).__delslice__(i, j)
+        self._replaced(i, j, old, ())
+
+    def insert_sorted(self, item):
+        """
+        Inserts `item` after any values less than or equal to it, which keeps
+        the sequence in sorted order.  Returns the position at which it was
+        inserted.  Only for sequences with a sorted index, which are in
+        sorted order.
+        """
+        ordered = self._sorted
+        if ordered is None:
+            raise TypeError('Sequence does not have a sorted index.')
+        if self._descents:
+            raise ValueError('Sequence is not in sorted order.')
+        value = self._prop._validate(self.__content__, item)
+        index = bisect.bisect_right(ordered, value)
+        self._insert_valid(index, value)
+        self._replaced(index, index, (), (value,))
+        return index
+
+    def values_between(self, min=None, max=None):
+        """
+        Returns a sorted list of the values in the sequence which are
+        greater than or equal to `min`, if given, and less than or equal to
+        `max`, if given.  Only for sequences with a sorted index.
+        """
+        ordered = self._sorted
+        if ordered is None:
+            raise TypeError('Sequence does not have a sorted index.')
+        start = 0 if min is None else bisect.bisect_left(ordered, min)
+        stop = (len(ordered) if max is None
+                else bisect.bisect_right(ordered, max))
+        return ordered[start:stop]
+
+
+def _count_descents(values):
+    """
+    Returns the number of values in the list `values` which are greater than
+    the value after them.
+    """
+    return sum(1 for a, b in zip(values, values[1:]) if a > b)
+
+
+_indexed_sequence_classes = {}
+
+
+def _indexed_sequence_class(cls):
+    """
+    Returns a subclass of the sequence node class `cls` which maintains an
+    index of its values.
+    """
+    indexed = _indexed_sequence_classes.get(cls)
+    if indexed is None:
+        indexed = _indexed_sequence_classes[cls] = type(
+            'Indexed' + cls.__name__.lstrip('_'), (_IndexedSequence, cls), {})
+    return indexed
 
 
 class _SequenceItem(object):
+    _parent_link = None
 
     def __init__(self, content, prop, value):
         self.__content__ = content
@@ -279,13 +1211,31 @@ class _SequenceItem(object):
     def get(self):
         return self._prop.__get__(self)
 
+    def _copy(self, content):
+        copy = type(self).__new__(type(self))
+        copy.__content__ = content
+        copy._prop = prop = self._prop
+        _copy_values(self, copy, (prop,), content)
+        return copy
+
+    @classmethod
+    def _restore(cls, content, prop, packed):
+        self = cls.__new__(cls)
+        self.__content__ = content
+        self._prop = prop
+        value = prop._restore(content, packed)
+        setattr(self, prop._attr, value)
+        if content._track_changes:
+            _link(self, prop.node.name, value)
+        return self
+
 
 class _TupleNodeProperty(_LeafNodeProperty):
 
     def __init__(self, content, node):
         super(_TupleNodeProperty, self).__init__(content, node)
-        property_factory = content._property_factory
-        self._props = tuple(property_factory(content, child) for child in node)
+        self._props = tuple(_nested_property(content, child)
+                            for child in node)
 
     def _validate(self, content, value):
         node = self.node
@@ -306,23 +1256,110 @@ class _TupleNodeProperty(_LeafNodeProperty):
 
         return tuple(item.get() for item in items)
 
+    def _pack(self, value):
+        return tuple([prop._pack(item)
+                      for prop, item in zip(self._props, value)])
+
+    def _restore(self, content, value):
+        return tuple([prop._restore(content, item)
+                      for prop, item in zip(self._props, value)])
+
 
 class PropertyFactory(object):
+    """
+    Creates the property for a schema node, using the class registered in
+    `registry` for the node's type or for the nearest of its base classes.
+    Which class is used for each type is worked out once and cached until
+    `registry` is changed.  A subclass may set `registry` on the class, to
+    add to or override the property classes used by default.
+    """
+    _generation = 0
 
     def __init__(self):
-        self.registry = {
+        registry = {
             colander.Mapping: _MappingNodeProperty,
             colander.Sequence: _SequenceNodeProperty,
             colander.Tuple: _TupleNodeProperty,
             colander.SchemaType: _LeafNodeProperty,
         }
+        registry.update(getattr(type(self), 'registry', {}))
+        self.registry = registry
+
+    def __setattr__(self, name, value):
+        if name == 'registry':
+            # Wrapped, so that the factory is told when it is changed.
+            value = _PropertyRegistry(self, value)
+        super(PropertyFactory, self).__setattr__(name, value)
+        if name == 'registry':
+            self._changed()
+
+    def _changed(self):
+        self._resolved = {}
+        self._generation += 1
 
     def __call__(self, content, node):
+        typ = type(node.typ)
+        resolved = self._resolved
+        try:
+            prop_cls = resolved[typ]
+        except KeyError:
+            prop_cls = resolved[typ] = self._resolve(typ)
+        if prop_cls is not None:
+            return prop_cls(content, node)
+
+    def _resolve(self, typ):
         registry = self.registry
-        for cls in type(node.typ).mro():
+        for cls in typ.mro():
             prop_cls = registry.get(cls)
             if prop_cls is not None:
-                return prop_cls(content, node)
+                return prop_cls
+
+
+class _PropertyRegistry(dict):
+    """
+    The registry of a `PropertyFactory`, which tells the factory when it is
+    changed.
+    """
+
+    def __init__(self, factory, items):
+        super(_PropertyRegistry, self).__init__(items)
+        self._factory = factory
+
+    def _changing(name):
+        method = getattr(dict, name)
+        def changing(self, *args, **kw):
+            try:
+                return method(self, *args, **kw)
+            finally:
+                self._factory._changed()
+        changing.__name__ = name
+        return changing
+
+    for name in ('__setitem__', '__delitem__', 'clear', 'pop', 'popitem',
+                 'setdefault', 'update'):
+        locals()[name] = _changing(name)
+    del _changing, name
+
+
+def _nested_property(content, node):
+    """
+    Returns the property for `node`, a node nested somewhere in the schema of
+    `content`, which may be a content type or an instance of one.  Properties
+    are created once for each content type and shared by all of its
+    instances, and created again if the content type's property factory has
+    changed since.
+    """
+    cls = content.__content_type__
+    factory = cls._property_factory
+    generation = getattr(factory, '_generation', None)
+    cache = cls._nested_props
+    if cache[0] != generation:
+        cls._nested_props = cache = (generation, {})
+    props = cache[1]
+    prop = props.get(node)
+    if prop is None:
+        props[node] = prop = factory(cls, node)
+    return prop
 
 
 property_factory = PropertyFactory()
@@ -330,20 +1367,32 @@ property_factory = PropertyFactory()
 
 class _ContentSchemaDecorator(object):
     """
-    Decorator for turning a Colander schema into a content type.
+    Decorator for turning a Colander schema into a content type.  Keyword
+    arguments are passed through to `make_content_type`.  Calling the
+    decorator with only keyword arguments returns a new decorator using those
+    options, eg::
+
+        @limone.content_schema(codegen=True)
+        class Person(colander.Schema):
+            ...
     """
-    def __init__(self, meta=type, property_factory=property_factory):
+    def __init__(self, meta=type, property_factory=property_factory,
+                 **options):
         self.meta = meta
         self.property_factory = property_factory
+        self.options = options
+
+    def __call__(self, schema=None, **options):
+        if schema is None:
+            options = dict(self.options, **options)
+            return _ContentSchemaDecorator(
+                self.meta, self.property_factory, **options)
 
-    def __call__(self, schema):
         ct = make_content_type(
             schema, schema.__name__, schema.__module__, meta=self.meta,
-            property_factory=self.property_factory
+            property_factory=self.property_factory, **self.options
         )
-        def callback(scanner, name, ob):
-            scanner.limone.register_content_type(ct)
-        venusian.attach(ct, callback, category='limone')
+        _attach(ct)
         return ct
 
 
@@ -353,21 +1402,23 @@ content_schema = _ContentSchemaDecorator()
 class _ContentTypeDecorator(object):
     """
     Decorator for turning a class into a content type using the passed in
-    Colander schema.
+    Colander schema.  Keyword arguments are passed through to
+    `make_content_type`.
     """
-    def __init__(self, meta=type, property_factory=property_factory):
+    def __init__(self, meta=type, property_factory=property_factory,
+                 **options):
         self.meta = meta
         self.property_factory = property_factory
+        self.options = options
 
-    def __call__(self, schema):
+    def __call__(self, schema, **options):
+        options = dict(self.options, **options)
         def decorator(cls):
             ct = make_content_type(
                 schema, cls.__name__, cls.__module__, (cls,), self.meta,
-                property_factory=self.property_factory
+                property_factory=self.property_factory, **options
             )
-            def callback(scanner, name, ob):
-                scanner.limone.register_content_type(ct)
-            venusian.attach(ct, callback, category='limone')
+            _attach(ct)
             return ct
         return decorator
 
@@ -375,10 +1426,56 @@ class _ContentTypeDecorator(object):
 content_type = _ContentTypeDecorator()
 
 
+def _attach(ct):
+    """
+    Marks a content type made by one of the decorators so that it is found by
+    `Registry.scan`.
+    """
+    # Venusian is imported here rather than at the top of the module so that
+    # applications which don't use the decorators don't pay for importing it.
+    import venusian
+    def callback(scanner, name, ob):
+        scanner.limone.register_content_type(ct)
+    # Venusian looks at the frame the decorator is used in, which is one
+    # further up since this is called by the decorator.
+    venusian.attach(ct, callback, category='limone', depth=2)
+
+
 def make_content_type(schema, name, module=None, bases=(object,), meta=type,
-                      property_factory=property_factory):
+                      property_factory=property_factory, codegen=False,
+                      layout='dict', sequences='items', lazy=False,
+                      track_changes=False):
     """
     Generate a content type class from a Colander schema.
+
+    If `codegen` is `True`, the constructor and the `_update_from_dict` and
+    `appstruct` methods are generated from source specialized for the schema,
+    which avoids looping over the schema on every call.  Defaults for leaf
+    nodes are computed once when the type is generated, so later changes to
+    the schema will not be seen by a generated type.
+
+    `layout` determines how instances store their values.  The default,
+    `'dict'`, stores them in the instance's `__dict__`.  With `'slots'`, the
+    generated type declares `__slots__` with one slot per field of the schema,
+    so instances don't need a `__dict__` at all unless one of the base classes
+    has one.  Nested mappings and sequences are not affected by `layout`.
+
+    `sequences` determines how sequence nodes store their items.  The default,
+    `'items'`, wraps each item in a `_SequenceItem`.  With `'list'`, validated
+    values are kept directly in a list.
+
+    If `lazy` is `True`, values assigned to attributes which are mappings or
+    sequences are kept as they are until the attribute is first accessed, at
+    which point they are validated.  Validation errors are then raised by the
+    access.  Call `validate_all` on an instance to validate any values which
+    haven't been yet.
+
+    If `track_changes` is `True`, instances keep track of which of their
+    attributes have been changed, including changes made anywhere inside
+    nested mappings and sequences, so that `changed_fields` can report them.
+    The results of `appstruct` and `serialize` are also cached, and only the
+    parts of them corresponding to changed nodes are rebuilt.  Since they are
+    shared between calls, the results must be treated as read only.
     """
     if isinstance(schema, type):
         schema = schema()
@@ -386,6 +1483,12 @@ def make_content_type(schema, name, module=None, bases=(object,), meta=type,
     if type(getattr(schema, 'typ', None)) != colander.Mapping:
         raise TypeError('Schema must be a colander mapping schema.')
 
+    if layout not in ('dict', 'slots'):
+        raise ValueError('Unknown layout: %s' % repr(layout))
+
+    if sequences not in ('items', 'list'):
+        raise ValueError('Unknown sequence storage: %s' % repr(sequences))
+
     class MetaType(meta):
         def __new__(cls, throw, away, members):
             return meta.__new__(cls, name, bases, members)
@@ -399,9 +1502,45 @@ def make_content_type(schema, name, module=None, bases=(object,), meta=type,
         __metaclass__ = MetaType
         __schema__ = schema
         _property_factory = property_factory
+        _nested_props = (None, {})
         _MappingNode = _MappingNode
-        _SequenceNode = _SequenceNode
+        if sequences == 'list':
+            _SequenceNode = _ListSequenceNode
+        else:
+            _SequenceNode = _SequenceNode
         _SequenceItem = _SequenceItem
+        _track_changes = track_changes
+
+        if layout == 'slots':
+            __slots__ = ('__content__',) + _slot_names(schema)
+            if track_changes:
+                __slots__ += ('_tracked_cache', '_dirty_fields')
+        elif track_changes:
+            _tracked_cache = None
+            _dirty_fields = None
+
+        __getstate__ = _getstate
+        __setstate__ = _setstate
+
+        if track_changes:
+            def changed_fields(self):
+                """
+                Returns the set of names of the attributes which have been
+                changed since `mark_clean` was last called.  For an instance
+                which has never been marked clean, this is all of them.
+                Instances restored from a pickle start out clean.
+                """
+                dirty = getattr(self, '_dirty_fields', None)
+                if dirty is None:
+                    return set(self._fields)
+                return set(dirty)
+
+            def mark_clean(self):
+                """
+                Forgets about changes made so far, eg once they have been
+                saved.
+                """
+                self._dirty_fields = set()
 
         @classmethod
         def deserialize(cls, cstruct):
@@ -412,6 +1551,68 @@ def make_content_type(schema, name, module=None, bases=(object,), meta=type,
         def from_appstruct(cls, appstruct):
             return cls(**appstruct)
 
+        @classmethod
+        def from_trusted_appstruct(cls, appstruct, sample_rate=0.0,
+                                   on_mismatch=None):
+            """
+            Creates an instance from `appstruct` without validating it, for
+            data which is known to be valid, such as the appstructs of
+            instances which were saved earlier.  Values missing from
+            `appstruct` get the default or missing values of their nodes, as
+            for the constructor.  Instances of content types which track
+            changes start out clean.  The instance is created without calling
+            `__init__`, so an `__init__` defined by a subclass of the content
+            type isn't run.
+
+            A fraction `sample_rate` of calls also validate `appstruct` in
+            full, to notice data which is no longer valid, eg because the
+            schema has changed since it was saved, and compare the result with
+            the instance created without validation, to notice values which
+            validation would have changed, such as a string for an `Int`
+            node.  If either is found, `on_mismatch(content_type, appstruct,
+            error)` is called with a `colander.Invalid` for the invalid or
+            changed values, and the instance created without validation is
+            returned all the same.  Without `on_mismatch`, the
+            `colander.Invalid` is raised instead.
+            """
+            pack = cls.__dict__.get('_pack_trusted')
+            if pack is None:
+                pack = cls._pack_trusted = _trusted_packer(cls.__schema__)
+            obj = cls.__new__(cls)
+            obj.__setstate__(
+                (cls._schema_tag, cls._state_names, pack(appstruct), None))
+            if sample_rate and _random() < sample_rate:
+                try:
+                    validated = cls.from_appstruct(appstruct)
+                    validated.validate_all()
+                    _check_trusted(cls.__schema__, obj, validated)
+                except colander.Invalid, e:
+                    if on_mismatch is None:
+                        raise
+                    on_mismatch(cls, appstruct, e)
+            return obj
+
+        @classmethod
+        def from_appstructs(cls, appstructs, fail_fast=False):
+            """
+            Create instances from an iterable of appstructs.  Returns a tuple
+            of `(instances, errors)`, where `instances` is a list with an
+            instance for each appstruct, or `None` for those which are not
+            valid, and `errors` is a list of `(index, colander.Invalid)`
+            tuples.  If `fail_fast` is `True`, a `colander.Invalid` is raised
+            for the first invalid appstruct instead, with the error for that
+            appstruct at its position in the batch.
+            """
+            return _construct_many(cls, appstructs, None, fail_fast)
+
+        @classmethod
+        def deserialize_many(cls, cstructs, fail_fast=False):
+            """
+            Like `from_appstructs`, but deserializes each of `cstructs` first.
+            """
+            return _construct_many(
+                cls, cstructs, cls.__schema__.deserialize, fail_fast)
+
         def __init__(self, **kw):
             try:
                 super(ContentType, self).__init__()
@@ -431,9 +1632,10 @@ def make_content_type(schema, name, module=None, bases=(object,), meta=type,
         def deserialize_update(self, cstruct):
             error = None
             schema = self.__schema__
+            fields = self._fields
             appstruct = {}
-            for i, (name, value) in enumerate(cstruct.items()):
-                node = schema[name]
+            for name, value in cstruct.items():
+                i, node = fields[name]
                 try:
                     appstruct[name] = node.deserialize(value)
                 except colander.Invalid, e:
@@ -450,18 +1652,98 @@ def make_content_type(schema, name, module=None, bases=(object,), meta=type,
             self._update_from_dict(appstruct, skip_missing=True)
 
         def serialize(self):
+            if self._track_changes:
+                return _copied(_cached(self, 1, _serialize_mapping))
             return self.__schema__.serialize(self.appstruct())
 
+        def clone(self):
+            """
+            Returns a copy of the instance which can be changed without
+            affecting the original, or the other way round.  Nested mappings
+            and sequences are copied, but the values in them are shared,
+            since they can't be changed, and aren't validated again, so
+            cloning is much cheaper than creating an instance from the
+            appstruct of this one.
+            """
+            return _clone(self, False)
+
+        def snapshot(self):
+            """
+            Returns a copy of the instance as it is now, in the same way as
+            `clone`.  For content types which track changes, the copy starts
+            out clean rather than with the changed fields of the instance.
+            """
+            return _clone(self, True)
+
+        def batch_update(self):
+            """
+            Returns a context manager whose attributes stand for those of the
+            instance.  Values assigned to them are kept until the end of the
+            `with` block, when they are validated and assigned to the
+            instance together::
+
+                with jack.batch_update() as batch:
+                    batch.name = 'Fred'
+                    batch.age = 53
+
+            Each value is validated once, and the validators of the schema
+            and of the mappings and sequences assigned are then run, which
+            assigning attributes one at a time doesn't do, all before
+            anything is assigned.  If anything isn't valid, nothing is
+            assigned and a single `colander.Invalid` is raised.  If the
+            `with` block raises an exception, nothing is assigned either.
+            """
+            return _BatchUpdate(self)
+
+        def apply_patch(self, patch):
+            """
+            Makes the changes described by `patch`, validating only the
+            values which change.  See `limone.patch`.
+            """
+            from limone.patch import apply_patch
+            apply_patch(self, patch)
+
+        def to_bytes(self):
+            """
+            Returns the instance encoded in the compact binary format
+            described in `limone.codec`.
+            """
+            from limone.codec import encode
+            return encode(self)
+
+        @classmethod
+        def from_buffer(cls, buf, validate=False):
+            """
+            Decodes an instance from `buf`, which contains exactly one
+            instance encoded by `to_bytes`.  `buf` may be a string or any
+            other object supporting the buffer interface, such as a
+            `memoryview` or an `mmap`, and isn't copied.  Values aren't
+            validated unless `validate` is `True`.
+            """
+            from limone.codec import decode
+            obj, end = decode(cls, buf, 0, validate)
+            if end != len(buf):
+                raise ValueError(
+                    'Unexpected data after encoded %s.' % cls.__name__)
+            return obj
+
         def _update_from_dict(self, data, skip_missing):
             error = None
             schema = self.__schema__
+            found = 0
 
             for i, node in enumerate(schema.children):
                 name = node.name
-                try:
-                    value = data.pop(name, colander.null)
+                if name in data:
+                    found += 1
+                    value = data[name]
                     if value is colander.null and skip_missing:
                         continue
+                elif skip_missing:
+                    continue
+                else:
+                    value = colander.null
+                try:
                     setattr(self, name, value)
                 except colander.Invalid, e:
                     if error is None:
@@ -471,19 +1753,1084 @@ def make_content_type(schema, name, module=None, bases=(object,), meta=type,
             if error is not None:
                 raise error
 
-            return data
+            if found < len(data):
+                return _unexpected(schema, data)
+            return {}
 
         def appstruct(self):
-            return dict([(node.name, _appstruct_node(getattr(self, node.name)))
-                         for node in self.__schema__])
+            return dict([(prop.node.name, _shared_appstruct(prop.__get__(self)))
+                         for prop in self._props])
+
+        def validate_all(self):
+            """
+            Validate values of lazy attributes which haven't been accessed yet.
+            Raises `colander.Invalid` for all of the invalid values found.
+            """
+            error = None
+            for i, prop in enumerate(self._props):
+                try:
+                    prop.__get__(self, type(self))
+                except colander.Invalid, e:
+                    if error is None:
+                        error = colander.Invalid(self.__schema__)
+                    error.add(e, i)
+
+            if error is not None:
+                raise error
 
     property_factory = ContentType._property_factory
-    for node in schema:
-        setattr(ContentType, node.name, property_factory(ContentType, node))
+    fields = {}
+    props = []
+    for i, node in enumerate(schema):
+        prop = property_factory(ContentType, node)
+        if layout == 'slots':
+            prop._attr = slot = ContentType.__slots__[i + 1]
+            prop._slot = ContentType.__dict__[slot]
+        if lazy and isinstance(prop, _NestedNodeProperty):
+            prop._lazy = True
+        setattr(ContentType, node.name, prop)
+        fields[node.name] = (i, node)
+        props.append(prop)
+    ContentType._fields = fields
+    ContentType._props = tuple(props)
+    ContentType._internal_attrs = frozenset(
+        [prop._attr for prop in props] +
+        ['__content__', '_tracked_cache', '_dirty_fields'])
+    ContentType._schema_tag = _schema_tag(schema)
+    ContentType._state_names = _state_names(schema)
+
+    # Everything needed to generate this type again, eg in another process.
+    ContentType._make_args = (schema, bases, meta, property_factory, dict(
+        codegen=codegen, layout=layout, sequences=sequences, lazy=lazy,
+        track_changes=track_changes))
+
+    if codegen:
+        _generate_methods(ContentType)
+
+    if track_changes:
+        ContentType.appstruct = _cached_appstruct(
+            ContentType.__dict__['appstruct'])
 
     return ContentType
 
 
+def _trusted_packer(node):
+    """
+    Returns a function which turns a trusted appstruct for `node` into the
+    form values are packed in for pickling, without validating it, or `None`
+    for leaf nodes, whose values are packed as they are.  Missing values are
+    replaced in the same way as by the constructor.
+    """
+    null = colander.null
+    typ = node.typ
+    if isinstance(typ, colander.Mapping):
+        children = []
+        for child in node.children:
+            pack_child = _trusted_packer(child)
+            if pack_child is None:
+                # Defaults are validated, as by the constructor, once.
+                try:
+                    default = (child.deserialize(child.serialize(null)), None)
+                except colander.Invalid, e:
+                    default = (None, e.msg)
+            else:
+                default = None
+            children.append((child.name, child, pack_child, default))
+
+        def pack(value):
+            if value is null:
+                value = {}
+            packed = []
+            append = packed.append
+            error = None
+            found = 0
+            for i, (name, child, pack_child, default) in enumerate(children):
+                item = value.get(name, null)
+                try:
+                    if item is null:
+                        found += name in value
+                        if pack_child is not None:
+                            append(pack_child(null))
+                        elif default[1] is None:
+                            append(default[0])
+                        else:
+                            raise colander.Invalid(child, default[1])
+                    else:
+                        found += 1
+                        append(item if pack_child is None
+                               else pack_child(item))
+                except colander.Invalid, e:
+                    if error is None:
+                        error = colander.Invalid(node)
+                    error.add(e, i)
+            if error is not None:
+                raise error
+            if found < len(value):
+                raise TypeError("Unexpected keyword argument(s): %s" %
+                                repr(_unexpected(node, value)))
+            return tuple(packed)
+
+    elif isinstance(typ, colander.Sequence):
+        pack_child = _trusted_packer(node.children[0])
+
+        def pack(value):
+            if value is null:
+                return []
+            if pack_child is None:
+                return list(value)
+            return [pack_child(item) for item in value]
+
+    elif isinstance(typ, colander.Tuple):
+        packers = [_trusted_packer(child) for child in node.children]
+
+        def pack(value):
+            if value is null:
+                raise colander.Invalid(node, _('Required'))
+            return tuple([item if pack_child is None else pack_child(item)
+                          for pack_child, item in zip(packers, value)])
+
+    else:
+        return None
+
+    return pack
+
+
+def _check_trusted(schema, obj, validated):
+    """
+    Raises `colander.Invalid` for the attributes of `obj`, a content object
+    created from a trusted appstruct, whose values are different in
+    `validated`, created from the same appstruct with validation.
+    """
+    appstruct = obj.appstruct()
+    expected = validated.appstruct()
+    error = None
+    for i, node in enumerate(schema.children):
+        value = appstruct[node.name]
+        if not _same_value(node, value, expected[node.name]):
+            if error is None:
+                error = colander.Invalid(schema)
+            error.add(colander.Invalid(node, _(
+                '${value} is ${expected} when validated',
+                mapping={'value': repr(value),
+                         'expected': repr(expected[node.name])})), i)
+    if error is not None:
+        raise error
+
+
+def _same_value(node, value, expected):
+    """
+    Returns whether `value`, an appstruct value for `node`, is the same as
+    `expected`, the value it has when validated.  A leaf value which is its
+    node's missing value counts as the same whatever it validates to, since
+    missing values needn't be valid themselves, eg `None` for a `String`.
+    """
+    if value == expected:
+        return True
+    typ = node.typ
+    if isinstance(typ, colander.Mapping):
+        return (type(value) is dict and type(expected) is dict and
+                all([_same_value(child, value.get(child.name),
+                                 expected.get(child.name))
+                     for child in node.children]))
+    if isinstance(typ, (colander.Sequence, colander.Tuple)):
+        if len(value) != len(expected):
+            return False
+        if isinstance(typ, colander.Sequence):
+            children = [node.children[0]] * len(value)
+        else:
+            children = node.children
+        return all([_same_value(child, item, expected_item) for
+                    child, item, expected_item in
+                    zip(children, value, expected)])
+    return value is node.missing and node.missing is not colander.required
+
+
+def _construct_many(cls, rows, prepare, fail_fast):
+    build = _row_builder(cls, prepare)
+    instances = []
+    errors = []
+    for i, row in enumerate(rows):
+        try:
+            instances.append(build(row))
+        except colander.Invalid, e:
+            if fail_fast:
+                node = colander.SchemaNode(colander.Sequence(), cls.__schema__)
+                error = colander.Invalid(node)
+                error.add(e, i)
+                raise error
+            instances.append(None)
+            errors.append((i, e))
+    return instances, errors
+
+
+def _row_builder(cls, prepare=None):
+    """
+    Returns a function which does the same thing as the content type's
+    constructor for a single appstruct, with everything that doesn't depend on
+    the appstruct worked out ahead of time.  Unexpected keys, and rows which
+    aren't mappings, are reported as a `colander.Invalid` for the appstruct,
+    rather than a `TypeError`.  If `prepare` is given, it is called first to
+    turn each row into an appstruct.
+    """
+    schema = cls.__schema__
+    new = cls.__new__
+    base_init = super(cls.__content_type__, cls).__init__
+    null = colander.null
+    Invalid = colander.Invalid
+
+    if '_generated_source' in cls.__dict__:
+        def update(obj, row):
+            return obj._update_from_dict(row, False)
+
+    else:
+        # Leaf validators are called directly, as in generated code.
+        plan = []
+        for i, (node, prop) in enumerate(zip(schema, cls._props)):
+            if type(prop) is _LeafNodeProperty and prop._check is not None:
+                plan.append((i, node.name, prop._attr, prop._check))
+            else:
+                plan.append((i, node.name, None, prop.__set__))
+
+        def update(obj, row):
+            error = None
+            found = 0
+            for i, name, attr, check in plan:
+                if name in row:
+                    found += 1
+                    value = row[name]
+                else:
+                    value = null
+                try:
+                    if attr is None:
+                        check(obj, value)
+                    else:
+                        setattr(obj, attr, check(value))
+                except Invalid, e:
+                    if error is None:
+                        error = Invalid(schema)
+                    error.add(e, i)
+
+            if error is not None:
+                raise error
+
+            if found < len(row):
+                return _unexpected(schema, row)
+
+    def build(row):
+        if prepare is not None:
+            row = prepare(row)
+        if type(row) is not dict:
+            row = schema.typ._validate(schema, row) # XXX private colander api
+        obj = new(cls)
+        try:
+            base_init(obj)
+        except TypeError:
+            raise TypeError(
+                'Limone content types may only extend types with no-arg '
+                'constructors.')
+        obj.__content__ = obj
+        unexpected = update(obj, row)
+        if unexpected:
+            raise Invalid(schema, _('Unrecognized keys in mapping: "${val}"',
+                                    mapping={'val': unexpected}))
+        return obj
+
+    counters = cls.__dict__.get('_construction_counters')
+    if counters is not None:
+        # Statistics are being collected for the content type.
+        from limone.stats import _counted
+        build = _counted(build, counters)
+    return build
+
+
+def _fingerprint(node):
+    """
+    Returns a hashable value describing the structure of a schema, which is
+    equal for schemas that would produce equivalent content types.
+    """
+    attrs = _items_key(node.__dict__, _fingerprint_ignored)
+    return (type(node), tuple(attrs),
+            tuple([_fingerprint(child) for child in node.children]))
+
+
+# Node attributes which don't affect the generated content type, or which are
+# handled separately.
+_fingerprint_ignored = frozenset(('children', '_order', 'raw_title'))
+
+_pattern_type = type(re.compile(''))
+
+_plain_types = frozenset((type(None), bool, int, long, float, str, unicode))
+
+
+def _value_key(value):
+    """
+    Returns a hashable value which is equal for attributes of schema nodes,
+    such as types, validators and defaults, which behave the same.  Things
+    like functions can only be compared by identity, which is safe because
+    they are kept alive by the content types using them.
+    """
+    cls = type(value)
+    if cls in _plain_types or isinstance(value, _immutable):
+        return (cls, value)
+    if isinstance(value, (tuple, list)):
+        return (type(value), tuple(_value_key(item) for item in value))
+    if isinstance(value, dict):
+        return (dict, _items_key(value))
+    if isinstance(value, _pattern_type):
+        return (_pattern_type, value.pattern, value.flags)
+    if isinstance(value, colander.SchemaNode):
+        return _fingerprint(value)
+    if (hasattr(value, '__dict__') and
+        not isinstance(value, (type, _function_types))):
+        return (type(value), _items_key(value.__dict__))
+    return ('id', id(value))
+
+
+def _items_key(mapping, ignored=()):
+    # Values of plain types, by far the most common, are handled inline.
+    plain = _plain_types
+    value_key = _value_key
+    items = []
+    for name, value in mapping.items():
+        if name in ignored:
+            continue
+        if type(name) is not str:
+            name = value_key(name)
+        cls = type(value)
+        if cls in plain:
+            items.append((name, (cls, value)))
+        else:
+            items.append((name, value_key(value)))
+    items.sort()
+    return tuple(items)
+
+
+_function_types = (type(_value_key), type(len), type(Registry.scan))
+
+_identity_options = ('meta', 'property_factory')
+
+
+def _slot_names(schema):
+    """
+    Returns a tuple of the names of the slots which hold the values of the
+    nodes of `schema`, in the slots layout, which are numbered, with a prefix
+    made long enough that they aren't the names of any of the nodes.
+    """
+    names = set([node.name for node in schema])
+    prefix = '_f'
+    while True:
+        slots = tuple(['%s%d' % (prefix, i)
+                       for i in xrange(len(schema.children))])
+        if names.isdisjoint(slots):
+            return slots
+        prefix += 'f'
+
+
+def _getstate(self):
+    """
+    Returns the state of a content object as a tuple of the schema tag of its
+    type, the names of the nodes of its schema, a tuple of the values of its
+    attributes in schema order and a dictionary of anything else in its
+    `__dict__`, or `None`.  Values are packed into plain Python objects, with
+    nested mappings packed as tuples of their values in schema order.
+    Attributes which were never set are packed as `_unset`, and left unset
+    when unpickled.  The names are the same object for every instance of a
+    type, so are only pickled once along with many instances.
+    """
+    values = []
+    for prop in self._props:
+        slot = prop._slot
+        if slot is None:
+            value = self.__dict__.get(prop._attr, _unset)
+        else:
+            try:
+                value = slot.__get__(self)
+            except AttributeError:
+                value = _unset
+        if value is not _unset and type(value) is not _Unvalidated:
+            value = prop._pack(value)
+        values.append(value)
+
+    # Instances using the slots layout may still have a __dict__ if one of the
+    # base classes has one.
+    extra = getattr(self, '__dict__', None)
+    if extra:
+        internal = self._internal_attrs
+        extra = dict([(name, value) for name, value in extra.items()
+                      if name not in internal]) or None
+    return self._schema_tag, self._state_names, tuple(values), extra
+
+
+def _setstate(self, state):
+    """
+    Restores a content object from the state returned by `_getstate`.  Values
+    are not validated again, since they were valid when they were pickled.
+    If the names, nesting or types of the nodes of the schema have changed
+    since then, values are matched to nodes by name instead, and validated,
+    with nodes which weren't in the schema getting their missing values.
+    States pickled by earlier versions of limone are also accepted.
+    """
+    cls = type(self)
+    if isinstance(state, dict):
+        # The instance dict, as pickled by default.
+        self.__dict__.update(state)
+        if self._track_changes:
+            self._dirty_fields = set()
+        return
+
+    if len(state) == 2:
+        # The instance dict, if any, and the values of the slots layout.
+        extra, values = state
+        tag = cls._schema_tag
+        values = [_Packed(value) for value in values]
+    else:
+        tag, names, values, extra = state
+
+    if extra:
+        self.__dict__.update(extra)
+    self.__content__ = self
+    track = self._track_changes
+    if tag != cls._schema_tag:
+        _restore_by_name(self, names, values)
+        if track:
+            self._dirty_fields = set()
+        return
+
+    for prop, value in zip(cls._props, values):
+        if value is _unset:
+            continue
+        if type(value) is _Packed:
+            value = value.value
+        elif type(value) is not _Unvalidated:
+            value = prop._restore(self, value)
+        slot = prop._slot
+        if slot is None:
+            self.__dict__[prop._attr] = value
+        else:
+            slot.__set__(self, value)
+        if track:
+            _link(self, prop.node.name, value)
+    if track:
+        self._dirty_fields = set()
+
+
+def _restore_by_name(self, names, values):
+    # Restores the values of a content object pickled when its schema had the
+    # names `names`, through its properties, which validate them.
+    old = _by_name(names, values)
+    for prop in self._props:
+        node = prop.node
+        name = node.name
+        if name not in old:
+            value = colander.null
+        else:
+            names, value = old[name]
+            if value is _unset:
+                continue
+            if type(value) is _Unvalidated:
+                value = value.appstruct
+            else:
+                value = _renamed(node, names, value)
+        setattr(self, name, value)
+
+
+def _renamed(node, names, value):
+    """
+    Returns `value`, packed for pickling when the children of `node` had the
+    names `names`, as an appstruct for `node`, with the values of its
+    children matched to them by name.  Values for children which are not in
+    `names` are left out.
+    """
+    typ = node.typ
+    if names is None:
+        return value
+    if isinstance(typ, colander.Sequence):
+        names, = names
+        child = node.children[0]
+        return [_renamed(child, _split_names(names)[1], item)
+                for item in value]
+    if isinstance(typ, (colander.Mapping, colander.Tuple)):
+        old = _by_name(names, value)
+        appstruct = {}
+        for child in node.children:
+            if child.name in old:
+                names, item = old[child.name]
+                appstruct[child.name] = _renamed(child, names, item)
+        if isinstance(typ, colander.Tuple):
+            return tuple([appstruct.get(child.name, colander.null)
+                          for child in node.children])
+        return appstruct
+    return value
+
+
+def _state_names(node):
+    """
+    Returns the names of the children of `node`, with each child which has
+    children of its own given as a tuple of its name and their names.
+    """
+    return tuple([(child.name, _state_names(child)) if child.children
+                  else child.name for child in node.children])
+
+
+def _by_name(names, values):
+    # Returns a dictionary of the names of the children of a node and the
+    # names of their own children, if any, with their values.
+    by_name = {}
+    for entry, value in zip(names, values):
+        name, names = _split_names(entry)
+        by_name[name] = names, value
+    return by_name
+
+
+def _split_names(entry):
+    # Returns a tuple of the name and the names of the children of a node
+    # from an entry in the tuple returned by `_state_names`.
+    if type(entry) is tuple:
+        return entry
+    return entry, None
+
+
+class _Unset(object):
+    # Stands in for the values of attributes which were never set, in the
+    # states of content objects.
+    __slots__ = ()
+
+    def __reduce__(self):
+        return '_unset' # when unpickled, refers to "_unset" below
+
+_unset = _Unset()
+
+
+class _Packed(object):
+    # Marks a value restored from an old state which is already unpacked.
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+
+def _schema_tag(schema):
+    """
+    Returns a number identifying the names, nesting and types of the nodes of
+    a schema, which determine the layout of pickled instances.
+    """
+    import zlib
+    return zlib.crc32(_schema_layout(schema).encode('utf-8')) & 0xffffffff
+
+
+def _schema_layout(node):
+    typ = type(node.typ)
+    return u'%s:%s.%s(%s)' % (
+        node.name, typ.__module__, typ.__name__,
+        u','.join([_schema_layout(child) for child in node.children]))
+
+
+def _link(parent, name, value):
+    # Links nodes restored without going through their properties to their
+    # parent, for change tracking.
+    if type(value) is tuple:
+        _adopt(parent, value, name)
+    else:
+        _adopt(parent, (value,), name)
+
+
+def _touch(obj, name):
+    """
+    Records that the attribute `name` of `obj`, which is either a content
+    object or a node nested in one, has changed.  Cached appstructs and
+    cstructs are discarded for `obj` and for everything containing it, and
+    the name of the content object's attribute containing `obj` is added to
+    its dirty fields.  `name` is `None` for the items of sequences.
+
+    Nodes which have been removed from a sequence still point at it, so
+    changing them afterwards marks the sequence as changed too, which errs on
+    the side of saving too much.
+    """
+    while True:
+        if getattr(obj, '_tracked_cache', None) is not None:
+            obj._tracked_cache = None
+        if obj is obj.__content__:
+            dirty = getattr(obj, '_dirty_fields', None)
+            if dirty is not None:
+                dirty.add(name)
+            return
+        link = getattr(obj, '_parent_link', None)
+        if link is None:
+            # Not attached to anything yet.
+            return
+        obj, name = link
+
+
+def _adopt(parent, values, name=None):
+    """
+    Points any nodes among `values` at `parent`, so changes to them can be
+    tracked.
+    """
+    for value in values:
+        if isinstance(value, (_MappingNode, _SequenceNode, _SequenceItem)):
+            value._parent_link = (parent, name)
+
+
+def _copy_values(source, target, props, content):
+    """
+    Copies the values of `props` from `source`, a content object or a node
+    nested in one, to `target`, a copy of it belonging to the content object
+    `content`.  Nested nodes are copied too.
+    """
+    track = content._track_changes
+    for prop in props:
+        slot = prop._slot
+        if slot is None:
+            value = source.__dict__[prop._attr]
+        else:
+            value = slot.__get__(source)
+        value = _owned(content, value)
+        if slot is None:
+            target.__dict__[prop._attr] = value
+        else:
+            slot.__set__(target, value)
+        if track and type(value) is not _Unvalidated:
+            _link(target, prop.node.name, value)
+
+
+def _owned(content, value):
+    """
+    Returns a copy of `value` belonging to `content`, if it is a node or a
+    tuple containing nodes, else `value` itself.
+    """
+    if isinstance(value, (_MappingNode, _SequenceNode)):
+        return value._copy(content)
+    if type(value) is tuple:
+        return tuple([_owned(content, item) for item in value])
+    return value
+
+
+def _clone(obj, clean):
+    """
+    Returns a copy of the content object `obj`, with copies of its nested
+    nodes.  If
+    `clean` is `True`, a copy of a content object which tracks changes starts
+    out with no changed fields.
+    """
+    cls = type(obj)
+    copy = cls.__new__(cls)
+    extra = getattr(obj, '__dict__', None)
+    if extra:
+        internal = obj._internal_attrs
+        copy.__dict__.update([(name, value) for name, value in extra.items()
+                              if name not in internal])
+    copy.__content__ = copy
+    _copy_values(obj, copy, obj._props, copy)
+    if obj._track_changes:
+        dirty = getattr(obj, '_dirty_fields', None)
+        if clean:
+            copy._dirty_fields = set()
+        elif dirty is not None:
+            copy._dirty_fields = set(dirty)
+    return copy
+
+
+class _BatchUpdate(object):
+    """
+    The context manager returned by a content object's `batch_update`.
+    Reading an attribute gives the value assigned to it in the `with` block,
+    as it was assigned, or else the content object's value.
+    """
+
+    def __init__(self, obj):
+        self.__dict__['_obj'] = obj
+        self.__dict__['_values'] = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        values = self._values
+        try:
+            if exc_type is None and values:
+                _batch_assign(self._obj, values)
+        finally:
+            values.clear()
+        return False
+
+    def __getattr__(self, name):
+        values = self.__dict__['_values']
+        if name in values:
+            return values[name]
+        return getattr(self._obj, name)
+
+    def __setattr__(self, name, value):
+        obj = self._obj
+        if name not in obj._fields:
+            raise AttributeError(
+                '%s has no attribute %r in its schema.' %
+                (type(obj).__name__, name))
+        self._values[name] = value
+
+
+def _batch_assign(obj, values):
+    """
+    Assigns `values`, a dictionary of attribute values, to the content object
+    `obj`.  Each value is validated once, and the validators of the nested
+    nodes assigned and of the schema are run, before anything is assigned.
+    If anything isn't valid, nothing is assigned and a `colander.Invalid` is
+    raised for all of the errors found.
+    """
+    schema = obj.__schema__
+    validated = []
+    error = None
+    for i, prop in enumerate(obj._props):
+        node = prop.node
+        if node.name not in values:
+            continue
+        try:
+            value = prop._validate(obj, values[node.name])
+            if isinstance(node.typ, (colander.Mapping, colander.Sequence,
+                                     colander.Tuple)):
+                _validate_nested(node, value)
+        except colander.Invalid, e:
+            if error is None:
+                error = colander.Invalid(schema)
+            error.add(e, i)
+        else:
+            validated.append((prop, value))
+    if error is not None:
+        raise error
+
+    validator = schema.validator
+    if validator is not None and not isinstance(validator, colander.deferred):
+        appstruct = dict([(prop.node.name, _shared_appstruct(value))
+                          for prop, value in validated])
+        for prop in obj._props:
+            name = prop.node.name
+            if name not in appstruct:
+                appstruct[name] = _shared_appstruct(prop.__get__(obj))
+        validator(schema, appstruct)
+
+    track = obj._track_changes
+    for prop, value in validated:
+        name = prop.node.name
+        if track:
+            old = getattr(obj, prop._attr)
+            if isinstance(old, (_MappingNode, _SequenceNode)):
+                # Changes to the replaced node no longer affect `obj`.
+                old._parent_link = None
+        setattr(obj, prop._attr, value)
+        if track:
+            _link(obj, name, value)
+            _touch(obj, name)
+
+
+def _put_back(obj, prop, old):
+    """
+    Puts back `old`, the value stored for `prop` of `obj` before it was
+    assigned, where `obj` is a content object or a mapping node.
+    """
+    new = getattr(obj, prop._attr)
+    if isinstance(new, (_MappingNode, _SequenceNode)):
+        new._parent_link = None
+    setattr(obj, prop._attr, old)
+    if obj.__content__._track_changes and type(old) is not _Unvalidated:
+        _link(obj, prop.node.name, old)
+
+
+def _validate_nested(node, value):
+    """
+    Runs the validators of `node` and of the nodes nested in it which aren't
+    leaves, for `value`, a value of `node` whose leaves have been validated
+    already.
+    """
+    value = _shared_appstruct(value)
+    typ = node.typ
+    if isinstance(typ, colander.Mapping):
+        items = [(child, value.get(child.name)) for child in node.children]
+    elif isinstance(typ, colander.Tuple):
+        items = zip(node.children, value)
+    elif isinstance(typ, colander.Sequence):
+        child = node.children[0]
+        items = [(child, item) for item in value]
+    else:
+        return
+
+    error = None
+    for i, (child, item) in enumerate(items):
+        try:
+            _validate_nested(child, item)
+        except colander.Invalid, e:
+            if error is None:
+                error = colander.Invalid(node)
+            error.add(e, i)
+    if error is not None:
+        raise error
+
+    validator = node.validator
+    if validator is not None and not isinstance(validator, colander.deferred):
+        validator(node, value)
+
+
+def _cached(obj, i, compute):
+    """
+    Returns `compute(obj)`, using the result cached at index `i` of `obj`'s
+    cache if there is one.  The cache holds the appstruct at index 0 and the
+    cstruct at index 1.
+    """
+    cache = getattr(obj, '_tracked_cache', None)
+    if cache is None:
+        obj._tracked_cache = cache = [None, None]
+    value = cache[i]
+    if value is None:
+        cache[i] = value = compute(obj)
+    return value
+
+
+def _cached_appstruct(appstruct):
+    def cached_appstruct(self):
+        return _copied(_cached(self, 0, appstruct))
+    cached_appstruct.__name__ = appstruct.__name__
+    return cached_appstruct
+
+
+def _serialize_mapping(obj):
+    # Does the same thing as `obj.__schema__.serialize(obj.appstruct())`, but
+    # reuses the cached cstructs of nested nodes.
+    props = obj._props
+    if type(props) is dict:
+        # A mapping node rather than a content object.
+        props = [props[node.name] for node in obj.__schema__]
+    return dict((prop.node.name, _serialize_value(prop.node, prop.__get__(obj)))
+                for prop in props)
+
+
+def _serialize_sequence(obj):
+    node = obj.__schema__.children[0]
+    return [_serialize_value(node, value) for value in obj]
+
+
+def _serialize_value(node, value):
+    if isinstance(value, (_MappingNode, _SequenceNode)):
+        return value._cstruct()
+    return node.serialize(value)
+
+
+def _unexpected(schema, data):
+    """
+    Returns the items in `data` which do not correspond to nodes in `schema`.
+    """
+    names = set(node.name for node in schema)
+    return dict((name, value) for name, value in data.items()
+                if name not in names)
+
+
+_identifier = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+
+
+def _generate_methods(cls):
+    """
+    Generates `__init__`, `_update_from_dict` and `appstruct` for a content
+    type, unrolling the loops over the schema's nodes.
+    """
+    schema = cls.__schema__
+    namespace = {
+        '_cls': cls,
+        '_schema': schema,
+        '_null': colander.null,
+        '_Invalid': colander.Invalid,
+        '_shared_appstruct': _shared_appstruct,
+        '_unexpected': _unexpected,
+        '_setattr': setattr,
+        '_touch': _touch,
+    }
+
+    init = [
+        'def __init__(self, **data):',
+        '    try:',
+        '        super(_cls, self).__init__()',
+        '    except TypeError:',
+        '        raise TypeError(',
+        '            "Limone content types may only extend types with no-arg "',
+        '            "constructors.")',
+        '    self.__content__ = self',
+        '    error = None',
+        '    found = 0',
+    ]
+    update = [
+        'def _update_from_dict(self, data, skip_missing):',
+        '    error = None',
+        '    found = 0',
+    ]
+    appstruct = []
+
+    for i, node in enumerate(schema):
+        name = node.name
+        prop = cls.__dict__[name]
+        namespace['_p%d' % i] = prop
+        if _identifier.match(name) and not keyword.iskeyword(name):
+            getter = 'self.%s' % name
+            setter = 'self.%s = %%s' % name
+        else:
+            getter = 'getattr(self, %r)' % name
+            setter = '_setattr(self, %r, %%s)' % name
+        leaf = type(prop) is _LeafNodeProperty and prop._check is not None
+        if leaf:
+            # Call the leaf validator directly, skipping the descriptor, and
+            # skip coercion altogether for values that already have the
+            # right type.
+            attr = prop._attr
+            namespace['_c%d' % i] = prop._check
+            store = ['_setattr(self, %r, _c%d(value))' % (attr, i)]
+            fast = _fast_path_type(node)
+            if fast is not None:
+                namespace['_t%d' % i] = fast
+                if fast is unicode:
+                    test = 'type(value) is _t%d and value' % i
+                else:
+                    test = 'type(value) is _t%d' % i
+                store = ['if %s:' % test]
+                validator = node.validator
+                if validator is not None:
+                    namespace['_n%d' % i] = node
+                    namespace['_v%d' % i] = validator
+                    store.append('    _v%d(_n%d, value)' % (i, i))
+                store.extend([
+                    '    _setattr(self, %r, value)' % attr,
+                    'else:',
+                    '    _setattr(self, %r, _c%d(value))' % (attr, i),
+                ])
+        else:
+            store = [setter % 'value']
+
+        default = _precompute_default(cls, prop)
+        if default is not _marker:
+            namespace['_d%d' % i] = default
+            set_default = ['_setattr(self, %r, _d%d)' % (prop._attr, i)]
+        else:
+            set_default = [setter % '_null']
+
+        def set_value(lines, indent, statements):
+            lines.append(indent + 'try:')
+            lines.extend(indent + '    ' + line for line in statements)
+            lines.extend([
+                indent + 'except _Invalid, e:',
+                indent + '    if error is None:',
+                indent + '        error = _Invalid(_schema)',
+                indent + '    error.add(e, %d)' % i,
+            ])
+
+        init.extend([
+            '    value = data.get(%r, _null)' % name,
+            '    if value is not _null:',
+            '        found += 1',
+        ])
+        set_value(init, '        ', store)
+        init.append('    else:')
+        init.append('        found += %r in data' % name)
+        set_value(init, '        ', set_default)
+
+        if cls._track_changes:
+            # Values stored without going through the descriptor need to be
+            # recorded as changes explicitly.
+            touch = '_touch(self, %r)' % name
+            if leaf:
+                store = store + [touch]
+            if default is not _marker:
+                set_default = set_default + [touch]
+
+        update.extend([
+            '    if %r in data:' % name,
+            '        found += 1',
+            '        value = data[%r]' % name,
+            '    else:',
+            '        value = _null',
+            '    if value is not _null:',
+        ])
+        set_value(update, '        ', store)
+        update.append('    elif not skip_missing:')
+        set_value(update, '        ', set_default)
+
+        if leaf:
+            appstruct.append('        %r: %s,' % (name, getter))
+        else:
+            appstruct.append('        %r: _shared_appstruct(_p%d.__get__(self)),'
+                             % (name, i))
+
+    finish = [
+        '    if error is not None:',
+        '        raise error',
+        '    if found < len(data):',
+    ]
+    init.extend(finish)
+    init.extend([
+        '        raise TypeError(',
+        '            "Unexpected keyword argument(s): %s" %',
+        '            repr(_unexpected(_schema, data)))',
+    ])
+    update.extend(finish)
+    update.extend([
+        '        return _unexpected(_schema, data)',
+        '    return {}',
+    ])
+    appstruct = ['def appstruct(self):', '    return {'] + appstruct + ['    }']
+
+    source = '\n\n'.join('\n'.join(lines) for lines in
+                          (init, update, appstruct)) + '\n'
+    code = compile(source, '<limone generated %s>' % cls.__name__, 'exec')
+    exec code in namespace
+
+    cls.__init__ = namespace['__init__']
+    cls._update_from_dict = namespace['_update_from_dict']
+    cls.appstruct = namespace['appstruct']
+    cls._generated_source = source
+
+
+_marker = object()
+
+
+def _precompute_default(cls, prop):
+    """
+    Returns the value a leaf property will take when no value is given for it,
+    if that value can be computed ahead of time, else `_marker`.
+    """
+    if type(prop) is not _LeafNodeProperty or prop._check is None:
+        return _marker
+    try:
+        value = prop._validate(cls, colander.null)
+    except colander.Invalid:
+        return _marker
+    if not isinstance(value, _immutable):
+        return _marker
+    return value
+
+
+def _fast_path_type(node):
+    """
+    Returns the type of value which a leaf node would accept unchanged, if
+    values of that type can skip coercion entirely.
+    """
+    if node.preparer is not None or isinstance(node.validator,
+                                               colander.deferred):
+        return None
+    typ = node.typ
+    if type(typ) is colander.String:
+        encoding = typ.encoding
+        if encoding is None or codecs.lookup(encoding).name == 'utf-8':
+            return unicode
+        return None
+    return _fast_path_types.get(type(typ))
+
+
+_fast_path_types = {
+    colander.Integer: int,
+    colander.Float: float,
+    colander.Boolean: bool,
+    colander.Date: datetime.date,
+}
+
+
+_immutable = (type(None), bool, int, long, float, basestring,
+              decimal.Decimal, datetime.date, datetime.time,
+              datetime.timedelta)
+
+
 def _appstruct_node(value):
     get_appstruct = getattr(value, 'appstruct', None)
     if get_appstruct is not None:
@@ -491,6 +2838,33 @@ def _appstruct_node(value):
     return value
 
 
+def _shared_appstruct(value):
+    # Like `_appstruct_node`, for building other appstructs from: with change
+    # tracking, the cached appstructs of nested nodes are used as they are,
+    # rather than copied, so the result mustn't be changed.
+    if isinstance(value, (_MappingNode, _SequenceNode)):
+        if value.__content__._track_changes:
+            return _cached(value, 0, type(value)._appstruct)
+        return value._appstruct()
+    return value
+
+
+def _copied(value):
+    """
+    Returns a copy of `value`, a cached appstruct or cstruct, which shares no
+    dictionaries or lists with it, so that changing the copy leaves the cache
+    as it is.
+    """
+    typ = type(value)
+    if typ is dict:
+        return dict([(key, _copied(item)) for key, item in value.iteritems()])
+    if typ is list:
+        return [_copied(item) for item in value]
+    if typ is tuple:
+        return tuple([_copied(item) for item in value])
+    return value
+
+
 class _FinderLoader(object):
     def __init__(self, limone, module):
         self.limone = limone
@@ -515,3 +2889,81 @@ class _FinderLoader(object):
         if module in sys.modules:
             del sys.modules[module]
         del self.limone
+
+
+def _random():
+    # The random module imports hashlib, so it's only imported when
+    # instances are sampled.
+    import random
+    return random.random()
+
+
+# The batch, collection and stream modules are only imported when what they
+# define is first used, so that applications which don't use them don't pay
+# for importing them.
+
+def validate_column(node, values, trusted=()):
+    """
+    See `limone.batch.validate_column`.
+    """
+    from limone.batch import validate_column
+    return validate_column(node, values, trusted)
+
+
+def iter_deserialize(content_type, fileobj, batch_size=1000, chunk_size=None):
+    """
+    See `limone.stream.iter_deserialize`.
+    """
+    from limone.stream import iter_deserialize
+    return iter_deserialize(content_type, fileobj, batch_size, chunk_size)
+
+
+def iter_deserialize_futures(content_type, cstructs, submit, chunk_size=1000,
+                             max_pending=2):
+    """
+    See `limone.stream.iter_deserialize_futures`.
+    """
+    from limone.stream import iter_deserialize_futures
+    return iter_deserialize_futures(content_type, cstructs, submit,
+                                    chunk_size, max_pending)
+
+
+class _Deferred(type):
+    """
+    Metaclass for stand-ins for classes which are defined in modules that are
+    only imported when the class is first used.  Calling the stand-in, or
+    getting attributes of it, uses the class, and instances of the class are
+    instances of the stand-in.
+    """
+
+    def _load(cls):
+        module, name = cls._defined_in
+        return getattr(__import__(module, fromlist=[name]), name)
+
+    def __call__(cls, *args, **kw):
+        return cls._load()(*args, **kw)
+
+    def __getattr__(cls, name):
+        return getattr(cls._load(), name)
+
+    def __instancecheck__(cls, obj):
+        return isinstance(obj, cls._load())
+
+    def __subclasscheck__(cls, subclass):
+        return issubclass(subclass, cls._load())
+
+
+class ContentCollection(object):
+    """
+    See `limone.collection.ContentCollection`.
+    """
+    __metaclass__ = _Deferred
+    _defined_in = ('limone.collection', 'ContentCollection')
+
+
+class JSONLinesFeed(object):
+    """
+    See `limone.stream.JSONLinesFeed`.
+    """
+    __metaclass__ = _Deferred
+    _defined_in = ('limone.stream', 'JSONLinesFeed')
@@ -0,0 +1,236 @@
+"""
+Validation of many values for the same leaf node at once.
+"""
+import array
+import colander
+
+import limone
+
+
+def validate_column(node, values, trusted=()):
+    """
+    Validates `values`, a sequence of appstruct values for the leaf node
+    `node`, with the same results as validating each of them in turn when
+    setting an attribute.  Returns a tuple of a list of the validated values
+    and a list of `(index, colander.Invalid)` tuples for the values which
+    aren't valid.  The values at the positions of errors aren't meaningful.
+    `trusted` is a collection of the positions of values which are
+    known to be valid already, which are neither coerced nor validated.
+
+    `colander.Range`, `colander.OneOf` and `colander.Length` validators, and
+    `colander.All` validators made up of them, are run over the whole column
+    at once, using NumPy if it is installed.  The validator is then called
+    for each failing value, so that errors have the same messages they would
+    otherwise.  Other validators are called for each value.
+
+    A `TypeError` is raised if `node` isn't a leaf node of one of the
+    standard Colander types.
+    """
+    coerce = limone._leaf_coercers.get(type(node.typ))
+    if coerce is None:
+        raise TypeError('Cannot validate a column of %r.' % node.typ)
+
+    values, skip, errors = _coerce_column(node, coerce, values, trusted)
+    validator = node.validator
+    if validator is None or isinstance(validator, colander.deferred):
+        return values, errors
+
+    if skip:
+        positions = [i for i in xrange(len(values)) if i not in skip]
+        checked = [values[i] for i in positions]
+    else:
+        positions = None
+        checked = values
+
+    failed = _failing(node, validator, checked)
+    if positions is not None:
+        failed = [positions[i] for i in failed]
+    for i in failed:
+        try:
+            validator(node, values[i])
+        except colander.Invalid, e:
+            errors.append((i, e))
+    if skip:
+        errors.sort(key=lambda error: error[0])
+    return values, errors
+
+
+def _coerce_column(node, coerce, values, trusted):
+    """
+    Does everything a leaf validator does other than calling the node's
+    validator.  Returns a tuple of the coerced values, the set of positions
+    which aren't to be validated and a list of errors.
+    """
+    null = colander.null
+    if not trusted and node.preparer is None:
+        if _numeric_array(node, values):
+            return values, (), []
+
+        # Most of the time there aren't any null values to replace, so try
+        # coercing everything in one go first.
+        # Values are compared by identity, since comparing unicode to other
+        # types is slow.
+        try:
+            coerced = [coerce(node, value) for value in values
+                       if value is not null]
+        except colander.Invalid:
+            pass
+        else:
+            if (len(coerced) == len(values) and
+                not any(value is null for value in coerced)):
+                return coerced, (), []
+
+    required = colander.required
+    deferred = colander.deferred
+    coerced = []
+    append = coerced.append
+    skip = set(trusted)
+    errors = []
+    for i, value in enumerate(values):
+        if i in skip:
+            append(value)
+            continue
+        try:
+            if value is null:
+                value = node.default
+                if isinstance(value, deferred):
+                    value = null
+            if value is not null:
+                value = coerce(node, value)
+            preparer = node.preparer
+            if preparer is not None:
+                value = preparer(value)
+            if value is null:
+                value = node.missing
+                if value is required or isinstance(value, deferred):
+                    raise colander.Invalid(node, limone._('Required'))
+                skip.add(i)
+        except colander.Invalid, e:
+            errors.append((i, e))
+            skip.add(i)
+        append(value)
+    return coerced, skip, errors
+
+
+def _numeric_array(node, values):
+    """
+    Returns whether `values` is an array of numbers which don't need coercing
+    to the type of `node`.
+    """
+    typ = type(node.typ)
+    if typ is colander.Integer:
+        kinds, typecodes = 'iu', 'bBhHiIlL'
+    elif typ is colander.Float:
+        kinds, typecodes = 'f', 'd'
+    else:
+        return False
+    if isinstance(values, array.array):
+        return values.typecode in typecodes
+    dtype = getattr(values, 'dtype', None)
+    return dtype is not None and dtype.kind in kinds
+
+
+def _failing(node, validator, values):
+    """
+    Returns the positions of the values which `validator` might reject.
+    """
+    check = _column_checks.get(type(validator))
+    if check is not None:
+        try:
+            failed = check(node, validator, values)
+        except TypeError:
+            # Eg values which can't be compared with the bounds of a Range.
+            # Calling the validator gives the same error it always would.
+            failed = None
+        if failed is not None:
+            return failed
+
+    failed = []
+    for i, value in enumerate(values):
+        try:
+            validator(node, value)
+        except colander.Invalid:
+            failed.append(i)
+    return failed
+
+
+def _check_all(node, validator, values):
+    failed = set()
+    for subvalidator in validator.validators:
+        failed.update(_failing(node, subvalidator, values))
+    return sorted(failed)
+
+
+def _check_range(node, validator, values):
+    min, max = validator.min, validator.max
+    numpy = _numpy(node, values)
+    if numpy is not None:
+        values = numpy.asarray(values)
+        failed = numpy.zeros(len(values), dtype=bool)
+        if min is not None:
+            failed |= values < min
+        if max is not None:
+            failed |= values > max
+        return numpy.flatnonzero(failed).tolist()
+
+    if max is None:
+        return [i for i, value in enumerate(values) if value < min]
+    if min is None:
+        return [i for i, value in enumerate(values) if value > max]
+    return [i for i, value in enumerate(values)
+            if value < min or value > max]
+
+
+def _check_one_of(node, validator, values):
+    choices = validator.choices
+    numpy = _numpy(node, values)
+    if numpy is not None:
+        try:
+            failed = numpy.in1d(values, list(choices), invert=True)
+        except (TypeError, ValueError):
+            pass
+        else:
+            return numpy.flatnonzero(failed).tolist()
+
+    try:
+        choices = frozenset(choices)
+    except TypeError:
+        # Unhashable choices are searched for one at a time, as by OneOf.
+        pass
+    return [i for i, value in enumerate(values) if value not in choices]
+
+
+def _check_length(node, validator, values):
+    min, max = validator.min, validator.max
+    lengths = map(len, values)
+    if max is None:
+        return [i for i, n in enumerate(lengths) if n < min]
+    if min is None:
+        return [i for i, n in enumerate(lengths) if n > max]
+    return [i for i, n in enumerate(lengths) if n < min or n > max]
+
+
+def _numpy(node, values):
+    """
+    Returns the numpy module, if it is installed and `values` can be checked
+    with it.
+    """
+    if type(node.typ) not in (colander.Integer, colander.Float):
+        return None
+    if not len(values) or not (isinstance(values, array.array) or
+                               hasattr(values, 'dtype') or
+                               isinstance(values[0], (int, long, float))):
+        return None
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
+
+
+_column_checks = {
+    colander.All: _check_all,
+    colander.Range: _check_range,
+    colander.OneOf: _check_one_of,
+    colander.Length: _check_length,
+}
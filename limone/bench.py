@@ -0,0 +1,327 @@
+"""
+Benchmarks for content types, run with::
+
+    python -m limone.bench [options]
+
+Results are written as JSON, so that the results of different runs can be
+compared with `--compare`.
+"""
+import colander
+import copy
+import json
+import optparse
+import pickle
+import platform
+import sys
+import time
+import timeit
+
+import limone
+
+
+class Friend(colander.TupleSchema):
+    rank = colander.SchemaNode(colander.Int(),
+                               validator=colander.Range(0, 9999))
+    name = colander.SchemaNode(colander.String())
+
+
+class Phone(colander.MappingSchema):
+    location = colander.SchemaNode(colander.String(),
+                                   validator=colander.OneOf(['home', 'work']))
+    number = colander.SchemaNode(colander.String())
+
+
+class Friends(colander.SequenceSchema):
+    friend = Friend()
+
+
+class Phones(colander.SequenceSchema):
+    phone = Phone()
+
+
+class Person(colander.MappingSchema):
+    name = colander.SchemaNode(colander.String())
+    age = colander.SchemaNode(colander.Int(),
+                              validator=colander.Range(0, 200))
+    friends = Friends()
+    phones = Phones()
+
+
+class FlatPerson(colander.MappingSchema):
+    name = colander.SchemaNode(colander.String())
+    age = colander.SchemaNode(colander.Int(),
+                              validator=colander.Range(0, 200))
+    height = colander.SchemaNode(colander.Float(), missing=None)
+    active = colander.SchemaNode(colander.Boolean(), default=True)
+
+
+def flat():
+    """
+    A few leaf attributes.
+    """
+    appstruct = {'name': u'Jack', 'age': 52, 'height': 1.8, 'active': True}
+    return FlatPerson(), appstruct, ('age', 53)
+
+
+def wide(width=50):
+    """
+    Lots of leaf attributes, of each of the common types.
+    """
+    types = [
+        (colander.String, u'value'),
+        (colander.Int, 42),
+        (colander.Float, 4.2),
+        (colander.Boolean, True),
+    ]
+    schema = colander.SchemaNode(colander.Mapping())
+    appstruct = {}
+    for i in xrange(width):
+        typ, value = types[i % len(types)]
+        name = 'field%d' % i
+        schema.add(colander.SchemaNode(typ(), name=name))
+        appstruct[name] = value
+    return schema, appstruct, ('field1', 43)
+
+
+def nested(depth=6):
+    """
+    Mappings nested `depth` deep, with a couple of leaves at each level.
+    """
+    schema = None
+    appstruct = None
+    for i in xrange(depth):
+        node = colander.SchemaNode(colander.Mapping(), name='child')
+        node.add(colander.SchemaNode(colander.String(), name='name'))
+        node.add(colander.SchemaNode(colander.Int(), name='level'))
+        value = {'name': u'level %d' % i, 'level': i}
+        if schema is not None:
+            node.add(schema)
+            value['child'] = appstruct
+        schema = node
+        appstruct = value
+    return schema, appstruct, ('level', 7)
+
+
+def sequences(length=20):
+    """
+    The `Person` example from the README, with `length` friends and phones.
+    """
+    appstruct = {
+        'name': u'Jack',
+        'age': 52,
+        'friends': [(i, u'Friend %d' % i) for i in xrange(length)],
+        'phones': [{'location': ['home', 'work'][i % 2],
+                    'number': u'555-%04d' % i} for i in xrange(length)],
+    }
+    return Person(), appstruct, ('age', 53)
+
+
+schemas = [
+    ('flat', flat),
+    ('wide', wide),
+    ('nested', nested),
+    ('sequences', sequences),
+]
+
+
+def benchmarks(ct, appstruct, assignment):
+    """
+    Returns a list of `(name, function)` pairs, where `function` does one
+    operation on instances of the content type `ct`.
+    """
+    obj = ct(**appstruct)
+    cstruct = obj.serialize()
+    pickled = pickle.dumps(obj, 2)
+    name, value = assignment
+    update = {name: ct.__schema__[name].serialize(value)}
+
+    def init():
+        ct(**appstruct)
+
+    def set_attr():
+        setattr(obj, name, value)
+
+    def get_attr():
+        getattr(obj, name)
+
+    def deserialize_update():
+        obj.deserialize_update(update)
+
+    return [
+        ('init', init),
+        ('set', set_attr),
+        ('get', get_attr),
+        ('appstruct', obj.appstruct),
+        ('serialize', obj.serialize),
+        ('deserialize', lambda: ct.deserialize(cstruct)),
+        ('deserialize_update', deserialize_update),
+        ('pickle', lambda: pickle.dumps(obj, 2)),
+        ('unpickle', lambda: pickle.loads(pickled)),
+    ]
+
+
+def sequence_benchmarks(ct, appstruct, assignment, size=100):
+    """
+    Operations on the `phones` sequence of a `Person`.  Appending and
+    extending start from an empty sequence and add `size` items each time.
+    """
+    obj = ct(**appstruct)
+    phones = appstruct['phones']
+    items = [copy.deepcopy(phones[i % len(phones)]) for i in xrange(size)]
+
+    def append():
+        obj.phones = []
+        seq = obj.phones
+        for item in items:
+            seq.append(item)
+
+    def extend():
+        obj.phones = []
+        obj.phones.extend(items)
+
+    def take_slice():
+        obj.phones[5:15]
+
+    return [
+        ('append%d' % size, append),
+        ('extend%d' % size, extend),
+        ('slice', take_slice),
+    ]
+
+
+def run(options=None, select=None, repeat=3, min_time=0.2):
+    """
+    Runs the benchmarks whose names, of the form `schema.benchmark`, contain
+    `select`, for content types made with the `make_content_type` keyword
+    arguments in `options`.  Each is timed `repeat` times for at least
+    `min_time` seconds.  Returns a dictionary describing the run, with a list
+    of results.
+    """
+    options = options or {}
+    registry = limone.Registry()
+    types = []
+    for schema_name, make_schema in schemas:
+        schema, appstruct, assignment = make_schema()
+        ct = limone.make_content_type(schema, schema_name.capitalize(),
+                                      **options)
+        registry.register_content_type(ct)
+        types.append((schema_name, ct, appstruct, assignment))
+
+    # The content types need to be importable to be pickled.
+    registry.hook_import('__limone_bench__')
+    try:
+        results = []
+        for schema_name, ct, appstruct, assignment in types:
+            funcs = benchmarks(ct, appstruct, assignment)
+            if schema_name == 'sequences':
+                funcs += sequence_benchmarks(ct, appstruct, assignment)
+            for name, func in funcs:
+                name = '%s.%s' % (schema_name, name)
+                if select and select not in name:
+                    continue
+                number, times = _time(func, repeat, min_time)
+                results.append({
+                    'name': name,
+                    'number': number,
+                    'times': times,
+                    'best': min(times),
+                })
+    finally:
+        registry.unhook_import()
+
+    return {
+        'python': sys.version.split()[0],
+        'implementation': platform.python_implementation(),
+        'platform': platform.platform(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'options': options,
+        'results': results,
+    }
+
+
+def _time(func, repeat, min_time):
+    """
+    Returns the number of calls to `func` which take at least `min_time`
+    seconds, and the time per call for `repeat` runs of that many calls.
+    """
+    timer = timeit.Timer(func)
+    number = 1
+    while True:
+        elapsed = timer.timeit(number)
+        if elapsed >= min_time:
+            break
+        number *= 2
+    times = [elapsed / number]
+    for i in xrange(repeat - 1):
+        times.append(timer.timeit(number) / number)
+    return number, times
+
+
+def compare(old, new):
+    """
+    Returns lines of text comparing the best times of two runs.
+    """
+    old_times = dict((r['name'], r['best']) for r in old['results'])
+    lines = []
+    for result in new['results']:
+        name = result['name']
+        before = old_times.get(name)
+        after = result['best']
+        if before is None:
+            lines.append('%-32s %12s %12.3f' % (name, '-', after * 1e6))
+        else:
+            lines.append('%-32s %12.3f %12.3f %7.2fx' % (
+                name, before * 1e6, after * 1e6, before / after))
+    return lines
+
+
+def main(argv=None, out=None):
+    if out is None:
+        out = sys.stdout
+    parser = optparse.OptionParser(
+        usage='%prog [options]\n       %prog --compare OLD NEW')
+    parser.add_option('-k', '--select', metavar='TEXT',
+                      help='Only run benchmarks whose names contain TEXT.')
+    parser.add_option('-r', '--repeat', type='int', default=3,
+                      help='Number of times to time each benchmark.')
+    parser.add_option('-t', '--min-time', type='float', default=0.2,
+                      help='Minimum number of seconds for each timing.')
+    parser.add_option('-o', '--output', metavar='FILE',
+                      help='Write results to FILE rather than stdout.')
+    parser.add_option('--codegen', action='store_true', default=False)
+    parser.add_option('--layout', default='dict')
+    parser.add_option('--sequences', default='items')
+    parser.add_option('--lazy', action='store_true', default=False)
+    parser.add_option('--track-changes', action='store_true', default=False)
+    parser.add_option('--compare', action='store_true', default=False,
+                      help='Compare the results in two files, in '
+                           'microseconds per operation.')
+    opts, args = parser.parse_args(argv)
+
+    if opts.compare:
+        if len(args) != 2:
+            parser.error('--compare needs two files')
+        with open(args[0]) as f:
+            old = json.load(f)
+        with open(args[1]) as f:
+            new = json.load(f)
+        for line in compare(old, new):
+            print >> out, line
+        return
+    if args:
+        parser.error('unexpected arguments')
+
+    options = dict(codegen=opts.codegen, layout=opts.layout,
+                   sequences=opts.sequences, lazy=opts.lazy,
+                   track_changes=opts.track_changes)
+    results = run(options, opts.select, opts.repeat, opts.min_time)
+    if opts.output:
+        with open(opts.output, 'w') as f:
+            json.dump(results, f, indent=1, sort_keys=True)
+    else:
+        json.dump(results, out, indent=1, sort_keys=True)
+        print >> out
+
+
+if __name__ == '__main__':
+    main()
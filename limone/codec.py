@@ -0,0 +1,319 @@
+"""
+A compact binary encoding of content, generated from the schema of a content
+type.
+
+An encoded instance starts with a tag identifying the layout of the
+encoding, as a four byte little endian unsigned integer, followed by the
+values of its attributes in schema order:
+
+- Integers are zigzag encoded varints, so small negative numbers are small
+  too.  Dates are encoded as the varint of their ordinal.
+- Floats are eight byte little endian doubles.  Booleans are a single byte.
+- Strings are a varint length followed by that many bytes of UTF-8.
+  Decimals are encoded as strings, as are values of other leaf types, using
+  the type's own serialization.
+- Mappings and tuples are their values in schema order.  Sequences are a
+  varint count followed by their items.
+- Values of nodes which aren't required are preceded by a byte which is `1`
+  if the value is the node's `missing` value, in which case nothing else is
+  written, and `0` otherwise.
+"""
+import codecs
+import colander
+import datetime
+import decimal
+import struct
+import zlib
+
+_tag = struct.Struct('<I')
+_float = struct.Struct('<d')
+_utf_8_decode = codecs.utf_8_decode
+
+
+def encode(obj):
+    """
+    Returns `obj`, an instance of a content type, encoded as a string.
+    """
+    cls = type(obj)
+    out = [_tag.pack(_codec_tag(cls))]
+    for prop, (enc, dec) in zip(cls._props, _codecs(cls)):
+        enc(prop._pack(prop.__get__(obj)), out)
+    return ''.join(out)
+
+
+def decode(cls, buf, offset=0, validate=False):
+    """
+    Decodes an instance of `cls` from `buf`, starting at `offset`.  Returns a
+    tuple of the instance and the offset just past its end.  `buf` may be any
+    object which supports the buffer interface, such as a string, a
+    `memoryview` or an `mmap`, and isn't copied.
+
+    Values are trusted not to need validating, unless `validate` is `True`,
+    in which case the instance is created with `from_appstruct` and a
+    `colander.Invalid` is raised for invalid values.  A `ValueError` is
+    raised if `buf` doesn't contain an encoded instance of `cls`.
+    """
+    if isinstance(buf, bytearray):
+        # Indexing a memoryview gives one byte strings, like the other types.
+        buf = memoryview(buf)
+    try:
+        tag, = _tag.unpack_from(buf, offset)
+        if tag != _codec_tag(cls):
+            raise ValueError('Not an encoded %s.' % cls.__name__)
+        pos = offset + 4
+        values = []
+        for enc, dec in _codecs(cls):
+            value, pos = dec(buf, pos)
+            values.append(value)
+    except (IndexError, struct.error):
+        raise ValueError('Truncated %s.' % cls.__name__)
+
+    if validate:
+        schema = cls.__schema__
+        return cls.from_appstruct(_unpack(schema, values)), pos
+    obj = cls.__new__(cls)
+    obj.__setstate__((cls._schema_tag, cls._state_names, values, None))
+    return obj, pos
+
+
+def _unpack(node, value):
+    """
+    Turns a value packed for pickling back into an appstruct.
+    """
+    typ = node.typ
+    if isinstance(typ, colander.Mapping):
+        return dict([(child.name, _unpack(child, item))
+                     for child, item in zip(node.children, value)])
+    if isinstance(typ, colander.Sequence):
+        child = node.children[0]
+        return [_unpack(child, item) for item in value]
+    if isinstance(typ, colander.Tuple):
+        return tuple([_unpack(child, item)
+                      for child, item in zip(node.children, value)])
+    return value
+
+
+def _codec_tag(cls):
+    # The schema tag of the content type, which identifies the names, nesting
+    # and types of its nodes, combined with which of its leaf nodes are
+    # optional, whose values are preceded by a flag byte.
+    tag = cls.__dict__.get('_codec_tag')
+    if tag is None:
+        flags = ''.join([_optional(node) and '1' or '0'
+                         for node in _leaves(cls.__schema__)])
+        tag = cls._codec_tag = zlib.crc32(flags, cls._schema_tag) & 0xffffffff
+    return tag
+
+
+def _leaves(node):
+    for child in node.children:
+        if child.children:
+            for leaf in _leaves(child):
+                yield leaf
+        else:
+            yield child
+
+
+def _optional(node):
+    missing = node.missing
+    return not (missing is colander.required or
+                isinstance(missing, colander.deferred))
+
+
+def _codecs(cls):
+    # Generated the first time a content type is encoded or decoded.
+    codecs = cls.__dict__.get('_codecs')
+    if codecs is None:
+        codecs = cls._codecs = tuple(
+            [_node_codec(node) for node in cls.__schema__.children])
+    return codecs
+
+
+def _node_codec(node):
+    """
+    Returns a tuple of functions, `(encode, decode)`, for the values of
+    `node`.  `encode(value, out)` appends strings to the list `out`, and
+    `decode(buf, pos)` returns a tuple of the value and the position after
+    it.
+    """
+    typ = node.typ
+    if isinstance(typ, colander.Mapping):
+        return _mapping_codec(node)
+    if isinstance(typ, colander.Sequence):
+        return _sequence_codec(node)
+    if isinstance(typ, colander.Tuple):
+        return _mapping_codec(node)
+
+    enc, dec = _leaf_codecs.get(type(typ)) or _string_codec(node)
+    if not _optional(node):
+        return enc, dec
+    missing = node.missing
+
+    def encode_optional(value, out):
+        if value is missing or (type(value) is type(missing) and
+                                value == missing):
+            out.append('\x01')
+        else:
+            out.append('\x00')
+            enc(value, out)
+
+    def decode_optional(buf, pos):
+        if buf[pos] == '\x01':
+            return missing, pos + 1
+        return dec(buf, pos + 1)
+
+    return encode_optional, decode_optional
+
+
+def _mapping_codec(node):
+    # Also used for tuples, which are packed the same way.
+    codecs = [_node_codec(child) for child in node.children]
+    encoders = [enc for enc, dec in codecs]
+    decoders = [dec for enc, dec in codecs]
+
+    def encode(value, out):
+        for enc, item in zip(encoders, value):
+            enc(item, out)
+
+    def decode(buf, pos):
+        items = []
+        for dec in decoders:
+            item, pos = dec(buf, pos)
+            items.append(item)
+        return tuple(items), pos
+
+    return encode, decode
+
+
+def _sequence_codec(node):
+    enc, dec = _node_codec(node.children[0])
+
+    def encode(value, out):
+        _write_varint(len(value), out)
+        for item in value:
+            enc(item, out)
+
+    def decode(buf, pos):
+        n, pos = _read_varint(buf, pos)
+        items = []
+        for i in xrange(n):
+            item, pos = dec(buf, pos)
+            items.append(item)
+        return items, pos
+
+    return encode, decode
+
+
+def _string_codec(node):
+    # Leaf types we don't know about are encoded using their own
+    # serialization.
+    typ = node.typ
+
+    def encode(value, out):
+        cstruct = typ.serialize(node, value)
+        if not isinstance(cstruct, basestring):
+            raise TypeError('Cannot encode %r.' % value)
+        _encode_string(cstruct, out)
+
+    def decode(buf, pos):
+        cstruct, pos = _decode_string(buf, pos)
+        return typ.deserialize(node, cstruct), pos
+
+    return encode, decode
+
+
+def _write_varint(n, out):
+    while n > 0x7f:
+        out.append(chr(n & 0x7f | 0x80))
+        n >>= 7
+    out.append(chr(n))
+
+
+def _read_varint(buf, pos):
+    result = shift = 0
+    while True:
+        byte = ord(buf[pos])
+        pos += 1
+        result |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return result, pos
+        shift += 7
+
+
+def _encode_int(value, out):
+    if value >= 0:
+        _write_varint(value << 1, out)
+    else:
+        _write_varint((-value << 1) - 1, out)
+
+
+def _decode_int(buf, pos):
+    n, pos = _read_varint(buf, pos)
+    if n & 1:
+        return -((n + 1) >> 1), pos
+    return n >> 1, pos
+
+
+def _encode_float(value, out):
+    out.append(_float.pack(value))
+
+
+def _decode_float(buf, pos):
+    return _float.unpack_from(buf, pos)[0], pos + 8
+
+
+def _encode_bool(value, out):
+    out.append(value and '\x01' or '\x00')
+
+
+def _decode_bool(buf, pos):
+    return buf[pos] == '\x01', pos + 1
+
+
+def _encode_string(value, out):
+    if isinstance(value, unicode):
+        value = value.encode('utf-8')
+    _write_varint(len(value), out)
+    out.append(value)
+
+
+def _decode_string(buf, pos):
+    n, pos = _read_varint(buf, pos)
+    end = pos + n
+    if end > len(buf):
+        raise IndexError(end)
+    # Slicing a memoryview doesn't copy, but slicing a string or an mmap
+    # does, so those are decoded through a buffer object instead.
+    if type(buf) is memoryview:
+        data = buf[pos:end]
+    else:
+        data = buffer(buf, pos, n)
+    return _utf_8_decode(data, 'strict', True)[0], end
+
+
+def _encode_decimal(value, out):
+    _encode_string(str(value), out)
+
+
+def _decode_decimal(buf, pos):
+    value, pos = _decode_string(buf, pos)
+    return decimal.Decimal(value), pos
+
+
+def _encode_date(value, out):
+    _write_varint(value.toordinal(), out)
+
+
+def _decode_date(buf, pos):
+    n, pos = _read_varint(buf, pos)
+    return datetime.date.fromordinal(n), pos
+
+
+_leaf_codecs = {
+    colander.Integer: (_encode_int, _decode_int),
+    colander.Float: (_encode_float, _decode_float),
+    colander.Boolean: (_encode_bool, _decode_bool),
+    colander.String: (_encode_string, _decode_string),
+    colander.Decimal: (_encode_decimal, _decode_decimal),
+    colander.Date: (_encode_date, _decode_date),
+}
@@ -0,0 +1,335 @@
+"""
+Column oriented storage for large numbers of instances of one content type.
+"""
+import array
+import colander
+
+import limone
+from limone.batch import validate_column
+
+# Columns for these types are kept in arrays, of the given type code, rather
+# than in lists.
+_array_types = {
+    colander.Integer: 'l',
+    colander.Float: 'd',
+    colander.Boolean: 'b',
+}
+
+
+class ContentCollection(object):
+    """
+    A collection of rows, each holding the values of an instance of
+    `content_type`, stored a column per attribute.  Columns of integers,
+    floats and booleans are stored in an `array.array`, which takes a small
+    fraction of the memory of a list of instances.  A column falls back to a
+    list if it needs to hold a value which doesn't fit in its array, such as
+    `None` for an attribute which isn't required.  Mappings, sequences and
+    tuples are stored as their appstructs.
+
+    Booleans are stored as integers in their arrays, so their columns hold
+    `0` and `1` rather than `False` and `True`.
+
+    Rows are validated when they are added.  Indexing or iterating over the
+    collection returns `Row` objects, which read from and write to the
+    columns.
+    """
+
+    def __init__(self, content_type, rows=()):
+        self.content_type = content_type
+        self.schema = schema = content_type.__schema__
+        self._columns = columns = []
+        self._names = {}
+        self._checks = []
+        self._booleans = set()
+        for i, (node, prop) in enumerate(zip(schema, content_type._props)):
+            typecode = _array_types.get(type(node.typ))
+            if typecode is not None:
+                columns.append(array.array(typecode))
+            else:
+                columns.append([])
+            self._names[node.name] = i
+            if type(node.typ) is colander.Boolean:
+                self._booleans.add(i)
+            self._checks.append(_field_check(content_type, prop))
+        self._len = 0
+        if rows:
+            self.extend(rows)
+
+    @classmethod
+    def from_instances(cls, content_type, instances):
+        """
+        Returns a new collection holding the values of `instances`.
+        """
+        return cls(content_type, instances)
+
+    def to_instances(self):
+        """
+        Returns a list with an instance of the content type for each row.
+        """
+        return [row.to_instance() for row in self]
+
+    def __len__(self):
+        return self._len
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self._len
+        if not 0 <= index < self._len:
+            raise IndexError(index)
+        return Row(self, index)
+
+    def __iter__(self):
+        for index in xrange(self._len):
+            yield Row(self, index)
+
+    def column(self, name):
+        """
+        Returns the column for the attribute `name`, which is an
+        `array.array` or a list.  It must not be changed directly.
+        """
+        return self._columns[self._names[name]]
+
+    def as_numpy(self, name):
+        """
+        Returns a NumPy array sharing the memory of the column for the
+        attribute `name`, which must be stored in an `array.array`.  The
+        array is only valid until more rows are added.  Requires NumPy.
+        """
+        import numpy
+        column = self.column(name)
+        if not isinstance(column, array.array):
+            raise TypeError('Column %r is not stored in an array.' % name)
+        dtype = numpy.dtype(column.typecode)
+        return numpy.frombuffer(column, dtype=dtype)
+
+    def append(self, row):
+        """
+        Validates and adds `row`, which is either an instance of the content
+        type or an appstruct.  Raises `colander.Invalid` if it isn't valid.
+        """
+        self._add([[value] for value in self._validate_row(row)], 1)
+
+    def extend(self, rows):
+        """
+        Validates and adds each of `rows`.  If any of them are invalid, none
+        are added and a `colander.Invalid` is raised with the errors for all
+        of them, at the positions of the rows in `rows`.
+        """
+        content_type = self.content_type
+        schema = self.schema
+        props = content_type._props
+        names = [node.name for node in schema]
+        null = colander.null
+        columns = [[] for column in self._columns]
+        trusted = []
+        unexpected = {}
+        count = 0
+        for i, row in enumerate(rows):
+            if isinstance(row, content_type):
+                for column, prop in zip(columns, props):
+                    column.append(limone._appstruct_node(prop.__get__(row)))
+                trusted.append(i)
+            else:
+                found = 0
+                for column, name in zip(columns, names):
+                    if name in row:
+                        found += 1
+                        column.append(row[name])
+                    else:
+                        column.append(null)
+                if found < len(row):
+                    unexpected[i] = limone._unexpected(schema, row)
+            count += 1
+
+        # Values are validated a column at a time, which lets leaf values be
+        # validated in bulk.
+        errors = {}
+        for j, (node, prop) in enumerate(zip(schema, props)):
+            if type(prop) is limone._LeafNodeProperty and prop._check:
+                columns[j], column_errors = validate_column(
+                    node, columns[j], trusted)
+            else:
+                columns[j], column_errors = self._check_column(
+                    j, columns[j], trusted)
+            for i, e in column_errors:
+                error = errors.get(i)
+                if error is None:
+                    error = errors[i] = colander.Invalid(schema)
+                error.add(e, j)
+
+        for i, keys in unexpected.items():
+            if i not in errors:
+                errors[i] = colander.Invalid(schema, limone._(
+                    'Unrecognized keys in mapping: "${val}"',
+                    mapping={'val': keys}))
+
+        if errors:
+            node = colander.SchemaNode(colander.Sequence(), schema)
+            error = colander.Invalid(node)
+            for i in sorted(errors):
+                error.add(errors[i], i)
+            raise error
+
+        self._add(columns, count)
+
+    def _check_column(self, j, values, trusted):
+        check = self._checks[j]
+        trusted = set(trusted)
+        errors = []
+        for i, value in enumerate(values):
+            if i not in trusted:
+                try:
+                    values[i] = check(value)
+                except colander.Invalid, e:
+                    errors.append((i, e))
+        return values, errors
+
+    def _validate_row(self, row):
+        """
+        Returns a list of the validated values of `row`, in schema order.
+        """
+        content_type = self.content_type
+        schema = self.schema
+        if isinstance(row, content_type):
+            return [limone._appstruct_node(prop.__get__(row))
+                    for prop in content_type._props]
+
+        values = []
+        error = None
+        found = 0
+        null = colander.null
+        for i, (node, check) in enumerate(zip(schema.children, self._checks)):
+            name = node.name
+            if name in row:
+                found += 1
+                value = row[name]
+            else:
+                value = null
+            try:
+                values.append(check(value))
+            except colander.Invalid, e:
+                if error is None:
+                    error = colander.Invalid(schema)
+                error.add(e, i)
+
+        if error is not None:
+            raise error
+
+        if found < len(row):
+            raise colander.Invalid(schema, limone._(
+                'Unrecognized keys in mapping: "${val}"',
+                mapping={'val': limone._unexpected(schema, row)}))
+        return values
+
+    def _add(self, new_columns, count):
+        columns = self._columns
+        for i, (column, values) in enumerate(zip(columns, new_columns)):
+            if isinstance(column, array.array):
+                try:
+                    values = array.array(column.typecode, values)
+                except (TypeError, OverflowError):
+                    # Arrays only hold numbers of a certain size.
+                    columns[i] = column = list(column)
+            column.extend(values)
+        self._len += count
+
+    def _set(self, index, name, value):
+        i = self._names[name]
+        value = self._checks[i](value)
+        column = self._columns[i]
+        try:
+            column[index] = value
+        except (TypeError, OverflowError):
+            if not isinstance(column, array.array):
+                raise
+            self._columns[i] = column = list(column)
+            column[index] = value
+
+
+def _field_check(content_type, prop):
+    """
+    Returns a function which validates a value for `prop` and returns it as
+    it is stored in a column.
+    """
+    if type(prop) is limone._LeafNodeProperty and prop._check is not None:
+        return prop._check
+
+    def check(value):
+        return limone._appstruct_node(prop._validate(content_type, value))
+    return check
+
+
+class Row(object):
+    """
+    A row of a `ContentCollection`.  The values of the row are attributes,
+    just as for an instance of the content type.  Values of mappings,
+    sequences and tuples are appstructs, which must not be changed in place.
+    """
+    __slots__ = ('_collection', '_index')
+
+    def __init__(self, collection, index):
+        self._collection = collection
+        self._index = index
+
+    def __getattr__(self, name):
+        collection = self._collection
+        i = collection._names.get(name)
+        if i is None:
+            raise AttributeError(name)
+        value = collection._columns[i][self._index]
+        if i in collection._booleans and value is not None:
+            return bool(value)
+        return value
+
+    def __setattr__(self, name, value):
+        if name in Row.__slots__:
+            return super(Row, self).__setattr__(name, value)
+        if name not in self._collection._names:
+            raise AttributeError(name)
+        self._collection._set(self._index, name, value)
+
+    def _values(self):
+        collection = self._collection
+        index = self._index
+        booleans = collection._booleans
+        values = []
+        for i, column in enumerate(collection._columns):
+            value = column[index]
+            if i in booleans and value is not None:
+                value = bool(value)
+            values.append(value)
+        return values
+
+    def appstruct(self):
+        return dict(zip([node.name for node in self._collection.schema],
+                        self._values()))
+
+    def to_instance(self):
+        """
+        Returns an instance of the content type with the values of this row.
+        """
+        collection = self._collection
+        content_type = collection.content_type
+        values = [_pack(node, value) for node, value in
+                  zip(collection.schema, self._values())]
+        obj = content_type.__new__(content_type)
+        obj.__setstate__((content_type._schema_tag,
+                          content_type._state_names, values, None))
+        return obj
+
+
+def _pack(node, value):
+    """
+    Turns an appstruct into the form values are pickled in.
+    """
+    typ = node.typ
+    if isinstance(typ, colander.Mapping):
+        return tuple([_pack(child, value[child.name])
+                      for child in node.children])
+    if isinstance(typ, colander.Sequence):
+        child = node.children[0]
+        return [_pack(child, item) for item in value]
+    if isinstance(typ, colander.Tuple):
+        return tuple([_pack(child, item)
+                      for child, item in zip(node.children, value)])
+    return value
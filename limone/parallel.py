@@ -0,0 +1,120 @@
+"""
+Parallel deserialization of content using a pool of worker processes.
+"""
+import multiprocessing
+import sys
+
+import limone
+from limone.stream import _chunks
+
+
+def deserialize_parallel(content_type, cstructs, registry=None, processes=None,
+                         chunk_size=1000, appstructs=False):
+    """
+    Deserialize `cstructs` as instances of `content_type` using a pool of
+    `processes` worker processes, defaulting to one per CPU.  Returns a tuple
+    of `(results, errors)` in the same form as `deserialize_many`, in the same
+    order as `cstructs`.  Each worker is sent `chunk_size` cstructs at a time.
+
+    Instances are pickled to send them back from the workers, so
+    `content_type` must be importable in the parent process.  For content
+    types which are generated imperatively, pass the `registry` the type is
+    registered with.  Its import hook is installed for the duration of the
+    call, if it isn't already, and each worker recreates the registry's
+    content types and installs the same hook, so that types which only exist
+    in the parent process can be used.  Alternatively, if `appstructs` is
+    `True`, workers send back the appstructs of validated instances rather
+    than the instances themselves.
+    """
+    unhook = False
+    if registry is None:
+        recipes = module = None
+        task_type = content_type
+    else:
+        if registry._finder_loader is None:
+            registry.hook_import()
+            unhook = True
+        module = registry._finder_loader.module
+        recipes = _recipes(registry)
+        task_type = (module, content_type.__name__)
+
+    pool = multiprocessing.Pool(
+        processes, initializer=_init_worker, initargs=(recipes, module))
+    try:
+        tasks = ((task_type, chunk, appstructs)
+                 for chunk in _chunks(cstructs, chunk_size))
+        results = []
+        errors = []
+        for chunk_results, chunk_errors in pool.imap(_deserialize_chunk,
+                                                     tasks):
+            offset = len(results)
+            results.extend(chunk_results)
+            errors.extend((offset + i, e) for i, e in chunk_errors)
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+        if unhook:
+            registry.unhook_import()
+
+    return results, errors
+
+
+def _recipes(registry):
+    """
+    Returns a picklable description of each content type in `registry`, from
+    which a worker process can recreate it.  Types which can be imported from
+    the module in which they were defined are imported, others are generated
+    again.
+    """
+    recipes = []
+    for ct in registry.get_content_types():
+        name = ct.__name__
+        module = getattr(ct, '_original__module__', ct.__module__)
+        if getattr(sys.modules.get(module), name, None) is ct:
+            recipes.append(('import', name, module))
+        else:
+            schema, bases, meta, property_factory, options = ct._make_args
+            recipes.append(('make', name, (schema, bases, meta,
+                                           property_factory, options)))
+    return recipes
+
+
+def _init_worker(recipes, module):
+    if recipes is None:
+        return
+
+    try:
+        __import__(module)
+        # The worker was forked from a process which has the import hook.
+        return
+    except ImportError:
+        pass
+
+    registry = limone.Registry()
+    for how, name, args in recipes:
+        if how == 'import':
+            __import__(args)
+            ct = getattr(sys.modules[args], name)
+        else:
+            schema, bases, meta, property_factory, options = args
+            ct = limone.make_content_type(
+                schema, name, bases=bases, meta=meta,
+                property_factory=property_factory, **options)
+        registry.register_content_type(ct)
+    registry.hook_import(module)
+
+
+def _deserialize_chunk(task):
+    content_type, cstructs, appstructs = task
+    if isinstance(content_type, tuple):
+        module, name = content_type
+        __import__(module)
+        content_type = getattr(sys.modules[module], name)
+    instances, errors = content_type.deserialize_many(cstructs)
+    if appstructs:
+        instances = [instance and instance.appstruct()
+                     for instance in instances]
+    return instances, errors
@@ -0,0 +1,250 @@
+"""
+Changes to content objects described by patches, in the style of JSON Patch
+(RFC 6902), which only validate the values they change.
+
+A patch is a list of operations, each of which is a dictionary with an `op`,
+one of `'add'`, `'remove'`, `'replace'`, `'move'`, `'copy'` or `'test'`, and a
+`path`, as well as a `value` or a `from` path for the operations which need
+one::
+
+    [{'op': 'replace', 'path': '/phones/0/number', 'value': '555-1234'},
+     {'op': 'add', 'path': '/phones/-',
+      'value': {'location': 'work', 'number': '555-4321'}}]
+
+Paths are JSON Pointers, or dotted paths such as `phones.0.number`.  A
+dictionary of paths and values is also accepted as a patch, which replaces
+the value at each path.
+
+Values are validated by assigning them to the attribute of the content object
+or nested mapping, or to the item of the sequence, which holds them, so only
+the values assigned are validated and everything else is left as it is.
+Removing an attribute of a mapping sets it to `colander.null`, which gives it
+its default value.  Operations are applied in order.  If one of them fails,
+those which were applied already are undone and the error is raised: a
+`colander.Invalid` for invalid values, located by its path, or a `ValueError`
+for paths which don't exist, malformed operations and failed tests.
+"""
+import colander
+
+import limone
+
+
+def apply_patch(obj, patch):
+    """
+    Applies `patch` to the content object `obj`.
+    """
+    if isinstance(patch, dict):
+        patch = [{'op': 'replace', 'path': path, 'value': value}
+                 for path, value in sorted(patch.items())]
+
+    track = obj._track_changes
+    if track:
+        dirty = getattr(obj, '_dirty_fields', None)
+        if dirty is not None:
+            dirty = set(dirty)
+    undo = []
+    try:
+        for operation in patch:
+            _apply(obj, operation, undo)
+    except:
+        for func in reversed(undo):
+            func()
+        if track:
+            obj._dirty_fields = dirty
+            obj._tracked_cache = None
+        raise
+
+
+def _apply(obj, operation, undo):
+    try:
+        op = operation['op']
+        path = operation['path']
+    except (KeyError, TypeError):
+        raise ValueError('Not a patch operation: %r' % (operation,))
+
+    if op in ('add', 'replace', 'test'):
+        try:
+            value = operation['value']
+        except KeyError:
+            raise ValueError('No value for %s of %s.' % (op, path))
+    elif op in ('move', 'copy'):
+        try:
+            source = operation['from']
+        except KeyError:
+            raise ValueError('No source for %s to %s.' % (op, path))
+        value = limone._appstruct_node(_get(obj, source))
+        if op == 'move':
+            _change(obj, 'remove', source, None, undo)
+        op = 'add'
+    elif op == 'remove':
+        value = None
+    else:
+        raise ValueError('Unknown patch operation: %r' % (op,))
+
+    if op == 'test':
+        if limone._appstruct_node(_get(obj, path)) != value:
+            raise ValueError('Test of %s failed.' % path)
+        return
+    _change(obj, op, path, value, undo)
+
+
+def _get(obj, path):
+    trail, container, node, name = _resolve(obj, path)
+    return _step(container, node, name, path)[2]
+
+
+def _change(obj, op, path, value, undo):
+    trail, container, node, name = _resolve(obj, path)
+    try:
+        if isinstance(node.typ, colander.Tuple):
+            # Tuples can't be changed in place, so the whole tuple is
+            # replaced in whatever holds it.
+            if op != 'replace':
+                raise ValueError('Cannot %s items of tuple %s.' % (op, path))
+            i, child, old = _step(container, node, name, path)
+            items = [limone._appstruct_node(item) for item in container]
+            items[i] = value
+            parent, parent_node, parent_name, position = trail.pop()
+            _set(parent, parent_node, parent_name, tuple(items), path,
+                 'replace', undo)
+        else:
+            _set(container, node, name, value, path, op, undo)
+    except colander.Invalid, e:
+        # Locate the error in the content object's schema.
+        for parent, parent_node, parent_name, position in reversed(trail):
+            error = colander.Invalid(parent_node)
+            error.add(e, position)
+            e = error
+        raise e
+
+
+def _resolve(obj, path):
+    """
+    Returns a tuple of `(trail, container, node, name)` for `path`, where
+    `container` is the content object, node or tuple which holds the value at
+    `path`, `node` is its schema node and `name` is the last part of `path`.
+    `trail` is a list of `(container, node, name, position)` tuples for each
+    of the containers of `container`, with the position of the next one in
+    the children of `node`, or in the sequence.
+    """
+    if not path:
+        raise ValueError('Cannot patch a whole content object.')
+    if path.startswith('/'):
+        names = [name.replace('~1', '/').replace('~0', '~')
+                 for name in path[1:].split('/')]
+    else:
+        names = path.split('.')
+
+    trail = []
+    container = obj
+    node = obj.__schema__
+    for name in names[:-1]:
+        position, child, value = _step(container, node, name, path)
+        trail.append((container, node, name, position))
+        container = value
+        node = child
+    return trail, container, node, names[-1]
+
+
+def _step(container, node, name, path):
+    """
+    Returns a tuple of the position, the schema node and the value of the
+    item `name` of `container`.
+    """
+    typ = node.typ
+    if isinstance(typ, colander.Mapping):
+        for i, child in enumerate(node.children):
+            if child.name == name:
+                return i, child, getattr(container, name)
+        raise ValueError('No %s in %s.' % (name, path))
+    if isinstance(typ, colander.Sequence):
+        i = _index(container, name, path)
+        return i, node.children[0], container[i]
+    if isinstance(typ, colander.Tuple):
+        i = _index(container, name, path)
+        return i, node.children[i], container[i]
+    raise ValueError('Cannot look up %s in %s.' % (name, path))
+
+
+def _index(container, name, path, end=0):
+    # `end` is how far past the end of the sequence the index may be.
+    n = len(container) + end
+    if name == '-' and end:
+        return n - 1
+    if not name.isdigit() or int(name) >= n:
+        raise ValueError('No item %s in %s.' % (name, path))
+    return int(name)
+
+
+def _set(container, node, name, value, path, op, undo):
+    if isinstance(node.typ, colander.Mapping):
+        _set_attribute(container, node, name, value, path, op, undo)
+    elif isinstance(node.typ, colander.Sequence):
+        _set_item(container, name, value, path, op, undo)
+    else:
+        raise ValueError('Cannot %s %s.' % (op, path))
+
+
+def _set_attribute(container, node, name, value, path, op, undo):
+    # `container` is a content object or a mapping node.
+    for i, child in enumerate(node.children):
+        if child.name == name:
+            break
+    else:
+        raise ValueError('No %s in %s.' % (name, path))
+    props = container._props
+    if type(props) is dict:
+        prop = props[name]
+    else:
+        prop = props[i]
+    if op == 'remove':
+        value = colander.null
+
+    old = getattr(container, prop._attr)
+    undo.append(lambda: limone._put_back(container, prop, old))
+    try:
+        setattr(container, name, value)
+        if child.children:
+            # Lazy values are validated here too.
+            getattr(container, name)
+    except colander.Invalid, e:
+        error = colander.Invalid(node)
+        error.add(e, i)
+        raise error
+
+
+def _set_item(seq, name, value, path, op, undo):
+    data = seq._data
+    if op == 'add':
+        i = _index(seq, name, path, end=1)
+        func = seq.append if i == len(seq) else (
+            lambda value: seq.insert(i, value))
+        restore = lambda: data.pop(i)
+    else:
+        i = _index(seq, name, path)
+        old = data[i]
+        if op == 'remove':
+            func = lambda value: seq.__delitem__(i)
+            restore = lambda: data.insert(i, old)
+        else:
+            func = lambda value: seq.__setitem__(i, value)
+            def restore():
+                data[i] = old
+
+    try:
+        func(value)
+    except colander.Invalid, e:
+        error = colander.Invalid(seq.__schema__)
+        error.add(e, i)
+        raise error
+
+    def undo_item():
+        # Changes are undone in the sequence's data directly, so that the
+        # same items are put back.
+        restore()
+        if seq.__content__._track_changes:
+            limone._adopt(seq, data)
+        if isinstance(seq, limone._IndexedSequence):
+            seq._build_index()
+
+    undo.append(undo_item)
@@ -0,0 +1,133 @@
+"""
+Scanning for content types, with an optional manifest that lets later scans
+register content types without importing the modules which define them.
+"""
+import json
+import os
+import sys
+import venusian
+
+MANIFEST_VERSION = 1
+
+
+def scan(registry, package, cache=None):
+    """
+    Register the content types found in `package` with `registry`.  If
+    `cache` is the path of a manifest written by an earlier scan, and none of
+    the package's source files have changed since, the content types listed
+    in the manifest are registered lazily instead, and only imported when
+    they are first looked up.  Otherwise the package is scanned and, if
+    `cache` is given, a new manifest is written there.
+    """
+    if cache is not None:
+        types = _read_manifest(cache, package)
+        if types is not None:
+            for name, (module, attr) in types.items():
+                registry._register_lazy(name, module, attr)
+            return
+
+    recorder = _Recorder(registry)
+    scanner = venusian.Scanner(limone=recorder)
+    scanner.scan(package, categories=('limone',))
+
+    if cache is not None:
+        types = {}
+        for content_type in recorder.found:
+            name = content_type.__name__
+            location = _locate(content_type)
+            if location is None:
+                # Can't be imported by name, so a manifest would be no use.
+                return
+            types[name] = location
+        _write_manifest(cache, package, types)
+
+
+class _Recorder(object):
+    """
+    Passed to venusian's callbacks in place of the registry, to record the
+    content types found by a scan, including any the registry already has.
+    """
+
+    def __init__(self, registry):
+        self.registry = registry
+        self.found = []
+
+    def register_content_type(self, content_type):
+        self.registry.register_content_type(content_type)
+        self.found.append(content_type)
+
+    def __getattr__(self, name):
+        return getattr(self.registry, name)
+
+
+def _locate(content_type):
+    """
+    Returns the module and attribute names which `content_type` can be
+    imported from, or `None`.
+    """
+    module = getattr(content_type, '_original__module__',
+                     content_type.__module__)
+    namespace = getattr(sys.modules.get(module), '__dict__', {})
+    name = content_type.__name__
+    if namespace.get(name) is content_type:
+        return module, name
+    for name, value in namespace.items():
+        if value is content_type:
+            return module, name
+
+
+def _source_files(package):
+    """
+    Returns a dictionary of the sizes and modification times of the source
+    files making up `package`, keyed by path.
+    """
+    paths = []
+    for path in getattr(package, '__path__', ()):
+        for dirpath, dirnames, filenames in os.walk(path):
+            paths.extend(os.path.join(dirpath, filename)
+                         for filename in filenames
+                         if filename.endswith('.py'))
+    if not paths:
+        path = package.__file__
+        if path.endswith(('.pyc', '.pyo')):
+            path = path[:-1]
+        paths.append(path)
+
+    files = {}
+    for path in paths:
+        stat = os.stat(path)
+        files[os.path.abspath(path)] = [stat.st_size, stat.st_mtime]
+    return files
+
+
+def _read_manifest(path, package):
+    """
+    Returns the content types listed in the manifest at `path`, or `None` if
+    there isn't one or it is out of date.
+    """
+    try:
+        with open(path) as f:
+            manifest = json.load(f)
+    except (IOError, ValueError):
+        return None
+
+    if (manifest.get('version') != MANIFEST_VERSION or
+        manifest.get('package') != package.__name__ or
+        manifest.get('files') != _source_files(package)):
+        return None
+    return manifest['types']
+
+
+def _write_manifest(path, package, types):
+    manifest = {
+        'version': MANIFEST_VERSION,
+        'package': package.__name__,
+        'files': _source_files(package),
+        'types': types,
+    }
+    # Write to a temporary file first so that other processes never read a
+    # partially written manifest.
+    tmp = '%s.%d.tmp' % (path, os.getpid())
+    with open(tmp, 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.rename(tmp, path)
@@ -0,0 +1,181 @@
+"""
+Instrumentation of content types, counting constructions and assignments and
+timing validation.  See `Registry.enable_stats`.
+"""
+import colander
+import timeit
+
+import limone
+
+_timer = timeit.default_timer
+
+
+class Stats(object):
+    """
+    The statistics collected for the content types of a registry.
+    """
+
+    def __init__(self, exporter=None):
+        self.exporter = exporter
+        self.types = {}
+
+    def instrument(self, cls):
+        """
+        Replaces the constructor, `__setstate__` and attribute descriptors of
+        `cls` with ones which collect statistics.  Instances created by
+        `from_appstructs` and `deserialize_many` are counted as constructions
+        too, and those restored without validation, by unpickling,
+        `from_trusted_appstruct`, `from_buffer` or `Row.to_instance`, as
+        restorations.
+        """
+        if '_instrumented' in cls.__dict__:
+            if cls._instrumented is self:
+                return
+            raise ValueError(
+                'Content type %s is already instrumented.' % cls.__name__)
+
+        names = [node.name for node in cls.__schema__]
+        saved = {}
+        for name in names + ['__init__', '__setstate__', '_update_from_dict',
+                             'appstruct', '_props', '_generated_source']:
+            if name in cls.__dict__:
+                saved[name] = cls.__dict__[name]
+        type_stats = self.types.get(cls.__name__)
+        if type_stats is None:
+            type_stats = self.types[cls.__name__] = _TypeStats(names)
+        cls._instrumented = self
+        cls._uninstrumented = saved
+
+        props = []
+        for name, prop in zip(names, cls._props):
+            prop = _InstrumentedProperty(prop, type_stats.fields[name])
+            setattr(cls, name, prop)
+            props.append(prop)
+        cls._props = tuple(props)
+
+        if '_generated_source' in saved:
+            # The generated methods store leaf values without going through
+            # the descriptors, so generate them again to use the
+            # instrumented ones.
+            limone._generate_methods(cls)
+            if cls._track_changes:
+                cls.appstruct = limone._cached_appstruct(
+                    cls.__dict__['appstruct'])
+        cls.__init__ = _counted(cls.__dict__['__init__'],
+                                type_stats.construction)
+        cls.__setstate__ = _counted(cls.__dict__['__setstate__'],
+                                    type_stats.restoration)
+        # Read by `limone._row_builder`, for `from_appstructs`.
+        cls._construction_counters = type_stats.construction
+
+    def uninstrument(self, cls):
+        """
+        Puts back the constructor and descriptors replaced by `instrument`.
+        """
+        if cls.__dict__.get('_instrumented') is not self:
+            return
+        for name, value in cls._uninstrumented.items():
+            setattr(cls, name, value)
+        del cls._instrumented
+        del cls._uninstrumented
+        del cls._construction_counters
+
+    def snapshot(self):
+        """
+        Returns the statistics collected so far as a dictionary, keyed by the
+        names of content types.
+        """
+        return dict((name, type_stats.snapshot())
+                    for name, type_stats in self.types.items())
+
+    def reset(self):
+        for type_stats in self.types.values():
+            type_stats.reset()
+
+
+class _TypeStats(object):
+
+    def __init__(self, names):
+        self.construction = [0, 0.0, 0]
+        self.restoration = [0, 0.0, 0]
+        self.fields = dict((name, [0, 0.0, 0]) for name in names)
+
+    def snapshot(self):
+        constructions, time, invalid = self.construction
+        fields = {}
+        for name, (assignments, field_time, field_invalid) in \
+                self.fields.items():
+            fields[name] = {
+                'assignments': assignments,
+                'validation_time': field_time,
+                'invalid': field_invalid,
+            }
+        restorations, restoration_time, _ = self.restoration
+        return {
+            'constructions': constructions,
+            'construction_time': time,
+            'invalid': invalid,
+            'restorations': restorations,
+            'restoration_time': restoration_time,
+            'fields': fields,
+        }
+
+    def reset(self):
+        self.construction[:] = [0, 0.0, 0]
+        self.restoration[:] = [0, 0.0, 0]
+        for counters in self.fields.values():
+            counters[:] = [0, 0.0, 0]
+
+
+class _InstrumentedProperty(object):
+    """
+    Wraps a property of a content type, counting assignments, timing them and
+    counting the ones which raise `colander.Invalid`.  Anything else is
+    delegated to the wrapped property.
+    """
+
+    def __init__(self, prop, counters):
+        self.__dict__['_prop'] = prop
+        self.__dict__['_counters'] = counters
+
+    def __get__(self, obj, cls=None):
+        return self._prop.__get__(obj, cls)
+
+    def __set__(self, obj, value):
+        counters = self._counters
+        counters[0] += 1
+        start = _timer()
+        try:
+            return self._prop.__set__(obj, value)
+        except colander.Invalid:
+            counters[2] += 1
+            raise
+        finally:
+            counters[1] += _timer() - start
+
+    def __getattr__(self, name):
+        return getattr(self._prop, name)
+
+    def __setattr__(self, name, value):
+        setattr(self._prop, name, value)
+
+
+def _counted(func, counters):
+    """
+    Wraps `func`, which creates an instance, counting calls, timing them and
+    counting the ones which raise `colander.Invalid`.
+    """
+
+    def counted(*args, **kw):
+        counters[0] += 1
+        start = _timer()
+        try:
+            return func(*args, **kw)
+        except colander.Invalid:
+            counters[2] += 1
+            raise
+        finally:
+            counters[1] += _timer() - start
+
+    counted.__name__ = func.__name__
+    return counted
@@ -0,0 +1,299 @@
+"""
+Streaming deserialization of content from JSON lines.
+"""
+import collections
+import colander
+
+
+def iter_deserialize(content_type, fileobj, batch_size=1000, chunk_size=None):
+    """
+    Lazily deserialize instances of `content_type` from `fileobj`, a file-like
+    object containing one JSON encoded cstruct per line.  Yields an instance
+    for each valid record and a `(lineno, error)` tuple for each record which
+    is not, where `lineno` is the line number, counting from one, and `error`
+    is a `colander.Invalid`.  Lines which are not valid JSON are reported the
+    same way.  Blank lines are skipped.
+
+    Records are deserialized `batch_size` at a time, so memory use depends on
+    `batch_size` rather than on the size of the input.  If `chunk_size` is
+    given, `fileobj` is read with `read(chunk_size)` rather than by iterating
+    over it, which is useful for streams which don't support iteration or
+    which aren't line buffered.
+    """
+    pending = []
+    for lineno, line in _iter_lines(fileobj, chunk_size):
+        if not line.strip():
+            continue
+        pending.append(_parse_line(content_type, lineno, line))
+        if len(pending) >= batch_size:
+            for result in _deserialize_batch(content_type, pending):
+                yield result
+            pending = []
+
+    for result in _deserialize_batch(content_type, pending):
+        yield result
+
+
+def _parse_line(content_type, lineno, line):
+    import json # imported here so importing limone doesn't import json
+    try:
+        return lineno, json.loads(line), None
+    except ValueError, e:
+        error = colander.Invalid(content_type.__schema__,
+                                 'Invalid JSON: %s' % e)
+        return lineno, None, error
+
+
+def _deserialize_batch(content_type, pending):
+    cstructs = [cstruct for lineno, cstruct, error in pending if error is None]
+    instances, errors = content_type.deserialize_many(cstructs)
+    errors = dict(errors)
+    results = iter(enumerate(instances))
+    for lineno, cstruct, error in pending:
+        if error is None:
+            i, instance = next(results)
+            if instance is not None:
+                yield instance
+                continue
+            error = errors[i]
+        yield lineno, error
+
+
+def _iter_lines(fileobj, chunk_size):
+    if chunk_size is None:
+        for lineno, line in enumerate(fileobj, 1):
+            yield lineno, line
+        return
+
+    lineno = 0
+    parts = []
+    while True:
+        chunk = fileobj.read(chunk_size)
+        if not chunk:
+            break
+        if '\n' not in chunk:
+            parts.append(chunk)
+            continue
+        parts.append(chunk)
+        lines = ''.join(parts).split('\n')
+        parts = [lines.pop()]
+        for line in lines:
+            lineno += 1
+            yield lineno, line
+
+    line = ''.join(parts)
+    if line:
+        yield lineno + 1, line
+
+
+def iter_deserialize_futures(content_type, cstructs, submit, chunk_size=1000,
+                             max_pending=2):
+    """
+    Deserialize `cstructs` as instances of `content_type` in chunks of
+    `chunk_size`, using `submit` to run each chunk elsewhere, so that an event
+    loop isn't blocked by validation.  `submit(fn, *args)` must return a
+    future, as the `submit` method of a `concurrent.futures` executor does.
+    Yields the future for each chunk in turn.  The result of each future is a
+    tuple of `(results, errors)` for the chunk, in the same form as
+    `deserialize_many`, except that the positions of errors count from the
+    start of `cstructs` rather than of the chunk.
+
+    `cstructs` is only iterated over as chunks are submitted, and at most
+    `max_pending` chunks are submitted before the first of them is taken, so
+    a consumer which waits for each future before taking the next applies
+    backpressure to whatever is producing `cstructs`.  Closing the iterator
+    cancels the futures which haven't been taken yet.  If `submit` runs
+    functions in other processes, `content_type` must be importable.
+    """
+    futures = collections.deque()
+    chunks = enumerate(_chunks(cstructs, chunk_size))
+    try:
+        while True:
+            for i, chunk in chunks:
+                futures.append(submit(_deserialize_chunk, content_type,
+                                      chunk, i * chunk_size))
+                if len(futures) >= max_pending:
+                    break
+            if not futures:
+                break
+            yield futures.popleft()
+    finally:
+        for future in futures:
+            future.cancel()
+
+
+class JSONLinesFeed(object):
+    """
+    Deserializes instances of `content_type` from JSON lines, as
+    `iter_deserialize` does, from data which is fed to it a piece at a time,
+    eg as an event loop reads it from a socket.  Lines are parsed and
+    deserialized in batches of `batch_size` using `submit`, which is called as
+    for `iter_deserialize_futures`.  The result of the future for each batch
+    is a list of the instances and `(lineno, error)` tuples for the batch, as
+    yielded by `iter_deserialize`.
+
+    At most `max_pending` batches are submitted at once.  Further batches are
+    submitted as futures are taken with `pop`.  Data which is fed in is only
+    split into lines until a full batch is waiting to be submitted, and the
+    rest of it is kept as it is until batches are taken.  When `paused` is
+    true, the caller must stop reading until it has taken a future: `feed`
+    raises a `ValueError` rather than letting unprocessed data build up.  So
+    besides the submitted batches, at most a batch of lines and the data
+    from one call to `feed` are held at once.
+    """
+
+    def __init__(self, content_type, submit, batch_size=1000, max_pending=2):
+        self.content_type = content_type
+        self.submit = submit
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+        self._parts = []
+        self._start = 0
+        self._lines = collections.deque()
+        self._lineno = 0
+        self._futures = collections.deque()
+        self._closed = False
+
+    @property
+    def paused(self):
+        """
+        Whether there is a full batch waiting for one of the submitted
+        batches to be taken.
+        """
+        return len(self._lines) >= self.batch_size
+
+    def feed(self, data):
+        """
+        Adds `data`, the next piece of the input.  Raises a `ValueError`,
+        without adding `data`, if the feed is paused.
+        """
+        if self._closed:
+            raise ValueError('Feed is closed.')
+        if self.paused:
+            raise ValueError('Feed is paused.')
+        self._parts.append(data)
+        if '\n' in data:
+            self._process()
+
+    def close(self):
+        """
+        Signals the end of the input, so that the last batch can be
+        submitted, even if it isn't full.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        self._process()
+
+    def pop(self):
+        """
+        Returns the future for the oldest batch which hasn't been taken yet,
+        or `None` if no batches have been submitted.
+        """
+        futures = self._futures
+        if not futures:
+            return None
+        future = futures.popleft()
+        self._process()
+        return future
+
+    def cancel(self):
+        """
+        Cancels batches which haven't been taken and discards any input which
+        hasn't been submitted.  The feed can't be used afterwards.
+        """
+        self._closed = True
+        self._parts = []
+        self._start = 0
+        self._lines.clear()
+        while self._futures:
+            self._futures.popleft().cancel()
+
+    def _process(self):
+        # Splits the input into lines and submits batches of them for as long
+        # as there is room for them.
+        while True:
+            self._split()
+            if not self._submit():
+                break
+
+    def _split(self):
+        # Moves whole lines from the input which hasn't been split yet to the
+        # lines waiting to be submitted, until a full batch is waiting.  Once
+        # the feed is closed, whatever follows the last newline is the last
+        # line.  Only the last of the parts of the input can contain a
+        # newline, unless a full batch is already waiting, in which case
+        # there is a single part, split up to `_start`.
+        lines = self._lines
+        batch_size = self.batch_size
+        parts = self._parts
+        if len(lines) >= batch_size or not parts:
+            return
+        if len(parts) > 1:
+            data = ''.join(parts)
+        else:
+            data = parts[0]
+        start = self._start
+        lineno = self._lineno
+        while len(lines) < batch_size:
+            end = data.find('\n', start)
+            if end < 0:
+                break
+            lineno += 1
+            line = data[start:end]
+            if line.strip():
+                lines.append((lineno, line))
+            start = end + 1
+        self._lineno = lineno
+
+        if len(lines) >= batch_size:
+            # The rest is split once a batch has been taken.
+            self._parts = [data]
+            self._start = start
+            return
+        line = data[start:]
+        self._start = 0
+        if self._closed:
+            self._parts = []
+            if line.strip():
+                lines.append((lineno + 1, line))
+        else:
+            self._parts = [line]
+
+    def _submit(self):
+        # Returns whether any batches were submitted.
+        lines = self._lines
+        batch_size = self.batch_size
+        futures = self._futures
+        submitted = False
+        while lines and len(futures) < self.max_pending:
+            if len(lines) < batch_size and not self._closed:
+                break
+            batch = [lines.popleft()
+                     for i in xrange(min(batch_size, len(lines)))]
+            futures.append(self.submit(_deserialize_lines, self.content_type,
+                                       batch))
+            submitted = True
+        return submitted
+
+
+def _chunks(items, size):
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _deserialize_chunk(content_type, cstructs, offset):
+    instances, errors = content_type.deserialize_many(cstructs)
+    return instances, [(offset + i, e) for i, e in errors]
+
+
+def _deserialize_lines(content_type, lines):
+    pending = [_parse_line(content_type, lineno, line)
+               for lineno, line in lines]
+    return list(_deserialize_batch(content_type, pending))
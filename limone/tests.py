@@ -32,6 +32,7 @@ class MakeContentTypeTests(unittest2.TestCase):
 
 
 class ShallowSchemaTests(unittest2.TestCase):
+    options = {}
 
     def setUp(self):
         import colander
@@ -47,7 +48,7 @@ class ShallowSchemaTests(unittest2.TestCase):
             def __init__(self):
                 self.hr_code = 'foo'
 
-        @limone.content_type(PersonSchema)
+        @limone.content_type(PersonSchema, **self.options)
         class Person(Record):
             pass
 
@@ -148,6 +149,18 @@ class ShallowSchemaTests(unittest2.TestCase):
         self.assertEqual(ecm.exception.asdict(), {
             'age': u'"forty" is not a number'})
 
+    def test_does_not_mutate_data(self):
+        data = {'name': 'Joe', 'age': 35}
+        joe = self.content_type.from_appstruct(data)
+        joe.update_from_appstruct(data)
+        self.assertEqual(data, {'name': 'Joe', 'age': 35})
+
+    def test_update_returns_unexpected(self):
+        joe = self.content_type(name='Joe', age=35)
+        self.assertEqual(joe._update_from_dict(
+            {'age': 36, 'sex': 'male'}, skip_missing=True), {'sex': 'male'})
+        self.assertEqual(joe.age, 36)
+
 
 class RegistryTests(unittest2.TestCase):
 
@@ -222,6 +235,7 @@ class RegistryTests(unittest2.TestCase):
 
 
 class NestedMappingNodeTests(unittest2.TestCase):
+    options = {}
 
     def setUp(self):
         import colander
@@ -240,7 +254,8 @@ class NestedMappingNodeTests(unittest2.TestCase):
             age = colander.SchemaNode(colander.Integer(), default=500)
             personal = PersonalData()
 
-        self.content_type = limone.make_content_type(PersonSchema, 'Person')
+        self.content_type = limone.make_content_type(
+            PersonSchema, 'Person', **self.options)
 
     def test_construction(self):
         import datetime
@@ -395,6 +410,7 @@ class NestedMappingNodeTests(unittest2.TestCase):
 
 
 class NestedSequenceNodeTests(unittest2.TestCase):
+    options = {}
 
     def setUp(self):
         import colander
@@ -410,7 +426,7 @@ class NestedSequenceNodeTests(unittest2.TestCase):
             id = colander.SchemaNode(colander.Str('UTF-8'), default='plane')
             coords = X()
 
-        @limone.content_type(Plane)
+        @limone.content_type(Plane, **self.options)
         class PlaneType(object):
             foo = 'bar'
 
@@ -625,6 +641,7 @@ class TupleNodeTests(unittest2.TestCase):
 
 
 class ColanderExampleTests(unittest2.TestCase):
+    options = {}
 
     def setUp(self):
         import colander
@@ -646,7 +663,7 @@ class ColanderExampleTests(unittest2.TestCase):
         class Phones(colander.SequenceSchema):
             phone = Phone()
 
-        @limone.content_schema
+        @limone.content_schema(**self.options)
         class Person(colander.MappingSchema):
             name = colander.SchemaNode(colander.String())
             age = colander.SchemaNode(colander.Int(),
@@ -683,6 +700,3113 @@ class ColanderExampleTests(unittest2.TestCase):
             'name': u'Jack',
             'phones': [{'location': u'home', 'number': u'555-1212'}]})
 
+    def test_pickle(self):
+        import colander
+        import limone
+        import pickle
+        registry = limone.Registry()
+        registry.register_content_type(self.content_type)
+        registry.hook_import()
+        self.addCleanup(registry.unhook_import)
+        jack = self.make_one()
+        for protocol in (0, 2):
+            jack2 = pickle.loads(pickle.dumps(jack, protocol))
+            self.assertEqual(jack2.appstruct(), jack.appstruct())
+            self.assertEqual(jack2.serialize(), jack.serialize())
+            jack2.phones[0].location = 'work'
+            with self.assertRaises(colander.Invalid):
+                jack2.phones[0].location = 'office'
+            jack2.friends.append((3, 'Wilma'))
+            self.assertEqual(jack2.friends[2], (3, u'Wilma'))
+
+    def test_to_bytes(self):
+        jack = self.make_one()
+        data = jack.to_bytes()
+        for buf in (data, memoryview(data), bytearray(data)):
+            jack2 = self.content_type.from_buffer(buf)
+            self.assertEqual(jack2.appstruct(), jack.appstruct())
+        jack2.phones[0].number = '555-1313'
+        self.assertEqual(jack2.phones[0].number, u'555-1313')
+
+
+class LeafValidatorTests(unittest2.TestCase):
+
+    def _check(self, typ, values, **kw):
+        import colander
+        import limone
+        node = colander.SchemaNode(typ, name='x', **kw)
+        validate = limone._leaf_validator(node)
+        self.assertIsNotNone(validate)
+        for value in values:
+            try:
+                expected = node.deserialize(node.serialize(value))
+            except colander.Invalid, e:
+                with self.assertRaises(colander.Invalid) as ecm:
+                    validate(value)
+                self.assertEqual(ecm.exception.msg, e.msg)
+                self.assertEqual(ecm.exception.node, e.node)
+            else:
+                self.assertEqual(validate(value), expected)
+
+    def test_int(self):
+        import colander
+        self._check(colander.Int(), [0, 5, -3, 2.7, '42', True, 'forty',
+                                     None, colander.null, []])
+
+    def test_float(self):
+        import colander
+        self._check(colander.Float(), [0, 0.5, '1.25', 'one', colander.null])
+
+    def test_decimal(self):
+        import colander
+        import decimal
+        self._check(colander.Decimal(), [decimal.Decimal('1.10'), 3, '2.5',
+                                         'two', colander.null])
+
+    def test_string(self):
+        import colander
+        values = ['abc', u'\xe9', '', u'', 42, colander.null, '\xff']
+        self._check(colander.String(), values)
+        self._check(colander.String('UTF-8'), values)
+        self._check(colander.String('ascii'), values)
+
+    def test_boolean(self):
+        import colander
+        self._check(colander.Boolean(), [True, False, 0, 1, 'false', '',
+                                         colander.null])
+
+    def test_date(self):
+        import colander
+        import datetime
+        self._check(colander.Date(), [
+            datetime.date(2011, 5, 12),
+            datetime.datetime(2011, 5, 12, 10, 30),
+            'Christmas', colander.null])
+
+    def test_datetime(self):
+        import colander
+        import datetime
+        validate = limone._leaf_validator(
+            colander.SchemaNode(colander.DateTime(), name='x'))
+        value = datetime.datetime(2011, 5, 12, 10, 30)
+        result = validate(value)
+        self.assertEqual(result.replace(tzinfo=None), value)
+        self.assertIsNotNone(result.tzinfo)
+        self.assertEqual(validate(datetime.date(2011, 5, 12)),
+                         datetime.datetime(2011, 5, 12, tzinfo=result.tzinfo))
+        with self.assertRaises(colander.Invalid):
+            validate('Christmas')
+
+    def test_defaults_missing_and_validators(self):
+        import colander
+        self._check(colander.Int(), [colander.null, 5, 300],
+                    default=7, validator=colander.Range(0, 200))
+        self._check(colander.Int(), [colander.null], missing=None)
+        self._check(colander.String(), [''], missing=u'nobody')
+
+    def test_custom_type_falls_back_to_round_trip(self):
+        import colander
+        import limone
+
+        class Upper(colander.String):
+            def deserialize(self, node, cstruct):
+                return super(Upper, self).deserialize(node, cstruct).upper()
+
+        @limone.content_schema
+        class Shouty(colander.Schema):
+            word = colander.SchemaNode(Upper())
+
+        self.assertIsNone(limone._leaf_validator(Shouty.__schema__['word']))
+        self.assertEqual(Shouty(word='hello').word, u'HELLO')
+
+
+class CodegenShallowSchemaTests(ShallowSchemaTests):
+    options = {'codegen': True}
+
+    def test_missing_fields_w_defaults(self):
+        # Defaults are computed when a generated type is created.
+        import colander
+        import limone
+        schema = self.schema()
+        schema['name'].default = 'Paul'
+        schema['age'].default = 200
+        content_type = limone.make_content_type(schema, 'Person', codegen=True)
+        paul = content_type()
+        self.assertEqual(paul.name, 'Paul')
+        self.assertEqual(paul.age, 200)
+
+    def test_methods_are_generated(self):
+        ct = self.content_type
+        self.assertIn('def __init__', ct._generated_source)
+        self.assertEqual(ct.__init__.__func__.__code__.co_filename,
+                         '<limone generated Person>')
+
+
+class CodegenNestedMappingNodeTests(NestedMappingNodeTests):
+    options = {'codegen': True}
+
+
+class CodegenNestedSequenceNodeTests(NestedSequenceNodeTests):
+    options = {'codegen': True}
+
+
+class CodegenColanderExampleTests(ColanderExampleTests):
+    options = {'codegen': True}
+
+    def test_fast_path_validates(self):
+        import colander
+        with self.assertRaises(colander.Invalid) as ecm:
+            self.content_type(name=u'', age=300)
+        self.assertEqual(ecm.exception.asdict(), {
+            'age': u'300 is greater than maximum value 200',
+            'name': u'Required'})
+
+    def test_odd_field_names(self):
+        import colander
+        import limone
+
+        class Schema(colander.Schema):
+            pass
+        schema = Schema()
+        schema.add(colander.SchemaNode(colander.Int(), name='class',
+                                       default=1))
+        schema.add(colander.SchemaNode(colander.Int(), name='two-words'))
+        ct = limone.make_content_type(schema, 'Odd', codegen=True)
+        ob = ct(**{'two-words': 2})
+        self.assertEqual(ob.appstruct(), {'class': 1, 'two-words': 2})
+
+
+class SlotsShallowSchemaTests(ShallowSchemaTests):
+    options = {'layout': 'slots'}
+
+    def test_values_are_stored_in_slots(self):
+        joe = self.content_type(name='Joe', age=35)
+        self.assertEqual(joe._f0, 'Joe')
+        self.assertEqual(joe._f1, 35)
+        self.assertNotIn('.name', joe.__dict__)
+        self.assertEqual(joe.__dict__, {'hr_code': 'foo'})
+
+    def test_copy(self):
+        import copy
+        joe = self.content_type(name='Joe', age=35)
+        joe2 = copy.copy(joe)
+        self.assertEqual(joe2.appstruct(), {'name': 'Joe', 'age': 35})
+        self.assertEqual(joe2.hr_code, 'foo')
+        self.assertIs(joe2.__content__, joe2)
+
+
+class CodegenSlotsShallowSchemaTests(CodegenShallowSchemaTests):
+    options = {'codegen': True, 'layout': 'slots'}
+
+
+class SlotsNestedMappingNodeTests(NestedMappingNodeTests):
+    options = {'layout': 'slots'}
+
+
+class SlotsNestedSequenceNodeTests(NestedSequenceNodeTests):
+    options = {'layout': 'slots'}
+
+
+class SlotsLayoutTests(unittest2.TestCase):
+
+    def setUp(self):
+        import colander
+        import limone
+
+        class Point(colander.Schema):
+            x = colander.SchemaNode(colander.Int())
+            y = colander.SchemaNode(colander.Int(), default=0)
+
+        self.content_type = limone.make_content_type(
+            Point, 'Point', layout='slots')
+        self.registry = limone.Registry()
+        self.registry.register_content_type(self.content_type)
+
+    def test_no_instance_dict(self):
+        point = self.content_type(x=1)
+        self.assertFalse(hasattr(point, '__dict__'))
+        self.assertEqual((point.x, point.y), (1, 0))
+        with self.assertRaises(AttributeError):
+            point.z = 3
+
+    def test_pickle(self):
+        import pickle
+        self.registry.hook_import()
+        self.addCleanup(self.registry.unhook_import)
+        point = self.content_type(x=1, y=2)
+        for protocol in (0, 2):
+            point2 = pickle.loads(pickle.dumps(point, protocol))
+            self.assertEqual((point2.x, point2.y), (1, 2))
+            self.assertIs(point2.__content__, point2)
+            point2.x = 5
+            self.assertEqual(point2.x, 5)
+
+    def test_unknown_layout(self):
+        import limone
+        with self.assertRaises(ValueError):
+            limone.make_content_type(
+                self.content_type.__schema__, 'Point', layout='array')
+
+    def test_field_named_like_slot(self):
+        import colander
+        import limone
+
+        class Fields(colander.Schema):
+            _f1 = colander.SchemaNode(colander.Int())
+            _f0 = colander.SchemaNode(colander.Int())
+            _ff0 = colander.SchemaNode(colander.Int())
+
+        ct = limone.make_content_type(Fields, 'Fields', layout='slots')
+        fields = ct(_f0=1, _f1=2, _ff0=3)
+        self.assertEqual((fields._f0, fields._f1, fields._ff0), (1, 2, 3))
+        self.assertEqual(fields.appstruct(), {'_f0': 1, '_f1': 2, '_ff0': 3})
+        self.assertEqual(ct.__slots__[1:], ('_fff0', '_fff1', '_fff2'))
+
+    def test_custom_property_factory(self):
+        import colander
+        import limone
+
+        class RecordingProperty(limone._LeafNodeProperty):
+            log = []
+
+            def __set__(self, obj, value):
+                self.log.append((self.node.name, value))
+                return super(RecordingProperty, self).__set__(obj, value)
+
+        class Factory(limone.PropertyFactory):
+            def __init__(self):
+                super(Factory, self).__init__()
+                self.registry[colander.Int] = RecordingProperty
+
+        ct = limone.make_content_type(
+            self.content_type.__schema__, 'Point', layout='slots',
+            property_factory=Factory())
+        point = ct(x=1, y=2)
+        self.assertEqual(RecordingProperty.log, [('x', 1), ('y', 2)])
+        self.assertEqual((point.x, point.y), (1, 2))
+
+
+class ListNestedSequenceNodeTests(NestedSequenceNodeTests):
+    options = {'sequences': 'list'}
+
+    def test_values_are_not_wrapped(self):
+        plane = self.test_construction()
+        self.assertEqual(plane.coords[0]._data, [1, 2, 3])
+        self.assertEqual(type(plane.coords._data), list)
+
+    def test_extend_is_atomic(self):
+        import colander
+        plane = self.test_construction()
+        with self.assertRaises(colander.Invalid):
+            plane.coords[0].extend([4, 'five'])
+        self.assertEqual(plane.coords[0], [1, 2, 3])
+
+    def test_index_w_bounds(self):
+        plane = self.test_construction()
+        coords = plane.coords[0]
+        coords.extend([1, 2])
+        self.assertEqual(coords.index(2, 2), 4)
+        with self.assertRaises(ValueError):
+            coords.index(3, 0, 2)
+
+    def test_setslice_invalid(self):
+        import colander
+        plane = self.test_construction()
+        with self.assertRaises(colander.Invalid) as ecm:
+            plane.coords[0][1:3] = [6, 'seven']
+        self.assertEqual(ecm.exception.asdict(), {
+            'x.2': u'"seven" is not a number'})
+        self.assertEqual(plane.coords[0], [1, 2, 3])
+
+
+class ListColanderExampleTests(ColanderExampleTests):
+    options = {'sequences': 'list'}
+
+    def test_unknown_sequence_storage(self):
+        import limone
+        with self.assertRaises(ValueError):
+            limone.make_content_type(
+                self.content_type.__schema__, 'Person', sequences='array')
+
+
+class CodegenSlotsListColanderExampleTests(ColanderExampleTests):
+    options = {'codegen': True, 'layout': 'slots', 'sequences': 'list'}
+
+
+class BulkConstructionTests(unittest2.TestCase):
+    options = {}
+
+    def setUp(self):
+        import colander
+        import limone
+
+        class Record(object):
+            def __init__(self):
+                self.hr_code = 'foo'
+
+        class Person(colander.Schema):
+            name = colander.SchemaNode(colander.String())
+            age = colander.SchemaNode(colander.Int(),
+                                      validator=colander.Range(0, 200))
+
+        self.content_type = limone.make_content_type(
+            Person, 'Person', bases=(Record,), **self.options)
+
+    def test_from_appstructs(self):
+        people, errors = self.content_type.from_appstructs([
+            {'name': u'Joe', 'age': 35},
+            {'name': u'Fred', 'age': 300},
+            {'name': u'Sue', 'age': 40, 'sex': 'female'},
+            {'name': u'Jill', 'age': 2},
+        ])
+        self.assertEqual([p and p.appstruct() for p in people], [
+            {'name': u'Joe', 'age': 35}, None, None,
+            {'name': u'Jill', 'age': 2}])
+        self.assertEqual(people[0].hr_code, 'foo')
+        self.assertIs(people[0].__content__, people[0])
+        self.assertEqual([i for i, e in errors], [1, 2])
+        self.assertEqual(errors[0][1].asdict(), {
+            'age': u'300 is greater than maximum value 200'})
+        self.assertIn('Unrecognized keys in mapping',
+                      str(errors[1][1].asdict()))
+
+    def test_from_appstructs_fail_fast(self):
+        import colander
+        rows = iter([{'name': u'Joe', 'age': 35}, {'name': u'Fred'},
+                     {'name': u'Sue', 'age': 'x'}])
+        with self.assertRaises(colander.Invalid) as ecm:
+            self.content_type.from_appstructs(rows, fail_fast=True)
+        self.assertEqual(ecm.exception.asdict(), {'1.age': u'Required'})
+        self.assertEqual(next(rows), {'name': u'Sue', 'age': 'x'})
+
+    def test_not_mappings(self):
+        import colander
+        people, errors = self.content_type.from_appstructs([
+            None, [('name', u'Joe'), ('age', 35)], 'Fred',
+            {'name': u'Jill', 'age': 2}])
+        self.assertEqual(people[0], None)
+        self.assertEqual(people[1].name, u'Joe')
+        self.assertEqual(people[3].name, u'Jill')
+        self.assertEqual([i for i, e in errors], [0, 2])
+        self.assertIsInstance(errors[0][1], colander.Invalid)
+        self.assertIn('is not a mapping type', errors[0][1].asdict()[''])
+
+    def test_deserialize_many(self):
+        people, errors = self.content_type.deserialize_many([
+            {'name': u'Joe', 'age': '35'},
+            {'name': u'Fred', 'age': 'old'},
+        ])
+        self.assertEqual(people[0].age, 35)
+        self.assertIsNone(people[1])
+        self.assertEqual(errors[0][0], 1)
+        self.assertEqual(errors[0][1].asdict(), {
+            'age': u'"old" is not a number'})
+
+
+class CodegenBulkConstructionTests(BulkConstructionTests):
+    options = {'codegen': True}
+
+
+class SlotsBulkConstructionTests(BulkConstructionTests):
+    options = {'layout': 'slots'}
+
+
+class IterDeserializeTests(unittest2.TestCase):
+
+    def setUp(self):
+        import colander
+        import limone
+
+        class Person(colander.Schema):
+            name = colander.SchemaNode(colander.String())
+            age = colander.SchemaNode(colander.Int())
+
+        self.content_type = limone.make_content_type(Person, 'Person')
+        self.lines = [
+            '{"name": "Joe", "age": "35"}\n',
+            '\n',
+            '{"name": "Fred", "age": "old"}\n',
+            '{"name": "Sue", \n',
+            '{"name": "Jill", "age": "2"}\n',
+            '[1, 2]',
+        ]
+
+    def _summarize(self, results):
+        summary = []
+        for result in results:
+            if isinstance(result, tuple):
+                lineno, error = result
+                summary.append((lineno, error.asdict().keys()))
+            else:
+                summary.append(result.appstruct())
+        return summary
+
+    def test_iterate_lines(self):
+        from limone import iter_deserialize
+        results = iter_deserialize(self.content_type, iter(self.lines),
+                                   batch_size=2)
+        self.assertEqual(self._summarize(results), [
+            {'name': u'Joe', 'age': 35},
+            (3, ['age']),
+            (4, ['']),
+            {'name': u'Jill', 'age': 2},
+            (6, [''])])
+
+    def test_chunked_reads(self):
+        from cStringIO import StringIO
+        from limone import iter_deserialize
+        expected = self._summarize(
+            iter_deserialize(self.content_type, iter(self.lines)))
+        for chunk_size in (1, 7, 4096):
+            results = iter_deserialize(self.content_type,
+                                       StringIO(''.join(self.lines)),
+                                       chunk_size=chunk_size)
+            self.assertEqual(self._summarize(results), expected)
+
+    def test_lazy(self):
+        from limone import iter_deserialize
+        read = []
+        def lines():
+            for line in self.lines:
+                read.append(line)
+                yield line
+        results = iter_deserialize(self.content_type, lines(), batch_size=1)
+        self.assertEqual(next(results).name, u'Joe')
+        self.assertEqual(len(read), 1)
+
+
+class DeserializeParallelTests(unittest2.TestCase):
+
+    def setUp(self):
+        import colander
+        import limone
+
+        class Person(colander.Schema):
+            name = colander.SchemaNode(colander.String())
+            age = colander.SchemaNode(colander.Int())
+
+        self.content_type = limone.make_content_type(Person, 'Person')
+        self.registry = limone.Registry()
+        self.registry.register_content_type(self.content_type)
+        self.cstructs = [{'name': u'P%d' % i, 'age': str(i)}
+                         for i in xrange(50)]
+        self.cstructs[7]['age'] = 'seven'
+
+    def test_instances(self):
+        from limone.parallel import deserialize_parallel
+        self.registry.hook_import()
+        self.addCleanup(self.registry.unhook_import)
+        people, errors = deserialize_parallel(
+            self.content_type, self.cstructs, self.registry, processes=2,
+            chunk_size=8)
+        self.assertEqual(len(people), 50)
+        self.assertIsNone(people[7])
+        self.assertIsInstance(people[8], self.content_type)
+        self.assertEqual([p.age for p in people if p is not None],
+                         [i for i in xrange(50) if i != 7])
+        self.assertEqual(errors[0][0], 7)
+        self.assertEqual(errors[0][1].asdict(), {
+            'age': u'"seven" is not a number'})
+
+    def test_appstructs_and_temporary_hook(self):
+        from limone.parallel import deserialize_parallel
+        appstructs, errors = deserialize_parallel(
+            self.content_type, self.cstructs, self.registry, processes=2,
+            chunk_size=8, appstructs=True)
+        self.assertEqual(appstructs[3], {'name': u'P3', 'age': 3})
+        self.assertEqual([i for i, e in errors], [7])
+        self.assertIsNone(self.registry._finder_loader)
+
+    def test_worker_recreates_types(self):
+        from limone import parallel
+        recipes = parallel._recipes(self.registry)
+        self.assertEqual(recipes[0][:2], ('make', 'Person'))
+        parallel._init_worker(recipes, '__limone_worker_test__')
+        loader = __import__('__limone_worker_test__')
+        self.addCleanup(loader.unload)
+        ct = loader.Person
+        self.assertIsNot(ct, self.content_type)
+        self.assertEqual(ct.__module__, '__limone_worker_test__')
+        instances, errors = parallel._deserialize_chunk(
+            (('__limone_worker_test__', 'Person'), self.cstructs[:2], True))
+        self.assertEqual(instances, [{'name': u'P0', 'age': 0},
+                                     {'name': u'P1', 'age': 1}])
+
+    def test_recipe_for_importable_type(self):
+        import limone
+        from limone import parallel
+        registry = limone.Registry()
+        registry.register_content_type(Cat)
+        self.assertEqual(parallel._recipes(registry),
+                         [('import', 'Cat', 'limone.tests')])
+
+
+class LazyNestedMappingNodeTests(NestedMappingNodeTests):
+    options = {'lazy': True}
+
+    def test_construction_missing(self):
+        import colander
+        jack = self.content_type(name='Jack', age=500)
+        self.assertEqual(jack.name, 'Jack')
+        with self.assertRaises(colander.Invalid) as ecm:
+            jack.personal
+        self.assertEqual(ecm.exception.asdict(), {
+            'personal.n_arrests': u'Required',
+            'personal.nsa_data.date_of_contact': u'Required',
+            'personal.nsa_data.serialnum': u'Required'})
+        with self.assertRaises(colander.Invalid) as ecm:
+            jack.validate_all()
+        self.assertEqual(ecm.exception.asdict(), {
+            'personal.n_arrests': u'Required',
+            'personal.nsa_data.date_of_contact': u'Required',
+            'personal.nsa_data.serialnum': u'Required'})
+
+    def test_invalid_assignment(self):
+        import colander
+        jack = self.test_construction()
+        jack.personal = 'foo'
+        with self.assertRaises(colander.Invalid):
+            jack.validate_all()
+
+    def test_materialized_on_access(self):
+        import limone
+        jack = self.test_construction()
+        jack.personal = {'nsa_data': {'serialnum': 'x', 'date_of_contact':
+                                      jack.personal.nsa_data.date_of_contact},
+                         'n_arrests': 1}
+        self.assertIs(type(jack.__dict__['.personal']), limone._Unvalidated)
+        personal = jack.personal
+        self.assertIs(type(personal), limone._MappingNode)
+        self.assertIs(jack.personal, personal)
+        jack.validate_all()
+
+    def test_pickle_unvalidated(self):
+        import limone
+        import pickle
+        value = pickle.loads(pickle.dumps(limone._Unvalidated({'a': 1})))
+        self.assertEqual(value.appstruct, {'a': 1})
+
+
+class LazyNestedSequenceNodeTests(NestedSequenceNodeTests):
+    options = {'lazy': True}
+
+
+class LazySlotsCodegenColanderExampleTests(ColanderExampleTests):
+    options = {'lazy': True, 'layout': 'slots', 'codegen': True}
+
+    def test_lazy(self):
+        import colander
+        jack = self.make_one()
+        jack.phones = [{'location': 'mars', 'number': '555'}]
+        self.assertEqual(jack.name, u'Jack')
+        with self.assertRaises(colander.Invalid) as ecm:
+            jack.validate_all()
+        self.assertEqual(ecm.exception.asdict(), {
+            'phones.0.location': u'"mars" is not one of home, work'})
+
+
+class TrackedShallowSchemaTests(ShallowSchemaTests):
+    options = {'track_changes': True}
+
+
+class TrackedNestedMappingNodeTests(NestedMappingNodeTests):
+    options = {'track_changes': True}
+
+
+class TrackedNestedSequenceNodeTests(NestedSequenceNodeTests):
+    options = {'track_changes': True}
+
+
+class TrackedListNestedSequenceNodeTests(NestedSequenceNodeTests):
+    options = {'track_changes': True, 'sequences': 'list'}
+
+
+class TrackedColanderExampleTests(ColanderExampleTests):
+    options = {'track_changes': True}
+
+
+class TrackedCodegenSlotsColanderExampleTests(ColanderExampleTests):
+    options = {'track_changes': True, 'codegen': True, 'layout': 'slots'}
+
+
+class ChangeTrackingTests(unittest2.TestCase):
+    options = {}
+
+    def setUp(self):
+        import colander
+        import limone
+
+        class Phone(colander.MappingSchema):
+            location = colander.SchemaNode(colander.String())
+            number = colander.SchemaNode(colander.String())
+
+        class Phones(colander.SequenceSchema):
+            phone = Phone()
+
+        class Address(colander.MappingSchema):
+            city = colander.SchemaNode(colander.String())
+
+        class Person(colander.MappingSchema):
+            name = colander.SchemaNode(colander.String())
+            age = colander.SchemaNode(colander.Int(), default=0)
+            address = Address()
+            phones = Phones()
+
+        self.content_type = limone.make_content_type(
+            Person, 'Person', track_changes=True, **self.options)
+        self.untracked = limone.make_content_type(Person, 'Person')
+
+    def make_one(self):
+        appstruct = {
+            'name': 'Jack',
+            'age': 52,
+            'address': {'city': 'Paris'},
+            'phones': [{'location': 'home', 'number': '555-1212'}]}
+        return self.content_type(**appstruct)
+
+    def test_new_instance_all_changed(self):
+        jack = self.make_one()
+        self.assertEqual(jack.changed_fields(),
+                         set(['name', 'age', 'address', 'phones']))
+        jack.mark_clean()
+        self.assertEqual(jack.changed_fields(), set())
+
+    def test_leaf_change(self):
+        jack = self.make_one()
+        jack.mark_clean()
+        jack.age = 53
+        self.assertEqual(jack.changed_fields(), set(['age']))
+
+    def test_nested_changes(self):
+        jack = self.make_one()
+        jack.mark_clean()
+        jack.address.city = 'Lyon'
+        self.assertEqual(jack.changed_fields(), set(['address']))
+        jack.mark_clean()
+        jack.phones[0].number = '555-1313'
+        self.assertEqual(jack.changed_fields(), set(['phones']))
+        jack.mark_clean()
+        jack.phones.append({'location': 'work', 'number': '555-1414'})
+        self.assertEqual(jack.changed_fields(), set(['phones']))
+        jack.mark_clean()
+        jack.phones[1].location = 'cell'
+        self.assertEqual(jack.changed_fields(), set(['phones']))
+        jack.mark_clean()
+        del jack.phones[0]
+        self.assertEqual(jack.changed_fields(), set(['phones']))
+
+    def test_replaced_node(self):
+        jack = self.make_one()
+        old = jack.address
+        jack.address = {'city': 'Lyon'}
+        jack.mark_clean()
+        old.city = 'Nice'
+        self.assertEqual(jack.changed_fields(), set())
+        jack.address.city = 'Nice'
+        self.assertEqual(jack.changed_fields(), set(['address']))
+
+    def test_update_from_appstruct(self):
+        jack = self.make_one()
+        jack.mark_clean()
+        jack.update_from_appstruct({'name': 'John'})
+        self.assertEqual(jack.changed_fields(), set(['name']))
+
+    def test_appstruct_cached(self):
+        jack = self.make_one()
+        appstruct = jack.appstruct()
+        cached = jack._tracked_cache[0]
+        self.assertEqual(jack.appstruct(), appstruct)
+        self.assertIs(jack._tracked_cache[0], cached)
+        jack.phones[0].number = '555-1313'
+        appstruct2 = jack.appstruct()
+        cached2 = jack._tracked_cache[0]
+        self.assertIsNot(cached2, cached)
+        self.assertIs(cached2['address'], cached['address'])
+        self.assertIsNot(cached2['phones'], cached['phones'])
+        self.assertEqual(appstruct2['phones'][0]['number'], u'555-1313')
+
+    def test_appstruct_copied(self):
+        jack = self.make_one()
+        appstruct = jack.appstruct()
+        appstruct['name'] = 'John'
+        appstruct['address']['city'] = 'Lyon'
+        appstruct['phones'][0]['number'] = '555-1313'
+        appstruct['phones'].append({})
+        self.assertEqual(jack.appstruct(), self.make_one().appstruct())
+        phones = jack.phones.appstruct()
+        phones[0]['number'] = '555-1313'
+        self.assertEqual(jack.phones.appstruct()[0]['number'], u'555-1212')
+        self.assertEqual(jack.appstruct()['phones'][0]['number'],
+                         u'555-1212')
+
+    def test_serialize_cached(self):
+        jack = self.make_one()
+        cstruct = jack.serialize()
+        cached = jack._tracked_cache[1]
+        self.assertEqual(jack.serialize(), cstruct)
+        self.assertIs(jack._tracked_cache[1], cached)
+        jack.address.city = 'Lyon'
+        cstruct2 = jack.serialize()
+        cached2 = jack._tracked_cache[1]
+        self.assertIs(cached2['phones'], cached['phones'])
+        self.assertEqual(cstruct2['address'], {'city': u'Lyon'})
+        untracked = self.untracked(**jack.appstruct())
+        self.assertEqual(cstruct2, untracked.serialize())
+
+    def test_serialize_copied(self):
+        jack = self.make_one()
+        cstruct = jack.serialize()
+        cstruct['address']['city'] = 'Lyon'
+        del cstruct['phones'][:]
+        self.assertEqual(jack.serialize(), self.make_one().serialize())
+
+    def test_pickle_starts_clean(self):
+        import limone
+        import pickle
+        registry = limone.Registry()
+        registry.register_content_type(self.content_type)
+        registry.hook_import()
+        self.addCleanup(registry.unhook_import)
+        jack = self.make_one()
+        jack.serialize()
+        jack2 = pickle.loads(pickle.dumps(jack))
+        self.assertEqual(jack2.changed_fields(), set())
+        jack2.phones[0].number = '555-1313'
+        self.assertEqual(jack2.changed_fields(), set(['phones']))
+        self.assertEqual(jack2.serialize()['phones'][0]['number'],
+                         u'555-1313')
+
+
+class CodegenSlotsListChangeTrackingTests(ChangeTrackingTests):
+    options = {'codegen': True, 'layout': 'slots', 'sequences': 'list'}
+
+
+class LazyChangeTrackingTests(ChangeTrackingTests):
+    options = {'lazy': True}
+
+
+class PropertyFactoryTests(unittest2.TestCase):
+
+    def setUp(self):
+        import colander
+
+        class Address(colander.MappingSchema):
+            city = colander.SchemaNode(colander.String())
+            zip = colander.SchemaNode(colander.Int())
+
+        class Person(colander.MappingSchema):
+            name = colander.SchemaNode(colander.String())
+            address = Address()
+
+        self.schema = Person
+
+    def make_factory(self):
+        import limone
+
+        class Factory(limone.PropertyFactory):
+            pass
+
+        return Factory()
+
+    def test_nested_properties_shared(self):
+        import limone
+        ct = limone.make_content_type(self.schema, 'Person')
+        jack = ct(name='Jack', address={'city': 'Paris', 'zip': 75001})
+        fred = ct(name='Fred', address={'city': 'Lyon', 'zip': 69001})
+        self.assertIs(jack.address._props['city'],
+                      fred.address._props['city'])
+        self.assertEqual(fred.address.city, u'Lyon')
+
+    def test_resolution_cached(self):
+        import colander
+        factory = self.make_factory()
+        node = colander.SchemaNode(colander.Int(), name='x')
+        factory(None, node)
+        self.assertEqual(factory._resolved, {
+            colander.Int: factory.registry[colander.SchemaType]})
+
+    def test_registry_change_invalidates(self):
+        import colander
+        import limone
+
+        class RecordingProperty(limone._LeafNodeProperty):
+            log = []
+
+            def __set__(self, obj, value):
+                self.log.append((self.node.name, value))
+                return super(RecordingProperty, self).__set__(obj, value)
+
+        factory = self.make_factory()
+        ct = limone.make_content_type(self.schema, 'Person',
+                                      property_factory=factory)
+        ct(name='Jack', address={'city': 'Paris', 'zip': 75001})
+        self.assertEqual(RecordingProperty.log, [])
+
+        factory.registry[colander.Int] = RecordingProperty
+        ct(name='Jack', address={'city': 'Paris', 'zip': 75001})
+        self.assertEqual(RecordingProperty.log, [('zip', 75001)])
+
+        del factory.registry[colander.Int]
+        ct(name='Jack', address={'city': 'Paris', 'zip': 75002})
+        self.assertEqual(RecordingProperty.log, [('zip', 75001)])
+
+        factory.registry = {colander.SchemaType: RecordingProperty,
+                            colander.Mapping: limone._MappingNodeProperty}
+        ct(name='Jack', address={'city': 'Paris', 'zip': 75003})
+        self.assertEqual(RecordingProperty.log, [
+            ('zip', 75001), ('city', 'Paris'), ('zip', 75003)])
+
+
+    def test_class_registry(self):
+        import colander
+        import limone
+
+        class StringProperty(limone._LeafNodeProperty):
+            pass
+
+        class Factory(limone.PropertyFactory):
+            registry = {colander.String: StringProperty}
+
+        factory = Factory()
+        ct = limone.make_content_type(self.schema, 'Person',
+                                      property_factory=factory)
+        jack = ct(name='Jack', address={'city': 'Paris', 'zip': 75001})
+        self.assertIs(type(ct.__dict__['name']), StringProperty)
+        self.assertIs(type(jack.address._props['zip']),
+                      limone._LeafNodeProperty)
+        self.assertEqual(jack.address.city, u'Paris')
+
+        del factory.registry[colander.String]
+        ct = limone.make_content_type(self.schema, 'Person',
+                                      property_factory=factory)
+        self.assertIs(type(ct.__dict__['name']), limone._LeafNodeProperty)
+        self.assertEqual(Factory.registry, {colander.String: StringProperty})
+
+
+class RegistryTypeCacheTests(unittest2.TestCase):
+
+    def make_schema(self, maximum=200, validator=None):
+        import colander
+
+        class Address(colander.MappingSchema):
+            city = colander.SchemaNode(colander.String())
+
+        class Person(colander.MappingSchema):
+            name = colander.SchemaNode(colander.String(), validator=validator)
+            age = colander.SchemaNode(colander.Int(),
+                                      validator=colander.Range(0, maximum))
+            address = Address()
+
+        return Person
+
+    def make_registry(self, **kw):
+        import limone
+        return limone.Registry(**kw)
+
+    def test_identical_schemas_share_type(self):
+        registry = self.make_registry()
+        ct = registry.make_content_type(self.make_schema(), 'Person')
+        self.assertIs(registry.make_content_type(
+            self.make_schema(), 'Person'), ct)
+        jack = ct(name='Jack', age=52, address={'city': 'Paris'})
+        self.assertEqual(jack.age, 52)
+        info = registry.type_cache_info()
+        self.assertEqual((info.hits, info.misses, info.currsize), (1, 1, 1))
+
+    def test_different_schemas(self):
+        import colander
+        registry = self.make_registry()
+        ct = registry.make_content_type(self.make_schema(), 'Person')
+        self.assertIsNot(registry.make_content_type(
+            self.make_schema(maximum=100), 'Person'), ct)
+        self.assertIsNot(registry.make_content_type(
+            self.make_schema(validator=colander.Length(max=5)), 'Person'), ct)
+        self.assertIsNot(registry.make_content_type(
+            self.make_schema(), 'Person', codegen=True), ct)
+        self.assertIsNot(registry.make_content_type(
+            self.make_schema(), 'Human'), ct)
+        self.assertEqual(registry.type_cache_info().misses, 5)
+
+    def test_function_validators_compared_by_identity(self):
+        registry = self.make_registry()
+        def validator(node, value):
+            pass
+        ct = registry.make_content_type(
+            self.make_schema(validator=validator), 'Person')
+        self.assertIs(registry.make_content_type(
+            self.make_schema(validator=validator), 'Person'), ct)
+        self.assertIsNot(registry.make_content_type(
+            self.make_schema(validator=lambda node, value: None), 'Person'),
+            ct)
+
+    def test_unhashable_option(self):
+        import limone
+
+        class Factory(object):
+            __hash__ = None
+
+            def __call__(self, content, node):
+                return limone.property_factory(content, node)
+
+        registry = self.make_registry()
+        factory = Factory()
+        ct = registry.make_content_type(
+            self.make_schema(), 'Person', property_factory=factory)
+        self.assertIs(registry.make_content_type(
+            self.make_schema(), 'Person', property_factory=factory), ct)
+        jack = ct(name='Jack', age=52, address={'city': 'Paris'})
+        self.assertEqual(jack.age, 52)
+
+    def test_options_compared_by_identity(self):
+        import limone
+
+        class Factory(limone.PropertyFactory):
+            pass
+
+        class Meta(type):
+            pass
+
+        class Base(object):
+            pass
+
+        registry = self.make_registry()
+        schema = self.make_schema()
+        factory = Factory()
+        ct = registry.make_content_type(schema, 'Person', bases=(Base,),
+                                        meta=Meta, property_factory=factory)
+        self.assertIs(registry.make_content_type(
+            schema, 'Person', bases=(Base,), meta=Meta,
+            property_factory=factory), ct)
+
+        # Equal contents aren't enough.
+        self.assertIsNot(registry.make_content_type(
+            schema, 'Person', bases=(Base,), meta=Meta,
+            property_factory=Factory()), ct)
+        Meta2 = type('Meta', (type,), dict(Meta.__dict__))
+        self.assertIsNot(registry.make_content_type(
+            schema, 'Person', bases=(Base,), meta=Meta2,
+            property_factory=factory), ct)
+        Base2 = type('Base', (object,), dict(Base.__dict__))
+        self.assertIsNot(registry.make_content_type(
+            schema, 'Person', bases=(Base2,), meta=Meta,
+            property_factory=factory), ct)
+
+    def test_eviction(self):
+        import gc
+        registry = self.make_registry(max_cached_types=1)
+        ct = registry.make_content_type(self.make_schema(), 'Person')
+        jack = ct(name='Jack', age=52, address={'city': 'Paris'})
+        registry.make_content_type(self.make_schema(), 'Human')
+        info = registry.type_cache_info()
+        self.assertEqual((info.evictions, info.currsize), (1, 1))
+
+        # Still alive, thanks to the instance.
+        gc.collect()
+        self.assertIs(registry.make_content_type(
+            self.make_schema(), 'Person'), type(jack))
+
+        registry.make_content_type(self.make_schema(), 'Human')
+        del ct, jack
+        gc.collect()
+        registry.make_content_type(self.make_schema(), 'Person')
+        info = registry.type_cache_info()
+        self.assertEqual((info.hits, info.misses, info.evictions),
+                         (2, 3, 4))
+
+
+class ScanCacheTests(unittest2.TestCase):
+    package = 'limone_scan_test_pkg'
+
+    def setUp(self):
+        import os
+        import shutil
+        import sys
+        import tempfile
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        path = os.path.join(self.tmp, self.package)
+        os.mkdir(path)
+        with open(os.path.join(path, '__init__.py'), 'w') as f:
+            f.write('')
+        self.models = os.path.join(path, 'models.py')
+        self.write_models('Cat')
+        sys.path.insert(0, self.tmp)
+        self.addCleanup(sys.path.remove, self.tmp)
+        self.addCleanup(self.unload)
+        self.cache = os.path.join(self.tmp, 'manifest.json')
+
+    def write_models(self, name):
+        import os
+        with open(self.models, 'w') as f:
+            f.write('\n'.join([
+                'import colander',
+                'import limone',
+                '@limone.content_schema',
+                'class %s(colander.Schema):' % name,
+                '    fur = colander.SchemaNode(colander.String())',
+                '']))
+        # Make sure the change is seen even if the file was written in the
+        # same second.
+        stat = os.stat(self.models)
+        os.utime(self.models, (stat.st_atime, stat.st_mtime + 10))
+
+    def unload(self):
+        import sys
+        for name in list(sys.modules):
+            if name.startswith(self.package):
+                del sys.modules[name]
+
+    def import_package(self):
+        import sys
+        __import__(self.package)
+        return sys.modules[self.package]
+
+    def test_manifest_used(self):
+        import json
+        import limone
+        import sys
+        limone.Registry().scan(self.import_package(), cache=self.cache)
+        with open(self.cache) as f:
+            manifest = json.load(f)
+        self.assertEqual(manifest['types'], {
+            'Cat': [self.package + '.models', 'Cat']})
+
+        self.unload()
+        registry = limone.Registry()
+        registry.scan(self.import_package(), cache=self.cache)
+        self.assertNotIn(self.package + '.models', sys.modules)
+        cat = registry.get_content_type('Cat')
+        self.assertIs(cat, sys.modules[self.package + '.models'].Cat)
+        self.assertEqual(registry.get_content_types(), (cat,))
+        self.assertEqual(cat(fur='tabby').fur, 'tabby')
+
+    def test_types_already_registered(self):
+        import json
+        import limone
+        registry = limone.Registry()
+        package = self.import_package()
+        registry.scan(package)
+        registry.scan(package, cache=self.cache)
+        with open(self.cache) as f:
+            manifest = json.load(f)
+        self.assertEqual(manifest['types'], {
+            'Cat': [self.package + '.models', 'Cat']})
+
+    def test_get_content_types_resolves(self):
+        import limone
+        limone.Registry().scan(self.import_package(), cache=self.cache)
+        self.unload()
+        registry = limone.Registry()
+        registry.scan(self.import_package(), cache=self.cache)
+        self.assertEqual([ct.__name__ for ct in registry.get_content_types()],
+                         ['Cat'])
+
+    def test_stale_manifest(self):
+        import limone
+        import sys
+        limone.Registry().scan(self.import_package(), cache=self.cache)
+        self.unload()
+        self.write_models('Dog')
+        registry = limone.Registry()
+        registry.scan(self.import_package(), cache=self.cache)
+        self.assertIn(self.package + '.models', sys.modules)
+        self.assertIsNone(registry.get_content_type('Cat'))
+        self.assertEqual(registry.get_content_type('Dog').__name__, 'Dog')
+
+    def test_corrupt_manifest(self):
+        import limone
+        with open(self.cache, 'w') as f:
+            f.write('{')
+        registry = limone.Registry()
+        registry.scan(self.import_package(), cache=self.cache)
+        self.assertEqual(registry.get_content_type('Cat').__name__, 'Cat')
+
+
+class ImportTests(unittest2.TestCase):
+    # Generous, so as not to fail on slow machines, but small enough to catch
+    # something like a heavy dependency being imported eagerly again.
+    budget = 0.25
+
+    def run_python(self, source):
+        import os
+        import subprocess
+        import sys
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+        return subprocess.check_output(
+            [sys.executable, '-c', source], env=env).strip()
+
+    def test_scanning_machinery_not_imported(self):
+        output = self.run_python('\n'.join([
+            'import sys',
+            'import limone',
+            'print " ".join(sorted(name for name in (',
+            '    "venusian", "json", "random", "hashlib", "zlib",',
+            '    "limone.batch", "limone.collection", "limone.stream")',
+            '    if name in sys.modules))',
+        ]))
+        self.assertEqual(output, '')
+
+    def test_deferred_imports(self):
+        output = self.run_python('\n'.join([
+            'import colander',
+            'import limone',
+            'class Person(colander.MappingSchema):',
+            '    name = colander.SchemaNode(colander.String())',
+            'Person = limone.make_content_type(Person, "Person")',
+            'people = limone.ContentCollection(Person, [{"name": "Jack"}])',
+            'from limone.collection import ContentCollection',
+            'print type(people) is ContentCollection,',
+            'print isinstance(people, limone.ContentCollection),',
+            'people = limone.ContentCollection.from_instances(',
+            '    Person, [Person(name="Jill")])',
+            'print people[0].name,',
+            'print limone.validate_column(Person.__schema__["name"], [1])',
+        ]))
+        self.assertEqual(output, "True True Jill ([u'1'], [])")
+
+    def test_decorator_imports_venusian(self):
+        output = self.run_python('\n'.join([
+            'import sys',
+            'import colander',
+            'import limone',
+            '@limone.content_schema',
+            'class Cat(colander.Schema):',
+            '    fur = colander.SchemaNode(colander.String())',
+            'print "venusian" in sys.modules',
+        ]))
+        self.assertEqual(output, 'True')
+
+    def test_import_time(self):
+        output = self.run_python('\n'.join([
+            'import time',
+            'import colander',
+            'start = time.time()',
+            'import limone',
+            'print time.time() - start',
+        ]))
+        self.assertLess(float(output), self.budget)
+
+
+class PickleStateTests(unittest2.TestCase):
+
+    def setUp(self):
+        import colander
+        import limone
+
+        class Address(colander.MappingSchema):
+            city = colander.SchemaNode(colander.String())
+            zip = colander.SchemaNode(colander.Int())
+
+        class Tags(colander.SequenceSchema):
+            tag = colander.SchemaNode(colander.String())
+
+        class Person(colander.MappingSchema):
+            name = colander.SchemaNode(colander.String())
+            address = Address()
+            tags = Tags()
+
+        self.schema = Person
+        self.registry = limone.Registry()
+        self.registry.hook_import()
+        self.addCleanup(self.registry.unhook_import)
+
+    def make_type(self, schema=None, **options):
+        import limone
+        ct = limone.make_content_type(schema or self.schema, 'Person',
+                                      **options)
+        self.registry.register_content_type(ct)
+        return ct
+
+    def make_one(self, ct):
+        return ct(name='Jack', address={'city': 'Paris', 'zip': 75001},
+                  tags=['a', 'b'])
+
+    def test_state(self):
+        ct = self.make_type()
+        jack = self.make_one(ct)
+        jack.note = 'extra'
+        self.assertEqual(jack.__getstate__(), (
+            ct._schema_tag,
+            ('name', ('address', ('city', 'zip')), ('tags', ('tag',))),
+            (u'Jack', (u'Paris', 75001), [u'a', u'b']),
+            {'note': 'extra'}))
+        self.assertIs(jack.__getstate__()[1],
+                      self.make_one(ct).__getstate__()[1])
+
+    def test_extra_attributes(self):
+        import pickle
+        ct = self.make_type()
+        jack = self.make_one(ct)
+        jack.note = 'extra'
+        jack2 = pickle.loads(pickle.dumps(jack, 2))
+        self.assertEqual(jack2.note, 'extra')
+        self.assertIs(jack2.__content__, jack2)
+        self.assertIs(jack2.address.__content__, jack2)
+
+    def test_smaller_than_dict(self):
+        import pickle
+        ct = self.make_type()
+        jack = self.make_one(ct)
+        self.assertLess(len(pickle.dumps(jack, 2)),
+                        len(pickle.dumps(jack.__dict__, 2)) / 2)
+
+    def test_old_dict_state(self):
+        ct = self.make_type()
+        jack = self.make_one(ct)
+        state = jack.__dict__.copy()
+        jack2 = ct.__new__(ct)
+        jack2.__setstate__(state)
+        self.assertEqual(jack2.appstruct(), jack.appstruct())
+
+    def test_old_slots_state(self):
+        ct = self.make_type(layout='slots')
+        jack = self.make_one(ct)
+        values = tuple(prop.__get__(jack) for prop in ct._props)
+        jack2 = ct.__new__(ct)
+        jack2.__setstate__((None, values))
+        self.assertEqual(jack2.appstruct(), jack.appstruct())
+        self.assertIs(jack2.__content__, jack2)
+
+    def test_schema_changed(self):
+        import colander
+        ct = self.make_type()
+        state = self.make_one(ct).__getstate__()
+
+        # Nodes added, removed and moved are matched by name.
+        schema = self.schema().clone()
+        schema.children.reverse()
+        schema.add(colander.SchemaNode(colander.Int(), name='age', missing=0))
+        del schema['address']['city']
+        schema['address'].add(colander.SchemaNode(
+            colander.String(), name='country', missing=u'France'))
+        ct2 = self.make_type(schema)
+        jack = ct2.__new__(ct2)
+        jack.__setstate__(state)
+        self.assertEqual(jack.appstruct(), {
+            'name': u'Jack', 'age': 0, 'tags': [u'a', u'b'],
+            'address': {'zip': 75001, 'country': u'France'}})
+
+        # Values are validated for the new schema.
+        schema = self.schema().clone()
+        schema['address']['zip'].typ = colander.String()
+        ct2 = self.make_type(schema)
+        jack = ct2.__new__(ct2)
+        jack.__setstate__(state)
+        self.assertEqual(jack.address.zip, u'75001')
+        schema.add(colander.SchemaNode(colander.Int(), name='age'))
+        ct2 = self.make_type(schema)
+        with self.assertRaises(colander.Invalid):
+            ct2.__new__(ct2).__setstate__(state)
+
+    def test_schema_tag(self):
+        import colander
+        import pickle
+        ct = self.make_type()
+        data = pickle.dumps(self.make_one(ct), 2)
+        schema = self.schema().clone()
+        schema['address']['zip'].typ = colander.String()
+        self.assertNotEqual(self.make_type(schema)._schema_tag,
+                            ct._schema_tag)
+
+        # Missing values and validators don't change the layout of pickled
+        # instances, so instances pickled before they changed are restored
+        # as they are.
+        schema = self.schema().clone()
+        schema['address']['zip'].missing = 0
+        schema['address']['zip'].validator = colander.Range(0, 99999)
+        ct2 = self.make_type(schema)
+        self.assertEqual(ct2._schema_tag, ct._schema_tag)
+        self.assertEqual(pickle.loads(data).address.zip, 75001)
+
+    def test_unset_attribute(self):
+        import pickle
+        for layout in ('dict', 'slots'):
+            ct = self.make_type(layout=layout)
+            jack = ct.__new__(ct)
+            jack.__content__ = jack
+            jack.name = 'Jack'
+            jack2 = pickle.loads(pickle.dumps(jack, 2))
+            self.assertEqual(jack2.name, u'Jack')
+            with self.assertRaises((AttributeError, KeyError)):
+                jack2.address
+
+    def test_lazy_unvalidated(self):
+        import colander
+        import limone
+        import pickle
+        ct = self.make_type(lazy=True)
+        jack = ct(name='Jack', address={'city': 'Paris'})
+        jack2 = pickle.loads(pickle.dumps(jack, 2))
+        self.assertIs(type(jack2.__dict__['.address']), limone._Unvalidated)
+        with self.assertRaises(colander.Invalid):
+            jack2.address
+
+
+class CodecTests(unittest2.TestCase):
+
+    def setUp(self):
+        import colander
+        import datetime
+        import decimal
+        import limone
+
+        class Point(colander.TupleSchema):
+            x = colander.SchemaNode(colander.Float())
+            y = colander.SchemaNode(colander.Float())
+
+        class Reading(colander.MappingSchema):
+            value = colander.SchemaNode(colander.Int())
+            at = colander.SchemaNode(colander.DateTime())
+
+        class Readings(colander.SequenceSchema):
+            reading = Reading()
+
+        class Sensor(colander.MappingSchema):
+            name = colander.SchemaNode(colander.String())
+            offset = colander.SchemaNode(colander.Int(),
+                                         validator=colander.Range(-100, 100))
+            active = colander.SchemaNode(colander.Boolean())
+            price = colander.SchemaNode(colander.Decimal())
+            installed = colander.SchemaNode(colander.Date())
+            note = colander.SchemaNode(colander.String(), missing=None)
+            location = Point()
+            readings = Readings()
+
+        self.schema = Sensor
+        self.content_type = limone.make_content_type(Sensor, 'Sensor')
+        self.appstruct = {
+            'name': u'caf\xe9',
+            'offset': -42,
+            'active': True,
+            'price': decimal.Decimal('1.25'),
+            'installed': datetime.date(2011, 9, 1),
+            'location': (1.5, -2.25),
+            'readings': [
+                {'value': 2 ** 40, 'at': datetime.datetime(
+                    2011, 9, 1, 12, 30, tzinfo=colander.iso8601.iso8601.Utc())},
+                {'value': 0, 'at': datetime.datetime(
+                    2011, 9, 2, tzinfo=colander.iso8601.iso8601.Utc())},
+            ]}
+
+    def make_one(self):
+        return self.content_type(**self.appstruct)
+
+    def test_round_trip(self):
+        sensor = self.make_one()
+        sensor2 = self.content_type.from_buffer(sensor.to_bytes())
+        appstruct = dict(self.appstruct, note=None)
+        self.assertEqual(sensor2.appstruct(), appstruct)
+        self.assertEqual(sensor2.serialize(), sensor.serialize())
+
+    def test_compact(self):
+        import json
+        sensor = self.make_one()
+        self.assertLess(len(sensor.to_bytes()),
+                        len(json.dumps(sensor.serialize())) / 2)
+
+    def test_optional_present(self):
+        sensor = self.make_one()
+        sensor.note = 'hello'
+        sensor2 = self.content_type.from_buffer(sensor.to_bytes())
+        self.assertEqual(sensor2.note, u'hello')
+
+    def test_mmap(self):
+        import mmap
+        import tempfile
+        data = self.make_one().to_bytes()
+        with tempfile.TemporaryFile() as f:
+            f.write(data)
+            f.flush()
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                sensor = self.content_type.from_buffer(buf)
+            finally:
+                buf.close()
+        self.assertEqual(sensor.name, u'caf\xe9')
+
+    def test_buffer(self):
+        data = self.make_one().to_bytes()
+        sensor = self.content_type.from_buffer(buffer(data))
+        self.assertEqual(sensor.name, u'caf\xe9')
+
+    def test_decode_at_offset(self):
+        from limone.codec import decode
+        data = self.make_one().to_bytes()
+        buf = memoryview(data * 2)
+        sensor, end = decode(self.content_type, buf, len(data))
+        self.assertEqual(end, len(buf))
+        self.assertEqual(sensor.offset, -42)
+
+    def test_validate(self):
+        import colander
+        sensor = self.content_type.from_trusted_appstruct(
+            dict(self.appstruct, offset=500))
+        data = sensor.to_bytes()
+        self.assertEqual(self.content_type.from_buffer(data).offset, 500)
+        with self.assertRaises(colander.Invalid) as ecm:
+            self.content_type.from_buffer(data, validate=True)
+        self.assertEqual(ecm.exception.asdict().keys(), ['offset'])
+
+    def test_bad_buffers(self):
+        import limone
+        data = self.make_one().to_bytes()
+        with self.assertRaises(ValueError):
+            self.content_type.from_buffer(data[:-3])
+        with self.assertRaises(ValueError):
+            self.content_type.from_buffer(data + '\x00')
+        schema = self.schema().clone()
+        schema['location'].children[0].name = 'lon'
+        other = limone.make_content_type(schema, 'Other')
+        with self.assertRaises(ValueError):
+            other.from_buffer(data)
+
+        # Values of optional nodes are preceded by a flag.
+        schema = self.schema().clone()
+        schema['name'].missing = u''
+        other = limone.make_content_type(schema, 'Other')
+        with self.assertRaises(ValueError):
+            other.from_buffer(data)
+        schema = self.schema().clone()
+        schema['offset'].validator = None
+        other = limone.make_content_type(schema, 'Other')
+        self.assertEqual(other.from_buffer(data).name, u'caf\xe9')
+
+
+class ContentCollectionTests(unittest2.TestCase):
+
+    def setUp(self):
+        import colander
+        import limone
+
+        class Tags(colander.SequenceSchema):
+            tag = colander.SchemaNode(colander.String())
+
+        class Person(colander.MappingSchema):
+            name = colander.SchemaNode(colander.String())
+            age = colander.SchemaNode(colander.Int(),
+                                      validator=colander.Range(0, 200))
+            height = colander.SchemaNode(colander.Float(), missing=None)
+            active = colander.SchemaNode(colander.Boolean(), default=True)
+            tags = Tags()
+
+        self.content_type = limone.make_content_type(Person, 'Person')
+
+    def make_one(self, rows=()):
+        from limone import ContentCollection
+        return ContentCollection(self.content_type, rows)
+
+    def test_columns(self):
+        import array
+        people = self.make_one([
+            {'name': 'Jack', 'age': 52, 'height': 1.8, 'tags': ['a']},
+            {'name': 'Jill', 'age': '49', 'height': 1.7, 'active': False},
+        ])
+        self.assertEqual(len(people), 2)
+        self.assertEqual(people.column('age'), array.array('l', [52, 49]))
+        self.assertEqual(people.column('height'),
+                         array.array('d', [1.8, 1.7]))
+        self.assertEqual(people.column('name'), [u'Jack', u'Jill'])
+        self.assertEqual(people.column('tags'), [[u'a'], []])
+        self.assertEqual(sum(people.column('age')), 101)
+
+    def test_rows(self):
+        people = self.make_one([{'name': 'Jack', 'age': 52}])
+        jack = people[0]
+        self.assertEqual(jack.name, u'Jack')
+        self.assertIs(jack.active, True)
+        self.assertIsNone(jack.height)
+        self.assertEqual(jack.appstruct(), {
+            'name': u'Jack', 'age': 52, 'height': None, 'active': True,
+            'tags': []})
+        self.assertEqual(people[-1].age, 52)
+        with self.assertRaises(IndexError):
+            people[1]
+        with self.assertRaises(AttributeError):
+            jack.foo
+
+    def test_set(self):
+        import colander
+        people = self.make_one([{'name': 'Jack', 'age': 52}])
+        jack = people[0]
+        jack.age = '53'
+        self.assertEqual(people.column('age')[0], 53)
+        with self.assertRaises(colander.Invalid):
+            jack.age = 500
+        self.assertEqual(jack.age, 53)
+        jack.active = False
+        self.assertIs(jack.active, False)
+        with self.assertRaises(AttributeError):
+            jack.foo = 1
+
+    def test_list_fallback(self):
+        import array
+        people = self.make_one([{'name': 'Jack', 'age': 52, 'height': 1.8}])
+        self.assertIsInstance(people.column('height'), array.array)
+        people.append({'name': 'Jill', 'age': 49})
+        self.assertEqual(people.column('height'), [1.8, None])
+        self.assertEqual([p.height for p in people], [1.8, None])
+
+    def test_optional_boolean(self):
+        import colander
+        import limone
+        from limone import ContentCollection
+
+        class Task(colander.MappingSchema):
+            done = colander.SchemaNode(colander.Boolean(), missing=None)
+
+        ct = limone.make_content_type(Task, 'Task')
+        tasks = ContentCollection(ct, [{'done': True}, {}, {'done': False}])
+        self.assertEqual([task.done for task in tasks], [True, None, False])
+        self.assertEqual(tasks[1].appstruct(), {'done': None})
+        self.assertIsNone(tasks[1].to_instance().done)
+
+    def test_invalid_rows(self):
+        import colander
+        people = self.make_one([{'name': 'Jack', 'age': 52}])
+        with self.assertRaises(colander.Invalid) as ecm:
+            people.extend([{'name': 'Jill', 'age': 49},
+                           {'name': 'Joe', 'age': 500},
+                           {'name': 'Jim', 'age': 5, 'foo': 1}])
+        self.assertEqual(sorted(ecm.exception.asdict()), ['1.age', '2'])
+        self.assertEqual(len(people), 1)
+        self.assertEqual(len(people.column('age')), 1)
+
+    def test_instances(self):
+        from limone import ContentCollection
+        jack = self.content_type(name='Jack', age=52, tags=['a', 'b'])
+        jill = self.content_type(name='Jill', age=49, active=False)
+        people = ContentCollection.from_instances(
+            self.content_type, [jack, jill])
+        instances = people.to_instances()
+        self.assertEqual([p.appstruct() for p in instances],
+                         [jack.appstruct(), jill.appstruct()])
+        instances[0].tags.append('c')
+        self.assertEqual(list(instances[0].tags), [u'a', u'b', u'c'])
+
+    def test_as_numpy(self):
+        try:
+            import numpy
+        except ImportError:
+            raise unittest2.SkipTest('NumPy is not installed.')
+        people = self.make_one([{'name': 'Jack', 'age': 52},
+                                {'name': 'Jill', 'age': 49}])
+        self.assertEqual(people.as_numpy('age').sum(), 101)
+        with self.assertRaises(TypeError):
+            people.as_numpy('name')
+
+
+class ValidateColumnTests(unittest2.TestCase):
+
+    def call_it(self, node, values, trusted=()):
+        from limone import validate_column
+        return validate_column(node, values, trusted)
+
+    def assert_scalar(self, node, values):
+        # Gives the same results as validating one value at a time.
+        import colander
+        from limone import _leaf_validator
+        check = _leaf_validator(node)
+        expected_values = []
+        expected_errors = []
+        for i, value in enumerate(values):
+            try:
+                expected_values.append((i, check(value)))
+            except colander.Invalid, e:
+                expected_errors.append((i, e.msg))
+        validated, errors = self.call_it(node, values)
+        invalid = set(i for i, e in errors)
+        self.assertEqual([(i, value) for i, value in enumerate(validated)
+                          if i not in invalid], expected_values)
+        self.assertEqual([(i, e.msg) for i, e in errors], expected_errors)
+        return errors
+
+    def test_range(self):
+        import colander
+        node = colander.SchemaNode(colander.Int(), name='age',
+                                   validator=colander.Range(0, 200))
+        errors = self.assert_scalar(node, [5, '7', -1, 300, 200, 0])
+        self.assertEqual([i for i, e in errors], [2, 3])
+        self.assertEqual(errors[0][1].asdict(),
+                         {'age': u'-1 is less than minimum value 0'})
+
+    def test_range_one_bound(self):
+        import colander
+        node = colander.SchemaNode(colander.Float(), name='x',
+                                   validator=colander.Range(max=1.5))
+        errors = self.assert_scalar(node, [-10.0, 1.5, 1.6])
+        self.assertEqual([i for i, e in errors], [2])
+
+    def test_one_of(self):
+        import colander
+        node = colander.SchemaNode(colander.String(), name='color',
+                                   validator=colander.OneOf(['red', 'blue']))
+        errors = self.assert_scalar(node, ['red', 'green', u'blue'])
+        self.assertEqual([i for i, e in errors], [1])
+
+    def test_length(self):
+        import colander
+        node = colander.SchemaNode(colander.String(), name='code',
+                                   validator=colander.Length(2, 3))
+        errors = self.assert_scalar(node, ['a', 'ab', 'abc', 'abcd'])
+        self.assertEqual([i for i, e in errors], [0, 3])
+
+    def test_all(self):
+        import colander
+        node = colander.SchemaNode(colander.Int(), name='n',
+                                   validator=colander.All(
+                                       colander.Range(0, 10),
+                                       colander.OneOf([1, 2, 20])))
+        errors = self.assert_scalar(node, [1, 3, 20, -1])
+        self.assertEqual([i for i, e in errors], [1, 2, 3])
+        self.assertEqual(len(errors[2][1].msg), 2)
+
+    def test_custom_validator(self):
+        import colander
+        calls = []
+
+        def even(node, value):
+            calls.append(value)
+            if value % 2:
+                raise colander.Invalid(node, 'Odd')
+
+        node = colander.SchemaNode(colander.Int(), name='n',
+                                   validator=colander.All(
+                                       colander.Range(0, 10), even))
+        errors = self.assert_scalar(node, [2, 3, 12])
+        self.assertEqual([i for i, e in errors], [1, 2])
+
+    def test_missing_and_default(self):
+        import colander
+        node = colander.SchemaNode(colander.Int(), name='n', missing=-1,
+                                   validator=colander.Range(0, 10))
+        values, errors = self.call_it(node, [1, colander.null, 11])
+        self.assertEqual(values, [1, -1, 11])
+        self.assertEqual([i for i, e in errors], [2])
+        node = colander.SchemaNode(colander.String(), name='s', default='x',
+                                   validator=colander.Length(1))
+        self.assert_scalar(node, [colander.null, 'y', ''])
+
+    def test_invalid_values(self):
+        import colander
+        node = colander.SchemaNode(colander.Int(), name='n',
+                                   validator=colander.Range(0, 10))
+        errors = self.assert_scalar(node, [1, 'x', colander.null, 20])
+        self.assertEqual([i for i, e in errors], [1, 2, 3])
+        self.assertEqual(errors[1][1].asdict(), {'n': u'Required'})
+
+    def test_preparer(self):
+        import colander
+        node = colander.SchemaNode(colander.Int(), name='n',
+                                   preparer=lambda value: value * 10,
+                                   validator=colander.Range(0, 50))
+        errors = self.assert_scalar(node, [1, 5, 6])
+        self.assertEqual([i for i, e in errors], [2])
+
+    def test_array(self):
+        import array
+        import colander
+        node = colander.SchemaNode(colander.Int(), name='n',
+                                   validator=colander.Range(0, 10))
+        column = array.array('l', [1, 20, 3])
+        values, errors = self.call_it(node, column)
+        self.assertIs(values, column)
+        self.assertEqual([i for i, e in errors], [1])
+
+    def test_trusted(self):
+        import colander
+        node = colander.SchemaNode(colander.Int(), name='n', missing=None,
+                                   validator=colander.Range(0, 10))
+        values, errors = self.call_it(node, [None, 20, 'x'], trusted=[0])
+        self.assertEqual(values, [None, 20, 'x'])
+        self.assertEqual([i for i, e in errors], [1, 2])
+
+    def test_not_a_leaf(self):
+        import colander
+        node = colander.SchemaNode(colander.Mapping(), name='m')
+        with self.assertRaises(TypeError):
+            self.call_it(node, [{}])
+
+    def test_collection_extend(self):
+        import colander
+        import limone
+
+        class Person(colander.MappingSchema):
+            name = colander.SchemaNode(colander.String())
+            age = colander.SchemaNode(colander.Int(), missing=None,
+                                      validator=colander.Range(0, 200))
+
+        Person = limone.make_content_type(Person, 'Person')
+        people = limone.ContentCollection(Person)
+        people.extend([Person(name='Jack'), {'name': 'Jill', 'age': 49}])
+        self.assertEqual(people.column('age'), [None, 49])
+        with self.assertRaises(colander.Invalid) as ecm:
+            people.extend([Person(name='Joe'), {'name': 'Jim', 'age': -5},
+                           {'age': 300}])
+        self.assertEqual(ecm.exception.asdict(), {
+            '1.age': u'-5 is less than minimum value 0',
+            '2.name': u'Required',
+            '2.age': u'300 is greater than maximum value 200'})
+        self.assertEqual(len(people), 2)
+
+
+class _DeferredFuture(object):
+    # Runs its function when its result is asked for, so tests can see what
+    # has been submitted but not yet run.
+
+    def __init__(self, fn, args):
+        self.fn = fn
+        self.args = args
+        self.cancelled = False
+
+    def result(self):
+        assert not self.cancelled
+        return self.fn(*self.args)
+
+    def cancel(self):
+        self.cancelled = True
+        return True
+
+
+class _DeferredExecutor(object):
+
+    def __init__(self):
+        self.submitted = []
+
+    def submit(self, fn, *args):
+        future = _DeferredFuture(fn, args)
+        self.submitted.append(future)
+        return future
+
+
+class IterDeserializeFuturesTests(unittest2.TestCase):
+
+    def setUp(self):
+        import colander
+        import limone
+
+        class Person(colander.Schema):
+            name = colander.SchemaNode(colander.String())
+            age = colander.SchemaNode(colander.Int())
+
+        self.content_type = limone.make_content_type(Person, 'Person')
+        self.cstructs = [{'name': u'P%d' % i, 'age': str(i)}
+                         for i in xrange(10)]
+        self.cstructs[7]['age'] = 'seven'
+        self.executor = _DeferredExecutor()
+
+    def call_it(self, cstructs, **kw):
+        from limone import iter_deserialize_futures
+        return iter_deserialize_futures(self.content_type, cstructs,
+                                        self.executor.submit, **kw)
+
+    def test_results(self):
+        people = []
+        errors = []
+        for future in self.call_it(self.cstructs, chunk_size=3):
+            chunk_people, chunk_errors = future.result()
+            people.extend(chunk_people)
+            errors.extend(chunk_errors)
+        self.assertEqual(len(self.executor.submitted), 4)
+        self.assertEqual(len(people), 10)
+        self.assertIsNone(people[7])
+        self.assertEqual(people[9].age, 9)
+        self.assertEqual([i for i, e in errors], [7])
+
+    def test_backpressure(self):
+        read = []
+        def cstructs():
+            for cstruct in self.cstructs:
+                read.append(cstruct)
+                yield cstruct
+        futures = self.call_it(cstructs(), chunk_size=2, max_pending=2)
+        next(futures)
+        self.assertEqual(len(self.executor.submitted), 2)
+        self.assertEqual(len(read), 4)
+        next(futures)
+        self.assertEqual(len(self.executor.submitted), 3)
+
+    def test_close_cancels(self):
+        futures = self.call_it(self.cstructs, chunk_size=2, max_pending=3)
+        first = next(futures)
+        futures.close()
+        submitted = self.executor.submitted
+        self.assertEqual([f.cancelled for f in submitted],
+                         [False, True, True])
+        self.assertIs(submitted[0], first)
+
+
+class JSONLinesFeedTests(unittest2.TestCase):
+
+    def setUp(self):
+        import colander
+        import limone
+
+        class Person(colander.Schema):
+            name = colander.SchemaNode(colander.String())
+            age = colander.SchemaNode(colander.Int())
+
+        self.content_type = limone.make_content_type(Person, 'Person')
+        self.data = ''.join([
+            '{"name": "Joe", "age": "35"}\n',
+            '\n',
+            '{"name": "Fred", "age": "old"}\n',
+            '{"name": "Sue", \n',
+            '{"name": "Jill", "age": "2"}\n',
+            '[1, 2]',
+        ])
+        self.executor = _DeferredExecutor()
+
+    def make_one(self, **kw):
+        from limone import JSONLinesFeed
+        return JSONLinesFeed(self.content_type, self.executor.submit, **kw)
+
+    def _drain(self, feed):
+        results = []
+        while True:
+            future = feed.pop()
+            if future is None:
+                return results
+            for result in future.result():
+                if isinstance(result, tuple):
+                    lineno, error = result
+                    results.append((lineno, error.asdict().keys()))
+                else:
+                    results.append(result.appstruct())
+
+    def test_results(self):
+        expected = [
+            {'name': u'Joe', 'age': 35},
+            (3, ['age']),
+            (4, ['']),
+            {'name': u'Jill', 'age': 2},
+            (6, [''])]
+        for size in (1, 5, 100):
+            feed = self.make_one(batch_size=2)
+            results = []
+            for i in xrange(0, len(self.data), size):
+                feed.feed(self.data[i:i + size])
+                results.extend(self._drain(feed))
+            feed.close()
+            results.extend(self._drain(feed))
+            self.assertEqual(results, expected)
+
+    def test_backpressure(self):
+        feed = self.make_one(batch_size=1, max_pending=2)
+        feed.feed(self.data)
+        self.assertEqual(len(self.executor.submitted), 2)
+        self.assertTrue(feed.paused)
+        with self.assertRaises(ValueError):
+            feed.feed('{"name": "Bob", "age": "1"}\n')
+        feed.pop()
+        self.assertEqual(len(self.executor.submitted), 3)
+        feed.close()
+        feed.pop()
+        feed.pop()
+        self.assertEqual(len(self.executor.submitted), 5)
+        self.assertFalse(feed.paused)
+
+    def test_large_piece_split_as_batches_are_taken(self):
+        data = ''.join(['{"name": "Joe", "age": "%d"}\n' % i
+                        for i in xrange(100)])
+        feed = self.make_one(batch_size=10, max_pending=2)
+        feed.feed(data + '{"name": "Sue", "age": "100"}')
+        self.assertEqual(len(self.executor.submitted), 2)
+        self.assertTrue(feed.paused)
+        self.assertEqual(len(feed._lines), 10)
+        ages = []
+        while True:
+            future = feed.pop()
+            if future is None:
+                break
+            self.assertLessEqual(len(feed._lines), 10)
+            ages.extend(person.age for person in future.result())
+            if not feed.paused:
+                feed.close()
+        self.assertEqual(ages, range(101))
+        self.assertEqual(len(self.executor.submitted), 11)
+
+    def test_cancel(self):
+        feed = self.make_one(batch_size=1, max_pending=2)
+        feed.feed(self.data)
+        feed.cancel()
+        self.assertEqual([f.cancelled for f in self.executor.submitted],
+                         [True, True])
+        self.assertIsNone(feed.pop())
+        with self.assertRaises(ValueError):
+            feed.feed('{}\n')
+
+
+class BenchTests(unittest2.TestCase):
+
+    def test_run(self):
+        from limone import bench
+        results = bench.run(select='.get', repeat=2, min_time=0)
+        self.assertEqual([r['name'] for r in results['results']], [
+            'flat.get', 'wide.get', 'nested.get', 'sequences.get'])
+        self.assertEqual(len(results['results'][0]['times']), 2)
+
+    def test_all_benchmarks(self):
+        from limone import bench
+        results = bench.run(dict(codegen=True, layout='slots'), repeat=1,
+                            min_time=0)
+        names = [r['name'] for r in results['results']]
+        self.assertEqual(len(names), 39)
+        self.assertIn('sequences.append100', names)
+
+    def test_main_and_compare(self):
+        import json
+        import os
+        import shutil
+        import tempfile
+        from StringIO import StringIO
+        from limone import bench
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        path = os.path.join(tmp, 'results.json')
+        bench.main(['-k', 'flat.set', '-r', '1', '-t', '0', '--codegen',
+                    '-o', path])
+        with open(path) as f:
+            results = json.load(f)
+        self.assertEqual(results['options']['codegen'], True)
+        self.assertEqual(results['results'][0]['name'], 'flat.set')
+        out = StringIO()
+        bench.main(['--compare', path, path], out)
+        self.assertTrue(out.getvalue().startswith('flat.set'))
+        self.assertTrue(out.getvalue().strip().endswith('1.00x'))
+
+
+class RegistryStatsTests(unittest2.TestCase):
+    options = {}
+
+    def setUp(self):
+        import colander
+        import limone
+
+        class Phone(colander.MappingSchema):
+            number = colander.SchemaNode(colander.String())
+
+        class Phones(colander.SequenceSchema):
+            phone = Phone()
+
+        class Person(colander.MappingSchema):
+            name = colander.SchemaNode(colander.String())
+            age = colander.SchemaNode(colander.Int(), default=0,
+                                      validator=colander.Range(0, 200))
+            phones = Phones()
+
+        self.content_type = limone.make_content_type(
+            Person, 'Person', **self.options)
+        self.registry = limone.Registry()
+        self.registry.register_content_type(self.content_type)
+
+    def test_disabled(self):
+        self.assertIsNone(self.registry.stats())
+        self.assertIsNone(self.registry.export_stats())
+
+    def test_stats(self):
+        import colander
+        ct = self.content_type
+        self.registry.enable_stats()
+        jack = ct(name='Jack', age=52)
+        with self.assertRaises(colander.Invalid):
+            ct(name='Jill', age=500)
+        jack.age = 53
+        with self.assertRaises(colander.Invalid):
+            jack.age = -1
+        jack.phones = [{'number': '555-1234'}]
+        jack.update_from_appstruct({'name': 'Jim'})
+        stats = self.registry.stats()['Person']
+        self.assertEqual(stats['constructions'], 2)
+        self.assertEqual(stats['invalid'], 1)
+        self.assertGreater(stats['construction_time'], 0)
+        fields = stats['fields']
+        self.assertEqual(fields['age']['assignments'], 4)
+        self.assertEqual(fields['age']['invalid'], 2)
+        self.assertGreater(fields['age']['validation_time'], 0)
+        self.assertEqual(fields['name']['assignments'], 3)
+        self.assertEqual(fields['name']['invalid'], 0)
+        self.assertEqual(fields['phones']['assignments'], 3)
+        self.assertEqual(jack.appstruct(), {
+            'name': u'Jim', 'age': 53,
+            'phones': [{'number': u'555-1234'}]})
+
+    def test_bulk_construction(self):
+        self.registry.enable_stats()
+        people, errors = self.content_type.from_appstructs([
+            {'name': 'Jack'}, {'name': 'Jill', 'age': 'x'}])
+        fields = self.registry.stats()['Person']['fields']
+        self.assertEqual(fields['age']['assignments'], 2)
+        self.assertEqual(fields['age']['invalid'], 1)
+
+    def test_deserialize_many(self):
+        self.registry.enable_stats()
+        people, errors = self.content_type.deserialize_many([
+            {'name': 'Jack', 'age': '52', 'phones': []},
+            {'name': 'Jill', 'age': 'x', 'phones': []},
+            {'name': 'Jim', 'age': '30', 'phones': [{'number': '555-1234'}]}])
+        self.assertEqual([i for i, error in errors], [1])
+        stats = self.registry.stats()['Person']
+        self.assertEqual(stats['constructions'], 3)
+        self.assertEqual(stats['invalid'], 1)
+        self.assertGreater(stats['construction_time'], 0)
+        self.assertEqual(stats['restorations'], 0)
+
+    def test_restorations(self):
+        import pickle
+        from limone import ContentCollection
+        self.registry.enable_stats()
+        self.registry.hook_import('__limone_stats_test__')
+        self.addCleanup(self.registry.unhook_import)
+        ct = self.content_type
+        jack = ct.from_trusted_appstruct(
+            {'name': u'Jack', 'age': 52, 'phones': []})
+        pickle.loads(pickle.dumps(jack, 2))
+        ct.from_buffer(jack.to_bytes())
+        ContentCollection(ct, [jack]).to_instances()
+        stats = self.registry.stats()['Person']
+        self.assertEqual(stats['restorations'], 4)
+        self.assertEqual(stats['constructions'], 0)
+
+    def test_export(self):
+        exported = []
+        self.registry.enable_stats(exported.append)
+        self.content_type(name='Jack')
+        stats = self.registry.export_stats()
+        self.assertEqual(exported, [stats])
+        self.assertEqual(stats['Person']['constructions'], 1)
+        self.assertEqual(
+            self.registry.stats()['Person']['constructions'], 0)
+
+    def test_disable_restores_type(self):
+        ct = self.content_type
+        before = dict(ct.__dict__)
+        self.registry.enable_stats()
+        self.assertIsNot(ct.__dict__['age'], before['age'])
+        self.registry.disable_stats()
+        self.assertEqual(dict(ct.__dict__), before)
+        self.assertIsNone(self.registry.stats())
+        self.assertEqual(ct(name='Jack', age=5).age, 5)
+
+    def test_types_registered_later(self):
+        import colander
+        import limone
+        self.registry.enable_stats()
+
+        class Cat(colander.MappingSchema):
+            name = colander.SchemaNode(colander.String())
+
+        cat = limone.make_content_type(Cat, 'Cat', **self.options)
+        self.registry.register_content_type(cat)
+        cat(name='Felix')
+        self.assertEqual(self.registry.stats()['Cat']['constructions'], 1)
+
+    def test_instrumented_by_another_registry(self):
+        import limone
+        self.registry.enable_stats()
+        registry = limone.Registry()
+        registry.register_content_type(self.content_type)
+        with self.assertRaises(ValueError):
+            registry.enable_stats()
+
+    def test_pickle(self):
+        import pickle
+        self.registry.enable_stats()
+        self.registry.hook_import('__limone_stats_test__')
+        self.addCleanup(self.registry.unhook_import)
+        jack = self.content_type(name='Jack', age=52,
+                                 phones=[{'number': '555-1234'}])
+        copy = pickle.loads(pickle.dumps(jack, 2))
+        self.assertEqual(copy.appstruct(), jack.appstruct())
+
+
+class CodegenSlotsRegistryStatsTests(RegistryStatsTests):
+    options = {'codegen': True, 'layout': 'slots'}
+
+
+class TrackedCodegenRegistryStatsTests(RegistryStatsTests):
+    options = {'codegen': True, 'track_changes': True}
+
+
+class IndexedSequenceTests(unittest2.TestCase):
+    options = {}
+
+    def setUp(self):
+        import colander
+        import limone
+
+        class Tags(colander.SequenceSchema):
+            tag = colander.SchemaNode(colander.String())
+
+        class Scores(colander.SequenceSchema):
+            score = colander.SchemaNode(colander.Int())
+
+        class Document(colander.MappingSchema):
+            tags = Tags(index='hash')
+            scores = Scores(index='sorted')
+
+        self.content_type = limone.make_content_type(
+            Document, 'Document', **self.options)
+
+    def make_one(self, tags=(), scores=()):
+        return self.content_type(tags=list(tags), scores=list(scores))
+
+    def assert_index(self, seq):
+        # The index agrees with the values in the sequence.
+        values = list(seq)
+        counts = {}
+        for value in values:
+            counts[value] = counts.get(value, 0) + 1
+        self.assertEqual(seq._counts, counts)
+        if seq._positions is not None:
+            # Positions kept up to date as the sequence changed.
+            positions = {}
+            for i, value in enumerate(values):
+                positions.setdefault(value, i)
+            self.assertEqual(seq._positions, positions)
+        for value in counts:
+            self.assertEqual(seq.index(value), values.index(value))
+        if seq._sorted is not None:
+            self.assertEqual(seq._sorted, sorted(values))
+
+    def test_lookups(self):
+        doc = self.make_one(['a', 'b', 'a', 'c'])
+        tags = doc.tags
+        self.assertIn('a', tags)
+        self.assertNotIn('d', tags)
+        self.assertNotIn(['a'], tags)
+        self.assertEqual(tags.count('a'), 2)
+        self.assertEqual(tags.count('d'), 0)
+        self.assertEqual(tags.index('c'), 3)
+        self.assertEqual(tags.index('a', 1), 2)
+        with self.assertRaises(ValueError):
+            tags.index('d')
+        with self.assertRaises(ValueError):
+            tags.index('b', 2)
+
+    def test_mutations(self):
+        doc = self.make_one(['a', 'b', 'c'])
+        tags = doc.tags
+        tags.index('a')
+        tags.append('d')
+        self.assert_index(tags)
+        tags.extend(['a', 'e'])
+        self.assert_index(tags)
+        tags.insert(0, 'e')
+        self.assert_index(tags)
+        tags.insert(-1, 'f')
+        tags.insert(100, 'g')
+        self.assert_index(tags)
+        tags[1] = 'z'
+        self.assert_index(tags)
+        tags[2:4] = ['x', 'y', 'x']
+        self.assert_index(tags)
+        tags[-2:] = []
+        self.assert_index(tags)
+        tags.pop()
+        self.assert_index(tags)
+        tags.pop(0)
+        self.assert_index(tags)
+        tags.remove('x')
+        self.assert_index(tags)
+        del tags[0]
+        self.assert_index(tags)
+        del tags[1:3]
+        self.assert_index(tags)
+        tags.reverse()
+        self.assert_index(tags)
+
+    def test_invalid_mutation_leaves_index(self):
+        import colander
+        doc = self.make_one(scores=[1, 2])
+        scores = doc.scores
+        with self.assertRaises(colander.Invalid):
+            scores.append('x')
+        with self.assertRaises(colander.Invalid):
+            scores[0:1] = [3, 'x']
+        with self.assertRaises(colander.Invalid):
+            scores.extend([3, 'x'])
+        self.assert_index(scores)
+        self.assertEqual(list(scores), [1, 2])
+        self.assertNotIn(3, scores)
+
+    def test_positions_updated(self):
+        doc = self.make_one(['a', 'b', 'a', 'c', 'b'])
+        tags = doc.tags
+        tags.index('a')
+        tags.append('d')
+        self.assertEqual(tags._positions, {'a': 0, 'b': 1, 'c': 3, 'd': 5})
+        tags.extend(['e', 'a'])
+        self.assertEqual(tags._positions,
+                         {'a': 0, 'b': 1, 'c': 3, 'd': 5, 'e': 6})
+        tags[-3:] = []
+        self.assertEqual(tags._positions, {'a': 0, 'b': 1, 'c': 3})
+        tags[2] = 'd'
+        self.assertEqual(tags._positions, {'a': 0, 'b': 1, 'd': 2, 'c': 3})
+        tags[0] = 'b'
+        self.assertEqual(tags._positions, {'b': 0, 'd': 2, 'c': 3})
+        self.assert_index(tags)
+
+        # Changes which move the values after them drop the positions.
+        tags.insert(1, 'c')
+        self.assertIs(tags._positions, None)
+        self.assertEqual(tags.index('c'), 1)
+        del tags[0]
+        self.assertIs(tags._positions, None)
+        self.assert_index(tags)
+
+    def test_insert_sorted_validates_once(self):
+        import colander
+        import limone
+        calls = []
+
+        def validator(node, value):
+            calls.append(value)
+
+        class Scores(colander.SequenceSchema):
+            score = colander.SchemaNode(colander.Int(), validator=validator)
+
+        class Document(colander.MappingSchema):
+            scores = Scores(index='sorted')
+
+        ct = limone.make_content_type(Document, 'Document', **self.options)
+        scores = ct(scores=[1, 3]).scores
+        del calls[:]
+        scores.insert_sorted(2)
+        self.assertEqual(calls, [2])
+        self.assertEqual(list(scores), [1, 2, 3])
+
+    def test_sorted(self):
+        doc = self.make_one(scores=[10, 20, 30])
+        scores = doc.scores
+        self.assertEqual(scores.insert_sorted('25'), 2)
+        self.assertEqual(scores.insert_sorted(5), 0)
+        self.assertEqual(scores.insert_sorted(30), 5)
+        self.assertEqual(list(scores), [5, 10, 20, 25, 30, 30])
+        self.assert_index(scores)
+        self.assertEqual(scores.values_between(10, 25), [10, 20, 25])
+        self.assertEqual(scores.values_between(min=26), [30, 30])
+        self.assertEqual(scores.values_between(max=9), [5])
+        scores.append(1)
+        self.assertEqual(scores.values_between(max=9), [1, 5])
+        with self.assertRaises(ValueError):
+            scores.insert_sorted(7)
+        scores.insert(0, 0)
+        with self.assertRaises(ValueError):
+            scores.insert_sorted(7)
+        del scores[-1]
+        self.assertEqual(scores.insert_sorted(7), 2)
+        self.assertEqual(list(scores), [0, 5, 7, 10, 20, 25, 30, 30])
+        scores.reverse()
+        with self.assertRaises(ValueError):
+            scores.insert_sorted(7)
+        scores[:] = [3, 2, 1]
+        scores[0:2] = [1, 2]
+        scores[2] = 3
+        self.assertEqual(scores.insert_sorted(2), 2)
+        with self.assertRaises(TypeError):
+            doc.tags.insert_sorted('a')
+        with self.assertRaises(TypeError):
+            doc.tags.values_between('a', 'b')
+
+    def test_replace_and_pickle(self):
+        import pickle
+        doc = self.make_one(['a', 'b'], [3, 1, 2])
+        doc.tags = ['c']
+        self.assertIn('c', doc.tags)
+        self.assertNotIn('a', doc.tags)
+        restored = self.content_type.__new__(self.content_type)
+        restored.__setstate__(doc.__getstate__())
+        self.assertIn('c', restored.tags)
+        self.assertEqual(restored.scores.values_between(), [1, 2, 3])
+        self.assert_index(restored.scores)
+
+    def test_bad_declarations(self):
+        import colander
+        import limone
+
+        class Phone(colander.MappingSchema):
+            number = colander.SchemaNode(colander.String())
+
+        class Phones(colander.SequenceSchema):
+            phone = Phone()
+
+        class Person(colander.MappingSchema):
+            phones = Phones(index='hash')
+
+        with self.assertRaises(TypeError):
+            limone.make_content_type(Person, 'Person')
+
+        class Person(colander.MappingSchema):
+            phones = Phones(index='btree')
+
+        with self.assertRaises(ValueError):
+            limone.make_content_type(Person, 'Person')
+
+
+class ListIndexedSequenceTests(IndexedSequenceTests):
+    options = {'sequences': 'list'}
+
+
+class TrackedCodegenIndexedSequenceTests(IndexedSequenceTests):
+    options = {'codegen': True, 'track_changes': True, 'lazy': True}
+
+    def test_changes_tracked(self):
+        doc = self.make_one(['a'])
+        doc.mark_clean()
+        doc.tags.append('b')
+        self.assertEqual(doc.changed_fields(), set(['tags']))
+        self.assertIn('b', doc.tags)
+
+
+class CloneTests(unittest2.TestCase):
+    options = {}
+
+    def setUp(self):
+        import colander
+        import limone
+
+        class Friend(colander.TupleSchema):
+            rank = colander.SchemaNode(colander.Int())
+            name = colander.SchemaNode(colander.String())
+
+        class Phone(colander.MappingSchema):
+            location = colander.SchemaNode(colander.String())
+            number = colander.SchemaNode(colander.String())
+
+        class Friends(colander.SequenceSchema):
+            friend = Friend()
+
+        class Phones(colander.SequenceSchema):
+            phone = Phone()
+
+        class Tags(colander.SequenceSchema):
+            tag = colander.SchemaNode(colander.String())
+
+        class Address(colander.MappingSchema):
+            city = colander.SchemaNode(colander.String())
+            phones = Phones()
+
+        class Person(colander.MappingSchema):
+            name = colander.SchemaNode(colander.String())
+            address = Address()
+            friends = Friends()
+            tags = Tags(index='hash')
+
+        self.content_type = limone.make_content_type(
+            Person, 'Person', **self.options)
+        self.appstruct = {
+            'name': u'Jack',
+            'address': {
+                'city': u'Paris',
+                'phones': [{'location': u'home', 'number': u'555-1234'},
+                           {'location': u'work', 'number': u'555-4321'}],
+            },
+            'friends': [(1, u'Fred'), (2, u'Barney')],
+            'tags': [u'a', u'b'],
+        }
+
+    def make_one(self):
+        return self.content_type(**self.appstruct)
+
+    def test_clone(self):
+        jack = self.make_one()
+        clone = jack.clone()
+        self.assertIsInstance(clone, self.content_type)
+        self.assertEqual(clone.appstruct(), self.appstruct)
+        self.assertEqual(clone.serialize(), jack.serialize())
+
+    def test_nodes_copied(self):
+        jack = self.make_one()
+        clone = jack.clone()
+        for name in ('address', 'friends', 'tags'):
+            self.assertIs(type(getattr(clone, name)),
+                          type(getattr(jack, name)))
+            self.assertIsNot(getattr(clone, name), getattr(jack, name))
+        self.assertIsNot(clone.address.phones, jack.address.phones)
+        self.assertIsNot(clone.address.phones[0], jack.address.phones[0])
+        self.assertIs(clone.address.phones.__content__, clone)
+        self.assertIs(clone.address.phones[0].__content__, clone)
+        self.assertIs(jack.address.phones[0].__content__, jack)
+
+    def test_node_got_before_change(self):
+        jack = self.make_one()
+        clone = jack.clone()
+        address = clone.address
+        phones = address.phones
+        phone = phones[0]
+        phones.insert(0, {'location': u'work', 'number': u'555-9999'})
+        phone.number = u'555-0000'
+        address.city = u'Lyon'
+        self.assertEqual(clone.address.city, u'Lyon')
+        self.assertEqual([phone.number for phone in clone.address.phones],
+                         [u'555-9999', u'555-0000', u'555-4321'])
+        self.assertEqual(jack.appstruct(), self.appstruct)
+
+    def test_replaced_node(self):
+        jack = self.make_one()
+        clone = jack.clone()
+        address = clone.address
+        clone.address = {'city': u'Nice', 'phones': []}
+        address.city = u'Lyon'
+        self.assertEqual(clone.address.city, u'Nice')
+        self.assertEqual(jack.address.city, u'Paris')
+
+    def test_apply_patch(self):
+        import colander
+        jack = self.make_one()
+        clone = jack.clone()
+        clone.apply_patch({'address.phones.0.number': u'555-0000'})
+        self.assertEqual(clone.address.phones[0].number, u'555-0000')
+        with self.assertRaises(colander.Invalid):
+            clone.apply_patch([
+                {'op': 'remove', 'path': '/address/phones/1'},
+                {'op': 'add', 'path': '/address/phones/-', 'value': {}}])
+        self.assertEqual(len(clone.address.phones), 2)
+        self.assertEqual(jack.appstruct(), self.appstruct)
+
+    def test_change_clone(self):
+        jack = self.make_one()
+        clone = jack.clone()
+        clone.name = u'Fred'
+        clone.address.city = u'Lyon'
+        clone.address.phones[0].number = u'555-0000'
+        clone.address.phones.append(
+            {'location': u'home', 'number': u'555-9999'})
+        clone.friends.append((3, u'Wilma'))
+        clone.tags.append(u'c')
+        self.assertEqual(jack.appstruct(), self.appstruct)
+        self.assertEqual(clone.name, u'Fred')
+        self.assertEqual(clone.address.city, u'Lyon')
+        self.assertEqual(clone.address.phones[0].number, u'555-0000')
+        self.assertEqual(len(clone.address.phones), 3)
+        self.assertEqual(clone.friends[2], (3, u'Wilma'))
+        self.assertIn(u'c', clone.tags)
+        self.assertNotIn(u'c', jack.tags)
+
+    def test_change_original(self):
+        jack = self.make_one()
+        clone = jack.clone()
+        jack.address.phones[1].location = u'home'
+        jack.address.phones.pop(0)
+        jack.friends[0] = (5, u'Dino')
+        jack.tags.remove(u'a')
+        self.assertEqual(clone.appstruct(), self.appstruct)
+        self.assertEqual(jack.address.phones[0].location, u'home')
+        self.assertEqual(jack.friends[0], (5, u'Dino'))
+        self.assertEqual(jack.tags.count(u'a'), 0)
+        self.assertEqual(clone.tags.count(u'a'), 1)
+
+    def test_clone_of_clone(self):
+        jack = self.make_one()
+        clone = jack.clone().clone()
+        clone.address.phones[0].location = u'work'
+        self.assertEqual(jack.appstruct(), self.appstruct)
+        self.assertEqual(clone.address.phones[0].location, u'work')
+
+    def test_node_got_before_clone(self):
+        jack = self.make_one()
+        address = jack.address
+        phone = jack.address.phones[0]
+        tags = jack.tags
+        clone = jack.clone()
+        address.city = u'Lyon'
+        phone.number = u'555-0000'
+        tags.append(u'c')
+        self.assertIs(jack.address, address)
+        self.assertEqual(jack.address.city, u'Lyon')
+        self.assertEqual(jack.address.phones[0].number, u'555-0000')
+        self.assertIn(u'c', jack.tags)
+        self.assertEqual(clone.appstruct(), self.appstruct)
+
+    def test_invalid_value(self):
+        import colander
+        clone = self.make_one().clone()
+        with self.assertRaises(colander.Invalid):
+            clone.address.phones.append({'location': u'home'})
+
+    def test_pickle(self):
+        import limone
+        import pickle
+        registry = limone.Registry()
+        registry.register_content_type(self.content_type)
+        registry.hook_import()
+        self.addCleanup(registry.unhook_import)
+        jack = self.make_one()
+        clone = pickle.loads(pickle.dumps(jack.clone(), 2))
+        self.assertEqual(clone.appstruct(), self.appstruct)
+        self.assertEqual(jack.appstruct(), self.appstruct)
+
+    def test_snapshot(self):
+        jack = self.make_one()
+        snapshot = jack.snapshot()
+        jack.address.city = u'Lyon'
+        self.assertEqual(snapshot.appstruct(), self.appstruct)
+        self.assertEqual(jack.address.city, u'Lyon')
+
+
+class ListCloneTests(CloneTests):
+    options = {'sequences': 'list'}
+
+
+class CodegenSlotsCloneTests(CloneTests):
+    options = {'codegen': True, 'layout': 'slots'}
+
+
+class TrackedCloneTests(CloneTests):
+    options = {'track_changes': True, 'lazy': True}
+
+    def test_changes_tracked(self):
+        jack = self.make_one()
+        jack.mark_clean()
+        jack.name = u'Fred'
+        clone = jack.clone()
+        self.assertEqual(clone.changed_fields(), set(['name']))
+        self.assertEqual(jack.snapshot().changed_fields(), set())
+        clone.mark_clean()
+        clone.address.phones[0].number = u'555-0000'
+        self.assertEqual(clone.changed_fields(), set(['address']))
+        self.assertEqual(jack.changed_fields(), set(['name']))
+        self.assertEqual(clone.serialize()['address']['phones'][0]['number'],
+                         u'555-0000')
+        self.assertEqual(jack.serialize()['address']['phones'][0]['number'],
+                         u'555-1234')
+
+    def test_cached_appstruct(self):
+        jack = self.make_one()
+        jack.appstruct()
+        clone = jack.clone()
+        clone.friends.append((3, u'Wilma'))
+        self.assertEqual(len(clone.appstruct()['friends']), 3)
+        self.assertEqual(len(jack.appstruct()['friends']), 2)
+
+
+class TrustedConstructionTests(unittest2.TestCase):
+    options = {}
+
+    def setUp(self):
+        import colander
+        import limone
+
+        class Friend(colander.TupleSchema):
+            rank = colander.SchemaNode(colander.Int())
+            name = colander.SchemaNode(colander.String())
+
+        class Phone(colander.MappingSchema):
+            location = colander.SchemaNode(
+                colander.String(), validator=colander.OneOf(['home', 'work']))
+            number = colander.SchemaNode(colander.String())
+
+        class Friends(colander.SequenceSchema):
+            friend = Friend()
+
+        class Phones(colander.SequenceSchema):
+            phone = Phone()
+
+        class Person(colander.MappingSchema):
+            name = colander.SchemaNode(colander.String())
+            age = colander.SchemaNode(colander.Int(),
+                                      validator=colander.Range(0, 200))
+            nickname = colander.SchemaNode(colander.String(), missing=None)
+            friends = Friends()
+            phones = Phones()
+
+        self.content_type = limone.make_content_type(
+            Person, 'Person', **self.options)
+        self.appstruct = {
+            'name': u'Jack',
+            'age': 52,
+            'nickname': None,
+            'friends': [(1, u'Fred'), (2, u'Barney')],
+            'phones': [{'location': u'home', 'number': u'555-1234'}],
+        }
+        self.mismatches = []
+
+    def on_mismatch(self, content_type, appstruct, error):
+        self.mismatches.append((content_type, appstruct, error))
+
+    def test_from_trusted_appstruct(self):
+        jack = self.content_type.from_trusted_appstruct(self.appstruct)
+        self.assertIsInstance(jack, self.content_type)
+        self.assertEqual(jack.appstruct(), self.appstruct)
+        self.assertEqual(jack.phones[0].number, u'555-1234')
+        self.assertEqual(jack.friends[1], (2, u'Barney'))
+        jack.age = 53
+        jack.phones.append({'location': u'work', 'number': u'555-4321'})
+        self.assertEqual(jack.age, 53)
+        self.assertEqual(len(jack.phones), 2)
+
+    def test_not_validated(self):
+        self.appstruct['age'] = 500
+        jack = self.content_type.from_trusted_appstruct(self.appstruct)
+        self.assertEqual(jack.age, 500)
+
+    def test_missing_values(self):
+        import colander
+        del self.appstruct['nickname']
+        del self.appstruct['phones']
+        jack = self.content_type.from_trusted_appstruct(self.appstruct)
+        self.assertEqual(jack.nickname, None)
+        self.assertEqual(list(jack.phones), [])
+
+        del self.appstruct['name']
+        with self.assertRaises(colander.Invalid) as cm:
+            self.content_type.from_trusted_appstruct(self.appstruct)
+        self.assertEqual(cm.exception.asdict(), {'name': u'Required'})
+
+    def test_unexpected_keys(self):
+        self.appstruct['phones'][0]['fax'] = u'555-0000'
+        with self.assertRaises(TypeError):
+            self.content_type.from_trusted_appstruct(self.appstruct)
+
+    def test_sampled_valid(self):
+        jack = self.content_type.from_trusted_appstruct(
+            self.appstruct, sample_rate=1.0, on_mismatch=self.on_mismatch)
+        self.assertEqual(jack.appstruct(), self.appstruct)
+        self.assertEqual(self.mismatches, [])
+
+    def test_sampled_invalid(self):
+        self.appstruct['phones'][0]['location'] = u'mobile'
+        jack = self.content_type.from_trusted_appstruct(
+            self.appstruct, sample_rate=1.0, on_mismatch=self.on_mismatch)
+        self.assertEqual(jack.phones[0].location, u'mobile')
+        [(ct, appstruct, error)] = self.mismatches
+        self.assertIs(ct, self.content_type)
+        self.assertIs(appstruct, self.appstruct)
+        self.assertEqual(error.asdict().keys(), ['phones.0.location'])
+
+    def test_sampled_changed(self):
+        self.appstruct['age'] = '52'
+        self.appstruct['phones'][0]['number'] = 5551234
+        jack = self.content_type.from_trusted_appstruct(
+            self.appstruct, sample_rate=1.0, on_mismatch=self.on_mismatch)
+        self.assertEqual(jack.age, '52')
+        [(ct, appstruct, error)] = self.mismatches
+        self.assertEqual(sorted(error.asdict().keys()), ['age', 'phones'])
+
+    def test_missing_default_validated(self):
+        import colander
+        import limone
+
+        class Schema(colander.MappingSchema):
+            count = colander.SchemaNode(colander.Int(), default='5')
+
+        ct = limone.make_content_type(Schema, 'Counter', **self.options)
+        self.assertEqual(ct.from_trusted_appstruct({}).count, 5)
+        self.assertEqual(ct.from_trusted_appstruct({}).count, ct().count)
+
+    def test_missing_default_validated_once(self):
+        import colander
+        import limone
+        calls = []
+
+        def record(node, value):
+            calls.append(value)
+
+        class Point(colander.TupleSchema):
+            x = colander.SchemaNode(colander.Int())
+            y = colander.SchemaNode(colander.Int())
+
+        class Schema(colander.MappingSchema):
+            count = colander.SchemaNode(colander.Int(), default='5',
+                                        validator=record)
+            point = Point()
+
+        ct = limone.make_content_type(Schema, 'Counter', **self.options)
+        ct.from_trusted_appstruct({'point': (1, 2)})
+        n = len(calls)
+        for i in xrange(3):
+            counter = ct.from_trusted_appstruct({'point': (1, 2)})
+            self.assertEqual(counter.count, 5)
+        self.assertEqual(len(calls), n)
+        with self.assertRaises(colander.Invalid) as cm:
+            ct.from_trusted_appstruct({})
+        self.assertEqual(cm.exception.asdict(), {'point': u'Required'})
+
+    def test_sampled_invalid_without_hook(self):
+        import colander
+        self.appstruct['age'] = 500
+        with self.assertRaises(colander.Invalid):
+            self.content_type.from_trusted_appstruct(
+                self.appstruct, sample_rate=1.0)
+
+    def test_sample_rate(self):
+        import random
+        self.appstruct['age'] = 500
+        state = random.getstate()
+        self.addCleanup(random.setstate, state)
+        random.seed(0)
+        for i in xrange(1000):
+            self.content_type.from_trusted_appstruct(
+                self.appstruct, sample_rate=0.1, on_mismatch=self.on_mismatch)
+        self.assertTrue(50 < len(self.mismatches) < 150)
+
+        del self.mismatches[:]
+        self.content_type.from_trusted_appstruct(
+            self.appstruct, on_mismatch=self.on_mismatch)
+        self.assertEqual(self.mismatches, [])
+
+
+class ListTrustedConstructionTests(TrustedConstructionTests):
+    options = {'sequences': 'list'}
+
+
+class CodegenSlotsTrustedConstructionTests(TrustedConstructionTests):
+    options = {'codegen': True, 'layout': 'slots'}
+
+
+class TrackedTrustedConstructionTests(TrustedConstructionTests):
+    options = {'track_changes': True, 'lazy': True}
+
+    def test_starts_clean(self):
+        jack = self.content_type.from_trusted_appstruct(self.appstruct)
+        self.assertEqual(jack.changed_fields(), set())
+        jack.phones[0].number = u'555-0000'
+        self.assertEqual(jack.changed_fields(), set(['phones']))
+        self.assertEqual(jack.serialize()['phones'][0]['number'],
+                         u'555-0000')
+
+
+class BatchUpdateTests(unittest2.TestCase):
+    options = {}
+
+    def setUp(self):
+        import colander
+        import limone
+
+        def valid_range(node, value):
+            if value['low'] > value['high']:
+                raise colander.Invalid(node, 'low is greater than high')
+
+        def adult_retired(node, value):
+            if value['retired'] and value['age'] < 18:
+                raise colander.Invalid(node, 'too young to retire')
+
+        class Range(colander.MappingSchema):
+            low = colander.SchemaNode(colander.Int())
+            high = colander.SchemaNode(colander.Int())
+
+        class Ranges(colander.SequenceSchema):
+            range = Range(validator=valid_range)
+
+        class Person(colander.MappingSchema):
+            name = colander.SchemaNode(colander.String())
+            age = colander.SchemaNode(colander.Int(),
+                                      validator=colander.Range(0, 200))
+            retired = colander.SchemaNode(colander.Boolean(), default=False)
+            ranges = Ranges()
+
+        self.content_type = limone.make_content_type(
+            Person(validator=adult_retired), 'Person', **self.options)
+        self.appstruct = {
+            'name': u'Jack',
+            'age': 52,
+            'retired': False,
+            'ranges': [{'low': 1, 'high': 2}],
+        }
+
+    def make_one(self):
+        return self.content_type(**self.appstruct)
+
+    def test_batch_update(self):
+        jack = self.make_one()
+        with jack.batch_update() as batch:
+            batch.name = u'Fred'
+            batch.age = '53'
+            self.assertEqual(batch.age, '53')
+            self.assertEqual(batch.retired, False)
+            self.assertEqual(jack.age, 52)
+        self.assertEqual(jack.name, u'Fred')
+        self.assertEqual(jack.age, 53)
+
+    def test_invalid_values(self):
+        import colander
+        jack = self.make_one()
+        with self.assertRaises(colander.Invalid) as cm:
+            with jack.batch_update() as batch:
+                batch.name = u'Fred'
+                batch.age = 500
+                batch.ranges = [{'low': 1}]
+        self.assertEqual(sorted(cm.exception.asdict().keys()),
+                         ['age', 'ranges.0.high'])
+        self.assertEqual(jack.appstruct(), self.appstruct)
+
+    def test_schema_validator(self):
+        import colander
+        jack = self.make_one()
+        with self.assertRaises(colander.Invalid) as cm:
+            with jack.batch_update() as batch:
+                batch.age = 12
+                batch.retired = True
+        self.assertEqual(cm.exception.msg, 'too young to retire')
+        self.assertEqual(jack.appstruct(), self.appstruct)
+
+        with jack.batch_update() as batch:
+            batch.age = 70
+            batch.retired = True
+        self.assertEqual((jack.age, jack.retired), (70, True))
+
+    def test_nested_validator(self):
+        import colander
+        jack = self.make_one()
+        ranges = jack.ranges
+        with self.assertRaises(colander.Invalid) as cm:
+            with jack.batch_update() as batch:
+                batch.ranges = [{'low': 1, 'high': 2}, {'low': 3, 'high': 1}]
+        self.assertEqual(cm.exception.asdict(),
+                         {'ranges.1': u'low is greater than high'})
+        self.assertIs(jack.ranges, ranges)
+        jack.ranges.append({'low': 5, 'high': 6})
+        self.assertEqual(len(jack.ranges), 2)
+
+    def test_validated_once(self):
+        import colander
+        import limone
+        calls = []
+
+        def record(node, value):
+            calls.append((node.name, value))
+
+        class Range(colander.MappingSchema):
+            low = colander.SchemaNode(colander.Int(), validator=record)
+            high = colander.SchemaNode(colander.Int())
+
+        class Person(colander.MappingSchema):
+            name = colander.SchemaNode(colander.String(), validator=record)
+            range = Range(validator=record)
+
+        ct = limone.make_content_type(Person(validator=record), 'Person',
+                                      **self.options)
+        jack = ct(name='Jack', range={'low': 1, 'high': 2})
+        del calls[:]
+        with jack.batch_update() as batch:
+            batch.name = 'Fred'
+            batch.range = {'low': 3, 'high': 4}
+        self.assertEqual(sorted(name for name, value in calls),
+                         ['', 'low', 'name', 'range'])
+        self.assertEqual(jack.range.low, 3)
+
+    def test_exception_in_block(self):
+        jack = self.make_one()
+        with self.assertRaises(KeyError):
+            with jack.batch_update() as batch:
+                batch.name = u'Fred'
+                raise KeyError('name')
+        self.assertEqual(jack.name, u'Jack')
+
+    def test_unknown_attribute(self):
+        jack = self.make_one()
+        with jack.batch_update() as batch:
+            with self.assertRaises(AttributeError):
+                batch.nickname = u'Jacko'
+        self.assertFalse(hasattr(jack, 'nickname'))
+
+
+class CodegenSlotsBatchUpdateTests(BatchUpdateTests):
+    options = {'codegen': True, 'layout': 'slots'}
+
+
+class TrackedBatchUpdateTests(BatchUpdateTests):
+    options = {'track_changes': True, 'lazy': True, 'sequences': 'list'}
+
+    def test_rollback_changed_fields(self):
+        import colander
+        jack = self.make_one()
+        jack.mark_clean()
+        jack.appstruct()
+        with self.assertRaises(colander.Invalid):
+            with jack.batch_update() as batch:
+                batch.name = u'Fred'
+                batch.ranges = [{'low': 3, 'high': 1}]
+        self.assertEqual(jack.changed_fields(), set())
+        self.assertEqual(jack.appstruct(), self.appstruct)
+        jack.ranges[0].low = 0
+        self.assertEqual(jack.changed_fields(), set(['ranges']))
+        self.assertEqual(jack.serialize()['ranges'][0]['low'], '0')
+
+
+class ApplyPatchTests(unittest2.TestCase):
+    options = {}
+
+    def setUp(self):
+        import colander
+        import limone
+
+        class Friend(colander.TupleSchema):
+            rank = colander.SchemaNode(colander.Int(),
+                                       validator=colander.Range(0, 9999))
+            name = colander.SchemaNode(colander.String())
+
+        class Phone(colander.MappingSchema):
+            location = colander.SchemaNode(
+                colander.String(), validator=colander.OneOf(['home', 'work']))
+            number = colander.SchemaNode(colander.String())
+
+        class Friends(colander.SequenceSchema):
+            friend = Friend()
+
+        class Phones(colander.SequenceSchema):
+            phone = Phone()
+
+        class Tags(colander.SequenceSchema):
+            tag = colander.SchemaNode(colander.String())
+
+        class Person(colander.MappingSchema):
+            name = colander.SchemaNode(colander.String())
+            age = colander.SchemaNode(colander.Int(),
+                                      validator=colander.Range(0, 200))
+            nickname = colander.SchemaNode(colander.String(), missing=None)
+            friends = Friends()
+            phones = Phones()
+            tags = Tags(index='hash')
+
+        self.content_type = limone.make_content_type(
+            Person, 'Person', **self.options)
+        self.appstruct = {
+            'name': u'Jack',
+            'age': 52,
+            'nickname': u'Jacko',
+            'friends': [(1, u'Fred'), (2, u'Barney')],
+            'phones': [{'location': u'home', 'number': u'555-1234'},
+                       {'location': u'work', 'number': u'555-4321'}],
+            'tags': [u'a', u'b'],
+        }
+
+    def make_one(self):
+        return self.content_type(**self.appstruct)
+
+    def test_replace(self):
+        jack = self.make_one()
+        phones = jack.phones
+        phone = jack.phones[0]
+        jack.apply_patch([
+            {'op': 'replace', 'path': '/age', 'value': '53'},
+            {'op': 'replace', 'path': '/phones/1/number', 'value': u'555'},
+            {'op': 'replace', 'path': 'friends.0.1', 'value': u'Dino'},
+            {'op': 'replace', 'path': 'tags.0', 'value': u'c'},
+        ])
+        self.assertEqual(jack.age, 53)
+        self.assertEqual(jack.phones[1].number, u'555')
+        self.assertEqual(jack.friends[0], (1, u'Dino'))
+        self.assertEqual(list(jack.tags), [u'c', u'b'])
+        self.assertNotIn(u'a', jack.tags)
+        self.assertIs(jack.phones, phones)
+        self.assertIs(jack.phones[0], phone)
+
+    def test_dotted_paths(self):
+        jack = self.make_one()
+        jack.apply_patch({'phones.0.location': u'work', 'name': u'Fred'})
+        self.assertEqual(jack.phones[0].location, u'work')
+        self.assertEqual(jack.name, u'Fred')
+
+    def test_add_and_remove(self):
+        jack = self.make_one()
+        jack.apply_patch([
+            {'op': 'add', 'path': '/phones/-',
+             'value': {'location': u'home', 'number': u'555-0000'}},
+            {'op': 'add', 'path': '/tags/0', 'value': u'z'},
+            {'op': 'remove', 'path': '/phones/0'},
+            {'op': 'remove', 'path': '/nickname'},
+        ])
+        self.assertEqual([phone.number for phone in jack.phones],
+                         [u'555-4321', u'555-0000'])
+        self.assertEqual(list(jack.tags), [u'z', u'a', u'b'])
+        self.assertEqual(jack.tags.index(u'b'), 2)
+        self.assertEqual(jack.nickname, None)
+
+    def test_move_copy_and_test(self):
+        jack = self.make_one()
+        jack.apply_patch([
+            {'op': 'test', 'path': '/phones/1/location', 'value': u'work'},
+            {'op': 'move', 'from': '/phones/1', 'path': '/phones/0'},
+            {'op': 'copy', 'from': '/phones/0', 'path': '/phones/-'},
+        ])
+        self.assertEqual([phone.location for phone in jack.phones],
+                         [u'work', u'home', u'work'])
+
+    def test_invalid_value(self):
+        import colander
+        jack = self.make_one()
+        with self.assertRaises(colander.Invalid) as cm:
+            jack.apply_patch([
+                {'op': 'replace', 'path': '/age', 'value': 53},
+                {'op': 'add', 'path': '/tags/-', 'value': u'c'},
+                {'op': 'remove', 'path': '/phones/0'},
+                {'op': 'replace', 'path': '/phones/0/location',
+                 'value': u'mobile'},
+            ])
+        self.assertEqual(cm.exception.asdict().keys(),
+                         ['phones.0.location'])
+        self.assertEqual(jack.appstruct(), self.appstruct)
+        self.assertEqual(jack.tags.count(u'c'), 0)
+
+    def test_invalid_item(self):
+        import colander
+        jack = self.make_one()
+        with self.assertRaises(colander.Invalid) as cm:
+            jack.apply_patch([
+                {'op': 'add', 'path': '/phones/1',
+                 'value': {'location': u'home'}},
+            ])
+        self.assertEqual(cm.exception.asdict().keys(), ['phones.1.number'])
+        with self.assertRaises(colander.Invalid) as cm:
+            jack.apply_patch({'/friends/1/0': -1})
+        self.assertEqual(cm.exception.asdict().keys(), ['friends.1.0'])
+        self.assertEqual(jack.appstruct(), self.appstruct)
+
+    def test_bad_operations(self):
+        jack = self.make_one()
+        for patch in (
+            [{'op': 'replace', 'path': '/phones/5/number', 'value': u'5'}],
+            [{'op': 'replace', 'path': '/address', 'value': u'5'}],
+            [{'op': 'replace', 'path': '/name/first', 'value': u'5'}],
+            [{'op': 'replace', 'path': '', 'value': {}}],
+            [{'op': 'add', 'path': '/friends/0/2', 'value': u'5'}],
+            [{'op': 'replace', 'path': '/name'}],
+            [{'op': 'frobnicate', 'path': '/name'}],
+            [{'path': '/name'}],
+            [{'op': 'replace', 'path': '/name', 'value': u'Fred'},
+             {'op': 'test', 'path': '/name', 'value': u'Jack'}],
+        ):
+            with self.assertRaises(ValueError):
+                jack.apply_patch(patch)
+        self.assertEqual(jack.appstruct(), self.appstruct)
+
+
+class ListApplyPatchTests(ApplyPatchTests):
+    options = {'sequences': 'list'}
+
+
+class CodegenSlotsApplyPatchTests(ApplyPatchTests):
+    options = {'codegen': True, 'layout': 'slots'}
+
+
+class TrackedApplyPatchTests(ApplyPatchTests):
+    options = {'track_changes': True, 'lazy': True}
+
+    def test_changes_tracked(self):
+        jack = self.make_one()
+        jack.mark_clean()
+        jack.serialize()
+        jack.apply_patch({'phones.1.number': u'555'})
+        self.assertEqual(jack.changed_fields(), set(['phones']))
+        self.assertEqual(jack.serialize()['phones'][1]['number'], u'555')
+
+    def test_rollback_changed_fields(self):
+        import colander
+        jack = self.make_one()
+        jack.mark_clean()
+        jack.serialize()
+        with self.assertRaises(colander.Invalid):
+            jack.apply_patch([
+                {'op': 'remove', 'path': '/phones/0'},
+                {'op': 'replace', 'path': '/age', 'value': -1},
+            ])
+        self.assertEqual(jack.changed_fields(), set())
+        self.assertEqual(jack.appstruct(), self.appstruct)
+        jack.phones[0].number = u'555'
+        self.assertEqual(jack.changed_fields(), set(['phones']))
+        self.assertEqual(jack.serialize()['phones'][0]['number'], u'555')
+
 
 import colander
 import limone